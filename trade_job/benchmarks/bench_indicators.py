@@ -0,0 +1,54 @@
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+from src.indicators import SMA, EMA, RollingStd, VWAP
+from src.trade_helper import calculate_rolling_average
+
+# Compares the cost of bringing a window average up to date for one new bar: recomputing it with pandas the way
+# run_trade_job used to against one update of the incremental accumulators.
+# Run from trade_job/: python -m benchmarks.bench_indicators [window_length]
+
+
+def bench_pandas(closes, window_length, updates):
+    series = pd.Series(closes)
+
+    def run():
+        for end in range(window_length, window_length + updates):
+            window = series.iloc[end - window_length:end]
+            calculate_rolling_average(window, len(window)).iloc[-1]
+    return timeit.timeit(run, number=1) / updates
+
+
+def bench_indicator(indicator, closes, volumes, window_length, updates):
+    values = closes.tolist()
+    weights = volumes.tolist()
+    # Fill the window first so every timed update also evicts a value
+    for i in range(window_length):
+        indicator.update(values[i], i, weights[i])
+
+    def run():
+        for i in range(window_length, window_length + updates):
+            indicator.update(values[i], i, weights[i])
+    return timeit.timeit(run, number=1) / updates
+
+
+def main(window_length=60, updates=20000):
+    generator = np.random.default_rng(0)
+    closes = 190 + np.cumsum(generator.normal(0, 0.05, window_length + updates))
+    volumes = generator.integers(100, 5000, window_length + updates).astype(float)
+
+    pandas_time = bench_pandas(closes, window_length, min(updates, 2000))
+    print(f"window length {window_length}")
+    print(f"pandas rolling mean per update: {pandas_time * 1e6:10.2f} us")
+    for name, indicator in (("SMA", SMA(window_length)),
+                            ("EMA", EMA(window_length)),
+                            ("RollingStd", RollingStd(window_length)),
+                            ("VWAP", VWAP(window_length))):
+        update_time = bench_indicator(indicator, closes, volumes, window_length, updates)
+        print(f"{name:>10} per update: {update_time * 1e6:10.2f} us "
+              f"({pandas_time / update_time:,.0f}x faster than pandas)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,80 @@
+import datetime
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from alpaca.data.requests import StockBarsRequest
+from alpaca.data.timeframe import TimeFrame
+from alpaca.trading.requests import GetOrdersRequest, MarketOrderRequest
+import src.trade_run
+from src.broker_simulator import BrokerSimulator
+from src.clock import use_clock
+from src.state_store import InMemoryStateStore
+from test.data.fakes import BAR_START as START, make_random_walk_bars
+
+# Load tests against the broker simulator: the request rate it serves from several threads, and a full job of
+# start_trade_run calls on the simulated market clock, optionally with injected server errors.
+# Run from trade_job/: python -m benchmarks.bench_simulator [requests] [threads] [runs] [error_rate]
+
+def bench_requests(simulator, requests, threads):
+    # A mix of the calls a run makes: one order, one position check, one orders page and one bars request
+    order = MarketOrderRequest(symbol="AAPL", qty=1, side="buy", time_in_force="day")
+    orders_page = GetOrdersRequest(status="all", symbols=["AAPL"], limit=50)
+    bars = StockBarsRequest(symbol_or_symbols="AAPL", timeframe=TimeFrame.Minute,
+                            start=START, end=START + datetime.timedelta(minutes=30))
+    calls = [lambda: simulator.submit_order(order),
+             lambda: simulator.get_all_positions(),
+             lambda: simulator.get_orders(orders_page),
+             lambda: simulator.get_stock_bars(bars)]
+
+    def call(i):
+        calls[i % len(calls)]()
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(call, range(requests)))
+    return requests / (time.perf_counter() - started_at)
+
+
+def bench_job(simulator, runs):
+    event = {
+        "jobParameters": {"windowLength": 5, "symbol": "AAPL", "maxRuns": runs + 1, "offsetTime": 1,
+                          "stopLoss": -1000, "takeProfit": 1000},
+        "jobInfo": "2024-08-02T13:30:00.000Z",
+        "jobStatus": {"cancelTradeJob": 0, "runCount": 0}
+    }
+    src.trade_run.get_clients = simulator.clients
+    src.trade_run.state_store = InMemoryStateStore()
+    failed_runs = 0
+    started_at = time.perf_counter()
+    with use_clock(simulator.now):
+        for _ in range(runs):
+            try:
+                event["jobStatus"] = src.trade_run.start_trade_run(event, None)
+            except Exception:
+                # The Step Function would retry the failed run on the next tick
+                failed_runs += 1
+            simulator.advance()
+    return time.perf_counter() - started_at, failed_runs
+
+
+def main(requests=20000, threads=8, runs=540, error_rate=0.0):
+    bars = make_random_walk_bars(["AAPL", "MSFT"], minutes=int(runs) + 60)
+    rate = bench_requests(BrokerSimulator(bars, start=START + datetime.timedelta(minutes=30)),
+                          int(requests), int(threads))
+    print(f"simulator served {rate:,.0f} requests/s from {threads} threads")
+
+    simulator = BrokerSimulator(bars, start=START + datetime.timedelta(minutes=30), error_rate=float(error_rate))
+    held_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        elapsed, failed_runs = bench_job(simulator, int(runs))
+    finally:
+        sys.stdout = held_stdout
+    print(f"{runs} runs took {elapsed:.2f}s ({elapsed / int(runs) * 1000:.1f}ms per run), {failed_runs} failed, "
+          f"realized profit/loss {simulator.realized_pl:.2f}")
+    print(f"broker requests: {dict(simulator.requests)}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
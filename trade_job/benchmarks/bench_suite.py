@@ -0,0 +1,192 @@
+import collections
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+import uuid
+from io import StringIO
+import pandas as pd
+import src.trade_run
+from src.broker_simulator import BrokerSimulator
+from src.clock import use_clock
+from src.indicators import SMA
+from src.order_store import OrderStore
+from src.state_store import InMemoryStateStore
+from src.trade_helper import (
+    calculate_realized_pl,
+    calculate_rolling_average,
+    filter_for_order_side,
+    filter_for_order_status,
+    update_close_average
+)
+from test.data.fakes import BAR_START, make_bars, place_orders
+
+# Times start_trade_run end to end against the broker simulator, and the order and rolling average helpers on
+# 10 to 1,000,000 orders or bars. Results are written to a JSON file; pass the file from an earlier commit as the
+# baseline to print how each timing has changed.
+# Run from trade_job/: python -m benchmarks.bench_suite [output] [baseline] [max_size] [runs] [latency_ms]
+
+SIZES = (10, 100, 1000, 10000, 100000, 1000000)
+WINDOW_LENGTH = 30
+# A timing this much slower than the baseline is flagged
+REGRESSION_RATIO = 1.2
+# The fields of alpaca.trading.models.Order the order helpers read, without building a pydantic model for each of a
+# million orders
+BenchOrder = collections.namedtuple(
+    "BenchOrder", ["id", "symbol", "side", "status", "qty", "filled_qty", "filled_avg_price", "submitted_at"])
+
+EVENT = {
+    "jobParameters": {
+        "windowLength": WINDOW_LENGTH,
+        "symbol": "AAPL",
+        "maxRuns": 100000,
+        "offsetTime": 16,
+        "stopLoss": -1000000,
+        "takeProfit": 1000000
+    },
+    "jobInfo": "2024-08-02T13:30:00.000Z",
+    "jobStatus": {"cancelTradeJob": 0, "runCount": 0}
+}
+
+
+def best_of(function, repeats):
+    # The fastest of a few runs is the least disturbed by whatever else the machine is doing
+    return min(timeit.repeat(function, number=1, repeat=repeats))
+
+
+def make_orders(count, symbol="AAPL", seed=0, start=BAR_START):
+    generator = random.Random(seed)
+    orders = []
+    for i in range(count):
+        status = generator.choices(("filled", "canceled", "new", "partially_filled"), (70, 15, 10, 5))[0]
+        filled_qty = {"filled": "1", "partially_filled": "0.5"}.get(status, "0")
+        orders.append(BenchOrder(uuid.UUID(int=generator.getrandbits(128)),
+                                 symbol,
+                                 generator.choice(("buy", "sell")),
+                                 status,
+                                 "1",
+                                 filled_qty,
+                                 f"{190 + generator.uniform(-5, 5):.2f}" if filled_qty != "0" else None,
+                                 start + datetime.timedelta(seconds=i)))
+    return orders
+
+
+def bench_trade_runs(runs, latency, orders):
+    # Consecutive runs of one job sharing a state store, as the step function would make them, a minute apart on the
+    # simulator's market clock. The job has already placed `orders` orders before the first run.
+    start = BAR_START + datetime.timedelta(minutes=2 * WINDOW_LENGTH)
+    simulator = BrokerSimulator(make_bars(minutes=2 * WINDOW_LENGTH + runs + 2, volume=orders + 100), start=start)
+    place_orders(simulator, orders)
+    simulator.latency = latency
+    src.trade_run.get_clients = simulator.clients
+    src.trade_run.state_store = InMemoryStateStore()
+    event = json.loads(json.dumps(EVENT))
+    timings = []
+    with use_clock(simulator.now):
+        for _ in range(runs):
+            started_at = timeit.default_timer()
+            result = src.trade_run.start_trade_run(event, None)
+            timings.append(timeit.default_timer() - started_at)
+            event["jobStatus"] = result
+            simulator.advance()
+    timings.sort()
+    return {
+        "runs": runs,
+        "median": statistics.median(timings),
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "calls": dict(simulator.requests)
+    }
+
+
+def bench_helpers(sizes, repeats=3):
+    results = []
+    for size in sizes:
+        orders = make_orders(size)
+        # The helpers convert a list of orders on every call, so the conversion is timed on its own
+        order_store = OrderStore.from_orders(orders)
+        bars = make_bars(minutes=size)
+        timestamps = bars.index.get_level_values("timestamp").asi8.tolist()
+        closes = bars["close"].tolist()
+        series = pd.Series(closes)
+        timings = {
+            "OrderStore.from_orders": best_of(lambda: OrderStore.from_orders(orders), repeats),
+            "calculate_realized_pl": best_of(lambda: calculate_realized_pl(
+                filter_for_order_status(order_store, "filled")), repeats),
+            "filter_for_order_status": best_of(lambda: filter_for_order_status(order_store, "filled"), repeats),
+            "filter_for_order_side": best_of(lambda: filter_for_order_side(order_store, "buy"), repeats),
+            "update_close_average": best_of(lambda: update_close_average(
+                SMA(WINDOW_LENGTH + 1, min_periods=1), timestamps, closes), repeats),
+            "calculate_rolling_average": best_of(
+                lambda: calculate_rolling_average(series, WINDOW_LENGTH).iloc[-1], repeats)
+        }
+        for name, seconds in timings.items():
+            results.append({"name": name, "size": size, "seconds": seconds})
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return f"{result['name']}[{result['size']}]"
+
+
+def compare(results, baseline):
+    previous = {result_key(result): result["seconds"] for result in baseline["results"]}
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('created_at')}):")
+    for result in results:
+        before = previous.get(result_key(result))
+        if not before:
+            continue
+        ratio = result["seconds"] / before
+        flag = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+        print(f"{result_key(result):>40} {before * 1000:12.3f}ms -> {result['seconds'] * 1000:12.3f}ms "
+              f"({ratio:5.2f}x){flag}")
+
+
+def main(output="benchmark_results.json", baseline=None, max_size=1000000, runs=50, latency_ms=0):
+    sizes = [size for size in SIZES if size <= int(max_size)]
+    held_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        first_run = bench_trade_runs(1, int(latency_ms) / 1000, 1000)
+        trade_runs = bench_trade_runs(int(runs), int(latency_ms) / 1000, 1000)
+    finally:
+        sys.stdout = held_stdout
+    results = [
+        {"name": "start_trade_run_first", "size": 1, "seconds": first_run["median"]},
+        {"name": "start_trade_run", "size": int(runs), "seconds": trade_runs["median"]},
+        {"name": "start_trade_run_p95", "size": int(runs), "seconds": trade_runs["p95"]}
+    ]
+    results += bench_helpers(sizes)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "latency_ms": int(latency_ms),
+        "broker_calls": trade_runs["calls"],
+        "results": results
+    }
+    with open(output, "w") as results_file:
+        json.dump(report, results_file, indent=2)
+
+    for result in results:
+        print(f"{result_key(result):>40} {result['seconds'] * 1000:12.3f}ms")
+    print(f"\nResults written to {output}")
+    if baseline:
+        with open(baseline) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
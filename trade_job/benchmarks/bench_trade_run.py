@@ -0,0 +1,70 @@
+import datetime
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import src.concurrency
+import src.trade_run
+from src.broker_simulator import BrokerSimulator
+from src.clock import use_clock
+from src.state_store import InMemoryStateStore
+from test.data.fakes import BAR_START, make_bars
+
+# Times run_trade_job against the broker simulator with a fixed latency on each kind of call. It compares the orders,
+# position and bars calls made one after another (a single worker) against the same calls made at the same time.
+# Run from trade_job/: python -m benchmarks.bench_trade_run [orders_ms] [position_ms] [bars_ms]
+
+EVENT = {
+    "jobParameters": {
+        "windowLength": 5,
+        "symbol": "AAPL",
+        "maxRuns": 540,
+        "offsetTime": 16,
+        "stopLoss": -1000,
+        "takeProfit": 1000
+    },
+    "jobInfo": "2024-08-02T13:30:00.000Z",
+    "jobStatus": {"cancelTradeJob": 0, "runCount": 1}
+}
+
+
+def make_simulator(orders_latency, position_latency, bars_latency):
+    return BrokerSimulator(make_bars(minutes=30), start=BAR_START + datetime.timedelta(minutes=20),
+                           latency={"get_orders": orders_latency, "get_open_position": position_latency,
+                                    "get_stock_bars": bars_latency})
+
+
+def time_run(latencies, max_workers, repeats=5):
+    src.concurrency.executor = ThreadPoolExecutor(max_workers=max_workers)
+    # Without the shared bar cache, which would answer the repeats' bars requests without a call
+    src.trade_run.shared_bar_cache = None
+    timings = []
+    for _ in range(repeats):
+        # A fresh state store each time, so every run reads the orders and the full window of bars again
+        src.trade_run.state_store = InMemoryStateStore()
+        simulator = make_simulator(*latencies)
+        with use_clock(simulator.now):
+            started_at = time.perf_counter()
+            src.trade_run.run_trade_job(EVENT, simulator, simulator)
+            timings.append(time.perf_counter() - started_at)
+    src.concurrency.executor.shutdown()
+    return min(timings)
+
+
+def main(orders_ms=150, position_ms=100, bars_ms=200):
+    latencies = [int(orders_ms) / 1000, int(position_ms) / 1000, int(bars_ms) / 1000]
+    held_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        sequential = time_run(latencies, max_workers=1)
+        concurrent = time_run(latencies, max_workers=3)
+    finally:
+        sys.stdout = held_stdout
+    print(f"injected latency: orders {orders_ms}ms, position {position_ms}ms, bars {bars_ms}ms "
+          f"(sum {sum(latencies) * 1000:.0f}ms, slowest {max(latencies) * 1000:.0f}ms)")
+    print(f"sequential run: {sequential * 1000:8.1f}ms")
+    print(f"concurrent run: {concurrent * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
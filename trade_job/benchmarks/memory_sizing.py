@@ -0,0 +1,88 @@
+import datetime
+import json
+import sys
+import tempfile
+from io import StringIO
+import src.trade_run
+from src.bar_store import BarStore
+from src.broker_simulator import BrokerSimulator
+from src.clock import use_clock
+from src.memory_profiler import memory_profile_scope, recommend_memory_mb
+from src.startup_profiler import profile_imports
+from src.state_store import InMemoryStateStore
+from test.data.fakes import BAR_START, make_bars, place_orders
+
+# Profiles the memory of cold start_trade_run and start_batch_trade_run calls against the broker simulator over a
+# range of order and bar counts, and recommends a Lambda memory size for the largest. The simulator serves orders as
+# alpaca-py Order models, so their pydantic overhead is counted.
+# Run from trade_job/: python -m benchmarks.memory_sizing [order_counts] [bar_counts] [batch_symbols]
+# e.g. python -m benchmarks.memory_sizing 100,1000,10000 30,390 10
+
+BATCH_SYMBOLS = ["AAPL", "MSFT", "TSLA", "AMZN", "GOOG", "META", "NVDA", "AMD", "INTC", "NFLX"]
+
+
+def make_event(symbols, bars):
+    parameters = {"windowLength": bars, "maxRuns": 100000, "offsetTime": 16, "stopLoss": -1000000,
+                  "takeProfit": 1000000}
+    if isinstance(symbols, list):
+        parameters["symbols"] = symbols
+    else:
+        parameters["symbol"] = symbols
+    return {"jobParameters": parameters, "jobInfo": "2024-08-02T13:30:00.000Z",
+            "jobStatus": {"cancelTradeJob": 0, "runCount": 0}}
+
+
+def profile_run(handler, event, orders, directory):
+    # A cold run: nothing in the state store or bar store, so every order since the job started is read
+    symbols = event["jobParameters"].get("symbols") or [event["jobParameters"]["symbol"]]
+    bars = event["jobParameters"]["windowLength"]
+    simulator = BrokerSimulator(make_bars(symbols, minutes=bars + 3, volume=orders + 100),
+                                start=BAR_START + datetime.timedelta(minutes=bars + 1))
+    place_orders(simulator, orders)
+    src.trade_run.get_clients = simulator.clients
+    src.trade_run.state_store = InMemoryStateStore()
+    src.trade_run.bar_store = BarStore(directory)
+    src.trade_run.shared_bar_cache = None
+    held_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        with use_clock(simulator.now), memory_profile_scope(enabled=True, emit=False) as profile:
+            handler(event, None)
+    finally:
+        sys.stdout = held_stdout
+    return profile
+
+
+def sweep(order_counts, bar_counts, batch_symbols):
+    results = []
+    for orders in order_counts:
+        for bars in bar_counts:
+            for name, handler, symbols in [("single", src.trade_run.start_trade_run, "AAPL"),
+                                           ("batch", src.trade_run.start_batch_trade_run, batch_symbols)]:
+                with tempfile.TemporaryDirectory() as directory:
+                    profile = profile_run(handler, make_event(symbols, bars), orders, directory)
+                results.append({"handler": name, "orders": orders, "bars": bars, "peak_kb": profile.peak_kb,
+                                "heaviest_phase": profile.heaviest_phase, "top_sites": profile.top_sites[:3]})
+                print(f"{name:>6} {orders:>8} orders {bars:>6} bars: peak {profile.peak_kb / 1024:8.1f}MB "
+                      f"(heaviest phase {profile.heaviest_phase})")
+    return results
+
+
+def main(order_counts="100,1000,10000", bar_counts="30,390", batch_symbols=10, output=None):
+    order_counts = [int(count) for count in str(order_counts).split(",")]
+    bar_counts = [int(count) for count in str(bar_counts).split(",")]
+    results = sweep(order_counts, bar_counts, BATCH_SYMBOLS[:int(batch_symbols)])
+
+    baseline_kb = profile_imports("src.trade_run")["peak_memory_kb"]
+    largest = max(results, key=lambda result: result["peak_kb"])
+    recommended = recommend_memory_mb(baseline_kb, largest["peak_kb"])
+    print(f"\nImporting src.trade_run takes {baseline_kb / 1024:.1f}MB. The largest run ({largest['handler']}, "
+          f"{largest['orders']} orders, {largest['bars']} bars) peaked at {largest['peak_kb'] / 1024:.1f}MB more.")
+    print(f"Recommended Lambda memory size: {recommended}MB")
+    if output:
+        with open(output, "w") as f:
+            json.dump({"baseline_kb": baseline_kb, "recommended_mb": recommended, "runs": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
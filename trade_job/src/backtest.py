@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+
+
+def prepare_bars(bars):
+    # Accepts the (symbol, timestamp) indexed frame returned by get_stock_data for a single symbol
+    if isinstance(bars.index, pd.MultiIndex):
+        bars = bars.droplevel("symbol")
+    bars = bars.sort_index()
+    timestamps = pd.DatetimeIndex(bars.index)
+    return timestamps, bars["close"].to_numpy(dtype=np.float64)
+
+
+def close_prefix_sums(closes):
+    prefix_sums = np.empty(len(closes) + 1, dtype=np.float64)
+    prefix_sums[0] = 0
+    np.cumsum(closes, out=prefix_sums[1:])
+    return prefix_sums
+
+
+def shift_right(values):
+    shifted = np.zeros_like(values)
+    shifted[1:] = values[:-1]
+    return shifted
+
+
+def backtest_arrays(timestamps_ns, closes, prefix_sums, window_length, offset, take_profit=None, stop_loss=None,
+                    max_runs=None):
+    # A run is made at every bar. It evaluates the window of bars [t - offset - windowLength, t - offset] and trades
+    # at the close of bar t, the same as start_trade_run with offsetTime and windowLength in minutes. Both ends are
+    # included, as in the bars request, so a full window holds windowLength + 1 bars.
+    window_end = timestamps_ns - offset * NANOSECONDS_PER_MINUTE
+    end_index = np.searchsorted(timestamps_ns, window_end, side="right")
+    start_index = np.searchsorted(timestamps_ns, window_end - window_length * NANOSECONDS_PER_MINUTE, side="left")
+    bar_counts = end_index - start_index
+    has_bars = bar_counts > 0
+
+    mean_price = np.full(len(closes), np.nan)
+    last_price = np.full(len(closes), np.nan)
+    mean_price[has_bars] = (prefix_sums[end_index[has_bars]] - prefix_sums[start_index[has_bars]]) \
+        / bar_counts[has_bars]
+    last_price[has_bars] = closes[end_index[has_bars] - 1]
+
+    buy = has_bars & (mean_price < last_price)
+    sell_signal = has_bars & (mean_price > last_price)
+    if max_runs is not None and 0 < max_runs <= len(closes):
+        # As in start_trade_run, the final run closes the position rather than buying into it
+        buy[max_runs - 1] = False
+
+    # Every sell closes the whole position, so holdings restart from zero after each sell signal
+    bought = np.cumsum(buy)
+    position_after = bought - np.maximum.accumulate(np.where(sell_signal, bought, 0))
+    position_before = shift_right(position_after)
+    sell = sell_signal & (position_before > 0)
+
+    buy_notional = np.cumsum(np.where(buy, closes, 0.0))
+    cost_basis_after = buy_notional - np.maximum.accumulate(np.where(sell_signal, buy_notional, 0.0))
+    cash_after = np.cumsum(np.where(sell, position_before * closes, 0.0)) - buy_notional
+    cash_before = shift_right(cash_after)
+
+    # The profit/loss limits are checked on the holdings carried into the run, before any decision is made
+    theoretical_pl_before = cash_before + position_before * closes
+    limit_reached = np.zeros(len(closes), dtype=bool)
+    if take_profit is not None:
+        limit_reached |= theoretical_pl_before >= take_profit
+    if stop_loss is not None:
+        limit_reached |= theoretical_pl_before <= stop_loss
+
+    run_count = len(closes)
+    stopped_by = None
+    if max_runs is not None and max_runs < run_count:
+        run_count = max_runs
+        stopped_by = "max_runs"
+    if limit_reached[:run_count].any():
+        run_count = int(np.argmax(limit_reached))
+        stopped_by = "profit_loss_limit"
+
+    # A limit stop closes the position without a decision being made on that bar
+    decided = np.arange(len(closes)) < run_count
+    buy &= decided
+    sell &= decided
+    position_after = np.where(decided, position_after, 0)
+    cost_basis_after = np.where(decided, cost_basis_after, 0.0)
+    cash_after = np.where(decided, cash_after, 0.0)
+
+    realized_pl = cash_after + cost_basis_after
+    unrealized_pl = position_after * closes - cost_basis_after
+
+    final_pl = 0.0
+    if stopped_by == "profit_loss_limit":
+        final_pl = theoretical_pl_before[run_count]
+    elif run_count > 0:
+        # The last run closes any open position at that bar's close
+        final_pl = realized_pl[run_count - 1] + unrealized_pl[run_count - 1]
+
+    return {
+        "mean_price": mean_price,
+        "last_price": last_price,
+        "buy": buy,
+        "sell": sell,
+        "position": position_after,
+        "realized_pl": realized_pl,
+        "unrealized_pl": unrealized_pl,
+        "run_count": run_count,
+        "stopped_by": stopped_by,
+        "final_pl": float(final_pl)
+    }
+
+
+def run_backtest(bars, window_length, offset, take_profit=None, stop_loss=None, max_runs=None):
+    timestamps, closes = prepare_bars(bars)
+    result = backtest_arrays(timestamps.asi8, closes, close_prefix_sums(closes), window_length, offset,
+                             take_profit, stop_loss, max_runs)
+
+    run_count = result["run_count"]
+    runs = pd.DataFrame({
+        "price": closes,
+        "mean_price": result["mean_price"],
+        "last_price": result["last_price"],
+        "buy": result["buy"],
+        "sell": result["sell"],
+        "position": result["position"],
+        "realized_pl": result["realized_pl"],
+        "unrealized_pl": result["unrealized_pl"]
+    }, index=timestamps)[:run_count]
+    summary = {
+        "runs": run_count,
+        "buys": int(result["buy"].sum()),
+        "sells": int(result["sell"].sum()),
+        "stopped_by": result["stopped_by"],
+        "final_pl": result["final_pl"]
+    }
+    return runs, summary
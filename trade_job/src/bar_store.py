@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from src.constants import BAR_COLUMNS, BAR_STORE_DIR
+from src.trade_helper import empty_bars, to_epoch_ns, from_epoch_ns
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+NANOSECONDS_PER_DAY = 24 * 60 * NANOSECONDS_PER_MINUTE
+
+
+def to_ns(time):
+    if isinstance(time, (int, np.integer)):
+        return int(time)
+    return to_epoch_ns(pd.Timestamp(time).to_pydatetime())
+
+
+def subtract_intervals(start, end, intervals):
+    # Parts of the inclusive range [start, end] that none of the sorted, merged intervals cover
+    missing = []
+    for covered_start, covered_end in intervals:
+        if covered_end < start:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > start:
+            missing.append((start, covered_start - 1))
+        start = max(start, covered_end + 1)
+    if start <= end:
+        missing.append((start, end))
+    return missing
+
+
+def merge_interval(intervals, start, end):
+    merged = []
+    for covered_start, covered_end in sorted(intervals + [[start, end]]):
+        if merged and covered_start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], covered_end)
+        else:
+            merged.append([covered_start, covered_end])
+    return merged
+
+
+def covered_end(end, timestamps=None):
+    # A minute's bar is only published once the minute is over, so a range ending part way through a minute (or
+    # as it starts) only covers that minute if its bar arrived. Later minutes can be covered by a newer bar.
+    covered = end - end % NANOSECONDS_PER_MINUTE - 1
+    if timestamps is not None and len(timestamps):
+        covered = max(covered, int(timestamps.max()))
+    return min(end, covered)
+
+
+def columns_from_frame(bars):
+    # Accepts the (symbol, timestamp) indexed frame returned by fetch_bars. Returns, for each symbol, the epoch
+    # nanosecond timestamps and a (column, bar) array of the BAR_COLUMNS values.
+    columns = {}
+    if bars.empty:
+        return columns
+    for symbol, symbol_bars in bars.groupby(level="symbol"):
+        timestamps = pd.DatetimeIndex(symbol_bars.index.get_level_values("timestamp")).asi8
+        values = np.ascontiguousarray(symbol_bars[BAR_COLUMNS].to_numpy(dtype=np.float64).T)
+        columns[symbol] = (timestamps, values)
+    return columns
+
+
+class BarStore:
+    # Minute bars kept on disk as one NumPy file per symbol and UTC day, laid out by column: a row of sorted
+    # timestamps followed by a row for each of BAR_COLUMNS. Range reads memory-map the file, binary search the
+    # timestamp row and copy out only the requested slice of each row, so just the pages holding those bars are
+    # read. The time ranges already fetched are recorded per symbol, including minutes that had no trades, so
+    # they are not requested again.
+
+    def __init__(self, directory=BAR_STORE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.stats = {"fetches": 0, "fetched_bars": 0, "stored_bars": 0}
+
+    def day_path(self, symbol, day):
+        return os.path.join(self.directory, symbol, f"{day}.npy")
+
+    def coverage_path(self, symbol):
+        return os.path.join(self.directory, symbol, "coverage.json")
+
+    def coverage(self, symbol):
+        try:
+            with open(self.coverage_path(symbol)) as coverage_file:
+                return json.load(coverage_file)
+        except FileNotFoundError:
+            return []
+
+    def missing_ranges(self, symbol, start, end):
+        return subtract_intervals(to_ns(start), to_ns(end), self.coverage(symbol))
+
+    def write_atomically(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as temporary_file:
+            write(temporary_file)
+        os.replace(temporary_path, path)
+
+    def load_day(self, symbol, day):
+        try:
+            rows = np.load(self.day_path(symbol, day), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        # The int64 timestamps are stored bit for bit in the first float64 row, so the timestamps and the bars
+        # they index are replaced together in a single file
+        return rows[0].view(np.int64), rows[1:]
+
+    def ingest(self, bars, start, end, symbols=None):
+        # Adds the bars of a get_stock_bars response for [start, end] and marks that range as covered for every
+        # requested symbol, including symbols with no bars in it, up to the last completed minute or the newest bar
+        start, end = to_ns(start), to_ns(end)
+        columns = columns_from_frame(bars)
+        with self.lock:
+            for symbol in set(symbols or []) | set(columns):
+                timestamps = None
+                if symbol in columns:
+                    timestamps = columns[symbol][0]
+                    self.add_bars(symbol, *columns[symbol])
+                    self.stats["stored_bars"] += len(timestamps)
+                symbol_end = covered_end(end, timestamps)
+                if symbol_end < start:
+                    continue
+                coverage = merge_interval(self.coverage(symbol), start, symbol_end)
+                self.write_atomically(self.coverage_path(symbol),
+                                      lambda coverage_file: coverage_file.write(json.dumps(coverage).encode()))
+
+    def add_bars(self, symbol, timestamps, values):
+        days = timestamps // NANOSECONDS_PER_DAY
+        for day_number in np.unique(days):
+            day = str(np.datetime64(int(day_number), "D"))
+            day_timestamps = timestamps[days == day_number]
+            day_values = values[:, days == day_number]
+            existing = self.load_day(symbol, day)
+            if existing is not None:
+                # A bar fetched again replaces the stored one
+                day_timestamps = np.concatenate([day_timestamps, existing[0]])
+                day_values = np.concatenate([day_values, existing[1]], axis=1)
+            day_timestamps, first_seen = np.unique(day_timestamps, return_index=True)
+            day_values = np.ascontiguousarray(day_values[:, first_seen])
+            rows = np.concatenate([day_timestamps.view(np.float64)[np.newaxis], day_values])
+            self.write_atomically(self.day_path(symbol, day), lambda day_file: np.save(day_file, rows))
+
+    def read_columns(self, symbol, start, end):
+        timestamps = []
+        values = []
+        for day_number in range(start // NANOSECONDS_PER_DAY, end // NANOSECONDS_PER_DAY + 1):
+            day = self.load_day(symbol, str(np.datetime64(day_number, "D")))
+            if day is None:
+                continue
+            day_timestamps, day_values = day
+            first = np.searchsorted(day_timestamps, start, side="left")
+            last = np.searchsorted(day_timestamps, end, side="right")
+            if first < last:
+                timestamps.append(np.array(day_timestamps[first:last]))
+                values.append(np.array(day_values[:, first:last]))
+        if not timestamps:
+            return None
+        return np.concatenate(timestamps), np.concatenate(values, axis=1)
+
+    def read(self, symbols, start, end):
+        # Returns the bars in the inclusive range as the (symbol, timestamp) indexed frame get_stock_data returns
+        symbols = [symbols] if isinstance(symbols, str) else symbols
+        start, end = to_ns(start), to_ns(end)
+        frames = {}
+        for symbol in symbols:
+            columns = self.read_columns(symbol, start, end)
+            if columns is not None:
+                timestamps, values = columns
+                index = pd.DatetimeIndex(pd.to_datetime(timestamps, unit="ns", utc=True), name="timestamp")
+                frames[symbol] = pd.DataFrame(dict(zip(BAR_COLUMNS, values)), index=index)
+        if not frames:
+            return empty_bars()
+        return pd.concat(frames, names=["symbol"])
+
+    def get_bars(self, symbols, start, end, fetcher):
+        # Fetches only what the store has not already got: one request spanning every symbol's missing range
+        symbol_list = [symbols] if isinstance(symbols, str) else symbols
+        missing = {symbol: self.missing_ranges(symbol, start, end) for symbol in symbol_list}
+        missing = {symbol: ranges for symbol, ranges in missing.items() if ranges}
+        if missing:
+            fetch_start = min(ranges[0][0] for ranges in missing.values())
+            fetch_end = max(ranges[-1][1] for ranges in missing.values())
+            fetch_symbols = list(missing)
+            print(f"Fetching bars for {fetch_symbols} missing from the bar store")
+            # Rounded inwards to whole microseconds, as datetimes cannot hold the nanosecond after a covered range
+            bars = fetcher(fetch_symbols if isinstance(symbols, list) else symbols,
+                           from_epoch_ns(-(-fetch_start // 1000) * 1000),
+                           from_epoch_ns(fetch_end))
+            self.stats["fetches"] += 1
+            self.stats["fetched_bars"] += len(bars)
+            self.ingest(bars, fetch_start, fetch_end, fetch_symbols)
+        return self.read(symbols, start, end)
@@ -0,0 +1,432 @@
+import asyncio
+import bisect
+import collections
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+import numpy as np
+from alpaca.common.exceptions import APIError
+from alpaca.data.models import BarSet
+from alpaca.trading.models import Order, Position, TradeUpdate
+from requests import HTTPError, Response
+from src.constants import DUPLICATE_CLIENT_ORDER_ID_MESSAGE, ORDER_TIME_FORMAT, TERMINAL_ORDER_STATUSES
+from src.trade_helper import to_epoch_ns, from_epoch_ns
+
+# Local stand-in for the parts of TradingClient and StockHistoricalDataClient the trade job uses. Minute bars are
+# replayed on a market clock the caller advances; market orders wait for the next bar and fill at its open. Calls
+# can be given latency, random server errors and a rate limit so the run loop can be load tested offline. Runs
+# should read the market clock, with src.clock.use_clock(simulator.now).
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+BAR_FIELDS = {"open": "o", "high": "h", "low": "l", "close": "c", "volume": "v", "trade_count": "n", "vwap": "vw"}
+
+
+def enum_value(value):
+    return getattr(value, "value", value)
+
+
+def api_error(status_code, code, message):
+    # Built the way the SDK builds them, so status_code and the retry and auth checks behave as against Alpaca
+    response = Response()
+    response.status_code = status_code
+    return APIError(json.dumps({"code": code, "message": message}), HTTPError(response=response))
+
+
+class RateLimiter:
+    # Token bucket allowing `rate` requests per second, in bursts of up to `burst`
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or rate
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class SimulatedTradingStream:
+    # Delivers the simulator's trade updates the way TradingStream does: to an async handler, on the thread that
+    # called run() and its own event loop. join() waits until every update published so far has been handled.
+
+    def __init__(self):
+        self.handler = None
+        self.updates = queue.Queue()
+
+    def subscribe_trade_updates(self, handler):
+        self.handler = handler
+
+    def publish(self, update):
+        self.updates.put(update)
+
+    def run(self):
+        asyncio.run(self.consume())
+
+    async def consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            update = await loop.run_in_executor(None, self.updates.get)
+            try:
+                if update is None:
+                    return
+                await self.handler(update)
+            finally:
+                self.updates.task_done()
+
+    def stop(self):
+        self.updates.put(None)
+
+    def join(self):
+        self.updates.join()
+
+
+class BrokerSimulator:
+
+    def __init__(self, bars, start=None, latency=0.0, error_rate=0.0, rate_limit=None, max_participation=1.0,
+                 seed=0, order_time_step=1000, sleep=time.sleep):
+        # bars is the (symbol, timestamp) indexed frame returned by get_stock_data
+        self.bars = {}
+        for symbol, symbol_bars in bars.groupby(level="symbol"):
+            symbol_bars = symbol_bars.droplevel("symbol").sort_index()
+            columns = {field: symbol_bars[column].to_numpy(dtype=np.float64)
+                       for column, field in BAR_FIELDS.items()}
+            columns["t"] = np.array([to_epoch_ns(timestamp) for timestamp in symbol_bars.index], dtype=np.int64)
+            self.bars[symbol] = columns
+        first_bar = min(int(columns["t"][0]) for columns in self.bars.values())
+        self.market_time = first_bar if start is None else to_epoch_ns(start)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.max_participation = max_participation
+        self.random = random.Random(seed)
+        self.order_time_step = order_time_step
+        self.sleep = sleep
+        self.scripted_errors = collections.defaultdict(list)
+        self.requests = collections.Counter()
+        self.orders = {}
+        # Order ids and submission times in submission order, for paging by time
+        self.order_ids = []
+        self.submitted_times = []
+        self.client_order_ids = {}
+        self.pending = collections.defaultdict(list)
+        self.positions = {}
+        self.realized_pl = 0.0
+        self.asset_ids = {symbol: str(uuid.UUID(int=self.random.getrandbits(128))) for symbol in self.bars}
+        self.lock = threading.RLock()
+        self.trading_stream = SimulatedTradingStream()
+
+    def clients(self):
+        # The simulator serves both clients' methods
+        return self, self
+
+    # Market clock
+
+    def now(self):
+        # Naive UTC, the same as datetime.datetime.now() on Lambda
+        return from_epoch_ns(self.market_time).replace(tzinfo=None)
+
+    def advance(self, minutes=1):
+        self.advance_to(self.market_time + minutes * NANOSECONDS_PER_MINUTE)
+
+    def advance_to(self, market_time):
+        with self.lock:
+            for symbol, columns in self.bars.items():
+                first, last = np.searchsorted(columns["t"], [self.market_time, market_time], side="right")
+                for index in range(first, last):
+                    self.match(symbol, index)
+            self.market_time = market_time
+
+    def market_time_string(self, market_time):
+        return from_epoch_ns(market_time).strftime(ORDER_TIME_FORMAT)
+
+    def last_close(self, symbol):
+        columns = self.bars[symbol]
+        index = int(np.searchsorted(columns["t"], self.market_time, side="right")) - 1
+        if index < 0:
+            return float(columns["o"][0])
+        return float(columns["c"][index])
+
+    # Matching engine
+
+    def match(self, symbol, index):
+        # Fills the symbol's waiting market orders at the bar's open, oldest first. Each bar can fill at most
+        # max_participation of its volume.
+        columns = self.bars[symbol]
+        price = float(columns["o"][index])
+        available = float(columns["v"][index])
+        if self.max_participation < 1:
+            available = float(np.floor(available * self.max_participation))
+        bar_time = self.market_time_string(int(columns["t"][index]))
+        still_pending = []
+        for order_id in self.pending[symbol]:
+            order = self.orders[order_id]
+            remaining = float(order["qty"]) - float(order["filled_qty"])
+            fill_qty = min(remaining, available)
+            if fill_qty > 0:
+                available -= fill_qty
+                self.fill(order, fill_qty, price, bar_time)
+            if order["status"] not in TERMINAL_ORDER_STATUSES:
+                still_pending.append(order_id)
+        self.pending[symbol] = still_pending
+
+    def fill(self, order, qty, price, fill_time):
+        filled_qty = float(order["filled_qty"])
+        filled_avg_price = float(order["filled_avg_price"] or 0)
+        total_qty = filled_qty + qty
+        order["filled_avg_price"] = str((filled_avg_price * filled_qty + price * qty) / total_qty)
+        order["filled_qty"] = str(total_qty)
+        order["status"] = "filled" if total_qty >= float(order["qty"]) else "partially_filled"
+        order["updated_at"] = fill_time
+        if order["status"] == "filled":
+            order["filled_at"] = fill_time
+
+        position = self.positions.setdefault(order["symbol"], {"qty": 0.0, "cost_basis": 0.0})
+        if order["side"] == "buy":
+            position["qty"] += qty
+            position["cost_basis"] += price * qty
+        else:
+            average_cost = position["cost_basis"] / position["qty"]
+            self.realized_pl += (price - average_cost) * qty
+            position["cost_basis"] -= average_cost * qty
+            position["qty"] -= qty
+            if position["qty"] <= 0:
+                del self.positions[order["symbol"]]
+        self.publish("fill" if order["status"] == "filled" else "partial_fill", order, fill_time,
+                     qty=qty, price=price, position_qty=max(position["qty"], 0.0))
+
+    def publish(self, event, order, timestamp, **fill):
+        # Updates are only built once something has subscribed to them
+        if self.trading_stream.handler is not None:
+            self.trading_stream.publish(TradeUpdate(event=event, order=Order(**order), timestamp=timestamp, **fill))
+
+    # Fault injection
+
+    def fail_next(self, method, error):
+        # The next call to `method` raises `error` instead of running
+        self.scripted_errors[method].append(error)
+
+    def request(self, method):
+        with self.lock:
+            self.requests[method] += 1
+            scripted_errors = self.scripted_errors.get(method)
+            error = scripted_errors.pop(0) if scripted_errors else None
+            random_error = self.error_rate and self.random.random() < self.error_rate
+        latency = self.latency.get(method, 0) if isinstance(self.latency, dict) else self.latency
+        if latency:
+            self.sleep(latency)
+        if error is not None:
+            raise error
+        if self.rate_limiter is not None and not self.rate_limiter.allow():
+            raise api_error(429, 42910000, "rate limit exceeded")
+        if random_error:
+            raise api_error(500, 50010000, "internal server error")
+
+    # TradingClient
+
+    def submit_order(self, order_data):
+        self.request("submit_order")
+        with self.lock:
+            symbol = order_data.symbol
+            if symbol not in self.bars:
+                raise api_error(422, 40010001, f"asset not found for {symbol}")
+            if enum_value(order_data.type) != "market":
+                raise api_error(422, 40010001, "only market orders are simulated")
+            side = enum_value(order_data.side)
+            qty = order_data.qty
+            if qty is None:
+                qty = float(order_data.notional) / self.last_close(symbol)
+            if order_data.client_order_id is not None and order_data.client_order_id in self.client_order_ids:
+                raise api_error(422, 40010001, DUPLICATE_CLIENT_ORDER_ID_MESSAGE)
+            if side == "sell" and qty > self.sellable_qty(symbol):
+                raise api_error(403, 40310000, f"insufficient qty available for order (requested: {qty})")
+            return self.accept(symbol, side, qty, order_data.client_order_id, enum_value(order_data.time_in_force))
+
+    def sellable_qty(self, symbol):
+        # Shares already promised to open sell orders cannot be sold again
+        held = self.positions.get(symbol, {"qty": 0.0})["qty"]
+        for order_id in self.pending[symbol]:
+            order = self.orders[order_id]
+            if order["side"] == "sell":
+                held -= float(order["qty"]) - float(order["filled_qty"])
+        return held
+
+    def accept(self, symbol, side, qty, client_order_id=None, time_in_force="day"):
+        submitted_time = self.market_time
+        if self.submitted_times and submitted_time <= self.submitted_times[-1]:
+            # Orders submitted at the same market time are order_time_step nanoseconds apart, keeping submission
+            # order. Alpaca can give orders the same submission time, which a step of 0 reproduces.
+            submitted_time = self.submitted_times[-1] + self.order_time_step
+        submitted_at = self.market_time_string(submitted_time)
+        order_id = str(uuid.UUID(int=self.random.getrandbits(128)))
+        self.client_order_ids[client_order_id or order_id] = order_id
+        self.orders[order_id] = {
+            "id": order_id,
+            "client_order_id": client_order_id or order_id,
+            "created_at": submitted_at,
+            "updated_at": submitted_at,
+            "submitted_at": submitted_at,
+            "filled_at": None,
+            "canceled_at": None,
+            "asset_id": self.asset_ids[symbol],
+            "symbol": symbol,
+            "asset_class": "us_equity",
+            "qty": str(qty),
+            "filled_qty": "0",
+            "filled_avg_price": None,
+            "order_class": "simple",
+            "order_type": "market",
+            "type": "market",
+            "side": side,
+            "time_in_force": time_in_force,
+            "status": "new",
+            "extended_hours": False
+        }
+        self.order_ids.append(order_id)
+        self.submitted_times.append(submitted_time)
+        self.pending[symbol].append(order_id)
+        self.publish("new", self.orders[order_id], submitted_at)
+        return Order(**self.orders[order_id])
+
+    def get_orders(self, filter=None):
+        self.request("get_orders")
+        status = enum_value(getattr(filter, "status", None)) or "open"
+        symbols = getattr(filter, "symbols", None)
+        direction = enum_value(getattr(filter, "direction", None)) or "desc"
+        limit = getattr(filter, "limit", None) or 50
+        with self.lock:
+            first = 0
+            last = len(self.order_ids)
+            if getattr(filter, "after", None) is not None:
+                first = bisect.bisect_right(self.submitted_times, to_epoch_ns(filter.after))
+            if getattr(filter, "until", None) is not None:
+                last = bisect.bisect_left(self.submitted_times, to_epoch_ns(filter.until))
+            order_ids = self.order_ids[first:last]
+            if direction == "desc":
+                order_ids = reversed(order_ids)
+            orders = []
+            for order_id in order_ids:
+                order = self.orders[order_id]
+                if symbols and order["symbol"] not in symbols:
+                    continue
+                if status != "all" and (order["status"] in TERMINAL_ORDER_STATUSES) != (status == "closed"):
+                    continue
+                orders.append(Order(**order))
+                if len(orders) == limit:
+                    break
+            return orders
+
+    def get_order_by_id(self, order_id):
+        self.request("get_order_by_id")
+        with self.lock:
+            order = self.orders.get(str(order_id))
+            if order is None:
+                raise api_error(404, 40410000, "order not found")
+            return Order(**order)
+
+    def get_order_by_client_id(self, client_id):
+        self.request("get_order_by_client_id")
+        with self.lock:
+            order_id = self.client_order_ids.get(client_id)
+            if order_id is None:
+                raise api_error(404, 40410000, "order not found")
+            return Order(**self.orders[order_id])
+
+    def cancel_order_by_id(self, order_id):
+        self.request("cancel_order_by_id")
+        with self.lock:
+            self.cancel(str(order_id))
+
+    def cancel(self, order_id):
+        order = self.orders.get(order_id)
+        if order is None:
+            raise api_error(404, 40410000, "order not found")
+        if order["status"] in TERMINAL_ORDER_STATUSES:
+            raise api_error(422, 42210000, "order is not cancelable")
+        order["status"] = "canceled"
+        order["canceled_at"] = order["updated_at"] = self.market_time_string(self.market_time)
+        self.pending[order["symbol"]].remove(order_id)
+        self.publish("canceled", order, order["canceled_at"])
+
+    def position_model(self, symbol):
+        position = self.positions.get(symbol)
+        if position is None:
+            raise api_error(404, 40410000, "position does not exist")
+        current_price = self.last_close(symbol)
+        market_value = position["qty"] * current_price
+        return Position(asset_id=self.asset_ids[symbol],
+                        symbol=symbol,
+                        exchange="NASDAQ",
+                        asset_class="us_equity",
+                        avg_entry_price=str(position["cost_basis"] / position["qty"]),
+                        qty=str(position["qty"]),
+                        side="long",
+                        cost_basis=str(position["cost_basis"]),
+                        market_value=str(market_value),
+                        current_price=str(current_price),
+                        unrealized_pl=str(market_value - position["cost_basis"]))
+
+    def get_open_position(self, symbol_or_asset_id):
+        self.request("get_open_position")
+        with self.lock:
+            return self.position_model(symbol_or_asset_id)
+
+    def get_all_positions(self):
+        self.request("get_all_positions")
+        with self.lock:
+            return [self.position_model(symbol) for symbol in self.positions]
+
+    def close_position(self, symbol_or_asset_id, close_options=None):
+        self.request("close_position")
+        with self.lock:
+            symbol = symbol_or_asset_id
+            position = self.positions.get(symbol)
+            if position is None:
+                raise api_error(404, 40410000, "position does not exist")
+            qty = position["qty"]
+            if close_options is not None and close_options.qty is not None:
+                qty = float(close_options.qty)
+            elif close_options is not None and close_options.percentage is not None:
+                qty = position["qty"] * float(close_options.percentage) / 100
+            if qty > self.sellable_qty(symbol):
+                raise api_error(403, 40310000, f"insufficient qty available for order (requested: {qty})")
+            return self.accept(symbol, "sell", qty)
+
+    # StockHistoricalDataClient
+
+    def get_stock_bars(self, request_params):
+        self.request("get_stock_bars")
+        symbols = request_params.symbol_or_symbols
+        symbols = [symbols] if isinstance(symbols, str) else symbols
+        with self.lock:
+            # Bars after the market time have not happened yet
+            end = self.market_time
+            if request_params.end is not None:
+                end = min(end, to_epoch_ns(request_params.end))
+            start = to_epoch_ns(request_params.start)
+            data = {}
+            for symbol in symbols:
+                columns = self.bars.get(symbol)
+                if columns is None:
+                    continue
+                first = int(np.searchsorted(columns["t"], start, side="left"))
+                last = int(np.searchsorted(columns["t"], end, side="right"))
+                if first < last:
+                    data[symbol] = [self.raw_bar(columns, index) for index in range(first, last)]
+        return BarSet(data)
+
+    def raw_bar(self, columns, index):
+        bar = {field: float(columns[field][index]) for field in BAR_FIELDS.values()}
+        bar["t"] = from_epoch_ns(int(columns["t"][index])).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return bar
@@ -0,0 +1,94 @@
+from alpaca.data.historical import StockHistoricalDataClient
+from alpaca.trading.client import TradingClient
+from alpaca.common.exceptions import APIError
+from src.secrets_helper import get_secret
+from src.constants import SECRET_CACHE_TTL_SECONDS, AUTH_ERROR_STATUS_CODES
+import time
+
+
+class ClientCache:
+    # Held at module level so the secret and the Alpaca clients survive across warm Lambda invocations
+
+    def __init__(self, secret_loader=get_secret, ttl=SECRET_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.secret_loader = secret_loader
+        self.ttl = ttl
+        self.clock = clock
+        self.secret = None
+        self.secret_fetched_at = None
+        self.clients = None
+        self.stats = {
+            "secret_hits": 0,
+            "secret_misses": 0,
+            "client_hits": 0,
+            "client_misses": 0,
+            "rotations": 0,
+            "invalidations": 0
+        }
+
+    def secret_expired(self):
+        return self.secret is None or self.clock() - self.secret_fetched_at >= self.ttl
+
+    def get_secret(self):
+        if not self.secret_expired():
+            self.stats["secret_hits"] += 1
+            return self.secret
+
+        self.stats["secret_misses"] += 1
+        secret = self.secret_loader()
+        if self.secret is not None and secret != self.secret:
+            print("Secret has been rotated, rebuilding Alpaca clients")
+            self.stats["rotations"] += 1
+            self.clients = None
+        self.secret = secret
+        self.secret_fetched_at = self.clock()
+        return secret
+
+    def get_clients(self):
+        secret = self.get_secret()
+        if self.clients is not None:
+            self.stats["client_hits"] += 1
+            return self.clients
+
+        self.stats["client_misses"] += 1
+        alpaca_api_key = secret['alpaca_api_key']
+        alpaca_secret_key = secret['alpaca_secret_key']
+        stock_client = StockHistoricalDataClient(alpaca_api_key, alpaca_secret_key)
+        trading_client = TradingClient(alpaca_api_key, alpaca_secret_key)
+        for client in (stock_client, trading_client):
+            # The SDK's own retry waits a fixed 3s per attempt regardless of the deadline; src.retry handles
+            # rate limits and server errors instead. alpaca-py has no public way to turn it off (the clients do not
+            # take retry_attempts, and RESTClient ignores values below 1), so test_client_cache checks this against
+            # the installed SDK.
+            client._retry = 0
+        self.clients = (stock_client, trading_client)
+        return self.clients
+
+    def invalidate(self):
+        print("Invalidating cached secret and Alpaca clients")
+        self.stats["invalidations"] += 1
+        self.secret = None
+        self.secret_fetched_at = None
+        self.clients = None
+
+
+def is_auth_error(error):
+    # Helpers such as get_orders re-raise broker errors as the cause of their own exception, and concurrent calls
+    # collect each call's error in `errors`
+    while error is not None:
+        if isinstance(error, APIError) and error.status_code in AUTH_ERROR_STATUS_CODES:
+            return True
+        if any(is_auth_error(call_error) for call_error in getattr(error, "errors", {}).values()):
+            return True
+        error = error.__cause__
+    return False
+
+
+client_cache = ClientCache()
+
+
+def get_clients():
+    return client_cache.get_clients()
+
+
+def invalidate_clients():
+    client_cache.invalidate()
@@ -0,0 +1,24 @@
+import contextlib
+import contextvars
+import datetime
+
+# The time the trade job reads as "now". It is the wall clock unless a block sets another clock, such as the
+# market clock of the broker simulator, so runs can be driven faster than real time.
+current_clock = contextvars.ContextVar("clock", default=None)
+
+
+def now():
+    return current_clock_function()()
+
+
+def current_clock_function():
+    return current_clock.get() or datetime.datetime.now
+
+
+@contextlib.contextmanager
+def use_clock(clock):
+    token = current_clock.set(clock)
+    try:
+        yield clock
+    finally:
+        current_clock.reset(token)
@@ -0,0 +1,83 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from src.constants import BROKER_CALL_TIMEOUT_SECONDS, CONCURRENT_CALL_WORKERS
+from src.retry import AttemptTimer, current_attempt
+
+# Kept at module level so warm invocations reuse the same worker threads
+executor = ThreadPoolExecutor(max_workers=CONCURRENT_CALL_WORKERS)
+
+
+class CallTimeoutError(TimeoutError):
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        super().__init__(f"{name} did not finish within {timeout}s")
+
+
+class ConcurrentCallError(Exception):
+    # errors maps the name of each call that failed to the exception it raised. The first error is also chained as
+    # the cause, so checks such as is_auth_error still see it.
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{name} failed: {error}" for name, error in errors.items()))
+
+
+def run_timed(timer, call):
+    current_attempt.set(timer)
+    return call()
+
+
+def wait_for(future, timer, timeout):
+    # The timeout runs from the start of the call's latest attempt, so a call that is still retrying keeps being
+    # waited on; retries themselves stop at the run's deadline
+    while True:
+        remaining = None if timeout is None else max(0, timer.started_at + timeout - time.monotonic())
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeoutError:
+            if time.monotonic() >= timer.started_at + timeout:
+                raise
+
+
+def run_concurrently(calls, timeouts=None, default_timeout=BROKER_CALL_TIMEOUT_SECONDS, pool=None):
+    # Runs independent calls at the same time and returns their results by name. Each call gets its own timeout,
+    # applied to each attempt the call makes through src.retry. A call that times out keeps running on its worker
+    # thread, but its result is discarded.
+    timeouts = timeouts or {}
+    pool = pool or executor
+    timers = {name: AttemptTimer() for name in calls}
+    # Each call runs in a copy of the caller's context so it shares the run's retry scope
+    futures = {name: pool.submit(contextvars.copy_context().run, run_timed, timers[name], call)
+               for name, call in calls.items()}
+
+    results = {}
+    errors = {}
+    for name, future in futures.items():
+        timeout = timeouts.get(name, default_timeout)
+        try:
+            results[name] = wait_for(future, timers[name], timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            errors[name] = CallTimeoutError(name, timeout)
+        except Exception as e:
+            errors[name] = e
+    if errors:
+        for name, error in errors.items():
+            print(f"Error during {name} call, message: {error}")
+        raise ConcurrentCallError(errors) from next(iter(errors.values()))
+    return results
+
+
+def run_each(function, items, pool=None):
+    # Calls function on every item across the pool and returns (item, result, error) for each, in order
+    pool = pool or executor
+    futures = [(item, pool.submit(contextvars.copy_context().run, function, item)) for item in items]
+    outcomes = []
+    for item, future in futures:
+        try:
+            outcomes.append((item, future.result(), None))
+        except Exception as e:
+            outcomes.append((item, None, e))
+    return outcomes
@@ -1 +1,55 @@
-MAX_RETRIES = 3
\ No newline at end of file
+MAX_RETRIES = 3
+SECRET_CACHE_TTL_SECONDS = 900
+AUTH_ERROR_STATUS_CODES = (401, 403)
+STATE_STORE_DIR = "/tmp/trade_job_state"
+BAR_COLUMNS = ["open", "high", "low", "close", "volume", "trade_count", "vwap"]
+ORDER_PAGE_LIMIT = 500
+ORDER_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+TERMINAL_ORDER_STATUSES = ("filled", "canceled", "expired", "replaced", "rejected")
+SCHEDULER_INTERVAL_SECONDS = 60
+SCHEDULER_MAX_WORKERS = 64
+STREAMING_MAX_WORKERS = 16
+# How many of the most recent bar-to-decision latencies a streaming trader keeps
+STREAMING_LATENCY_SAMPLES = 10000
+BROKER_CALL_TIMEOUT_SECONDS = 5
+CONCURRENT_CALL_WORKERS = 16
+RETRY_BASE_DELAY_SECONDS = 0.2
+RETRY_MAX_DELAY_SECONDS = 2
+# Time kept back from the Lambda's remaining time for the rest of the run after a retried call
+RETRY_DEADLINE_MARGIN_SECONDS = 1
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+METRICS_NAMESPACE = "TradeJob"
+BAR_STORE_DIR = "/tmp/trade_job_bars"
+SHARED_BAR_CACHE_DIR = "/tmp/trade_job_bar_cache"
+SHARED_BAR_CACHE_TTL_SECONDS = 300
+SHARED_BAR_CACHE_MAX_ENTRIES = 1024
+# How long a fetch may hold a range's lock before other callers stop waiting for it and fetch the range themselves.
+# The wait counts against the caller's BROKER_CALL_TIMEOUT_SECONDS, so it is kept well under it to leave time for the
+# caller's own fetch.
+SHARED_BAR_CACHE_LOCK_SECONDS = 2
+SHARED_BAR_CACHE_POLL_SECONDS = 0.05
+MULTIPLEXED_JOB_WORKERS = 16
+# Step Function state is limited to 256 KB, the rest is left for the job's parameters and status
+SNAPSHOT_MAX_BYTES = 192 * 1024
+MEMORY_PROFILE_FRAMES = 1
+MEMORY_PROFILE_TOP = 10
+MEMORY_HEADROOM_RATIO = 1.5
+LAMBDA_MIN_MEMORY_MB = 128
+LAMBDA_MEMORY_STEP_MB = 64
+# Alpaca's message when an order reuses a client_order_id
+DUPLICATE_CLIENT_ORDER_ID_MESSAGE = "client_order_id must be unique"
+# How long a job's ledger and position are read from the trade-updates stream before a run reads them over REST again
+TRADE_STATE_MAX_AGE_SECONDS = 300
+TRADE_STATE_RECENT_UPDATES = 1000
+# Client methods whose responses are recorded with TRADE_JOB_RECORD and served back when a job is replayed
+RECORDED_CALLS = frozenset({
+    "get_stock_bars",
+    "get_orders",
+    "get_order_by_id",
+    "get_order_by_client_id",
+    "get_open_position",
+    "get_all_positions",
+    "submit_order",
+    "close_position",
+    "cancel_order_by_id"
+})
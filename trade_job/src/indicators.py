@@ -0,0 +1,284 @@
+import math
+
+NAN = float("nan")
+
+
+class RingBuffer:
+    # Fixed-capacity buffer of (timestamp, value, weight) entries, oldest first
+
+    __slots__ = ("capacity", "timestamps", "values", "weights", "start", "count")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = [0] * capacity
+        self.values = [0.0] * capacity
+        self.weights = [0.0] * capacity
+        self.start = 0
+        self.count = 0
+
+    def is_full(self):
+        return self.count == self.capacity
+
+    def push(self, timestamp, value, weight):
+        # Returns the entry that was overwritten when the buffer was already full
+        end = (self.start + self.count) % self.capacity
+        evicted = None
+        if self.is_full():
+            evicted = (self.timestamps[end], self.values[end], self.weights[end])
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.count += 1
+        self.timestamps[end] = timestamp
+        self.values[end] = value
+        self.weights[end] = weight
+        return evicted
+
+    def oldest(self):
+        return self.timestamps[self.start], self.values[self.start], self.weights[self.start]
+
+    def pop_oldest(self):
+        oldest = self.oldest()
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+        return oldest
+
+    def newest_timestamp(self):
+        if not self.count:
+            return None
+        return self.timestamps[(self.start + self.count - 1) % self.capacity]
+
+    def newest_value(self):
+        if not self.count:
+            return None
+        return self.values[(self.start + self.count - 1) % self.capacity]
+
+    def entries(self):
+        for i in range(self.count):
+            index = (self.start + i) % self.capacity
+            yield self.timestamps[index], self.values[index], self.weights[index]
+
+
+class WindowIndicator:
+    # Base for indicators over the last `capacity` values, optionally also limited to values newer than
+    # `max_age` (in timestamp units) behind the newest one. Running sums are rebuilt from the buffer once per
+    # `capacity` updates so floating-point drift cannot build up, keeping updates amortized O(1).
+
+    __slots__ = ("buffer", "min_periods", "max_age", "updates_since_resync")
+    indicator_type = None
+
+    def __init__(self, capacity, min_periods=None, max_age=None):
+        self.buffer = RingBuffer(capacity)
+        self.min_periods = capacity if min_periods is None else min_periods
+        self.max_age = max_age
+        self.updates_since_resync = 0
+
+    @property
+    def count(self):
+        return self.buffer.count
+
+    @property
+    def last_timestamp(self):
+        return self.buffer.newest_timestamp()
+
+    @property
+    def last_value(self):
+        return self.buffer.newest_value()
+
+    def update(self, value, timestamp=0, weight=1.0):
+        evicted = self.buffer.push(timestamp, value, weight)
+        if evicted is not None:
+            self.remove(*evicted)
+        self.add(timestamp, value, weight)
+        if self.max_age is not None:
+            self.evict_before(timestamp - self.max_age, inclusive=True)
+        self.updates_since_resync += 1
+        if self.updates_since_resync >= self.buffer.capacity:
+            self.resync()
+        return self.value
+
+    def evict_before(self, timestamp, inclusive=False):
+        while self.buffer.count and (self.buffer.oldest()[0] < timestamp or
+                                     (inclusive and self.buffer.oldest()[0] == timestamp)):
+            self.remove(*self.buffer.pop_oldest())
+
+    def reset(self):
+        self.buffer = RingBuffer(self.buffer.capacity)
+        self.clear()
+        self.updates_since_resync = 0
+
+    def resync(self):
+        self.clear()
+        for entry in self.buffer.entries():
+            self.add(*entry)
+        self.updates_since_resync = 0
+
+    def to_state(self):
+        return {
+            "type": self.indicator_type,
+            "capacity": self.buffer.capacity,
+            "min_periods": self.min_periods,
+            "max_age": self.max_age,
+            "entries": [list(entry) for entry in self.buffer.entries()]
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        indicator = cls(state["capacity"], state["min_periods"], state["max_age"])
+        for timestamp, value, weight in state["entries"]:
+            indicator.buffer.push(timestamp, value, weight)
+        indicator.resync()
+        return indicator
+
+
+class SMA(WindowIndicator):
+    __slots__ = ("total",)
+    indicator_type = "sma"
+
+    def clear(self):
+        self.total = 0.0
+
+    def __init__(self, capacity, min_periods=None, max_age=None):
+        super().__init__(capacity, min_periods, max_age)
+        self.clear()
+
+    def add(self, timestamp, value, weight):
+        self.total += value
+
+    def remove(self, timestamp, value, weight):
+        self.total -= value
+
+    @property
+    def value(self):
+        if self.count < max(self.min_periods, 1):
+            return NAN
+        return self.total / self.count
+
+
+class RollingStd(WindowIndicator):
+    # Sample standard deviation (ddof=1) using Welford's updates, which add and remove values without the
+    # cancellation of a sum-of-squares approach
+    __slots__ = ("size", "mean", "m2")
+    indicator_type = "std"
+
+    def clear(self):
+        self.size = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def __init__(self, capacity, min_periods=None, max_age=None):
+        super().__init__(capacity, min_periods, max_age)
+        self.clear()
+
+    def add(self, timestamp, value, weight):
+        self.size += 1
+        delta = value - self.mean
+        self.mean += delta / self.size
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, timestamp, value, weight):
+        if self.size == 1:
+            self.clear()
+            return
+        delta = value - self.mean
+        self.mean -= delta / (self.size - 1)
+        self.m2 -= delta * (value - self.mean)
+        self.size -= 1
+
+    @property
+    def value(self):
+        if self.count < max(self.min_periods, 2):
+            return NAN
+        return math.sqrt(max(self.m2, 0.0) / (self.size - 1))
+
+
+class VWAP(WindowIndicator):
+    # Volume-weighted average price over the window; the volume is passed as the update weight
+    __slots__ = ("price_volume", "volume")
+    indicator_type = "vwap"
+
+    def clear(self):
+        self.price_volume = 0.0
+        self.volume = 0.0
+
+    def __init__(self, capacity, min_periods=None, max_age=None):
+        super().__init__(capacity, min_periods, max_age)
+        self.clear()
+
+    def add(self, timestamp, value, weight):
+        self.price_volume += value * weight
+        self.volume += weight
+
+    def remove(self, timestamp, value, weight):
+        self.price_volume -= value * weight
+        self.volume -= weight
+
+    @property
+    def value(self):
+        if self.count < max(self.min_periods, 1) or self.volume == 0:
+            return NAN
+        return self.price_volume / self.volume
+
+
+class EMA:
+    # Matches pandas ewm(span=span, adjust=False).mean(), which only needs the previous average
+    __slots__ = ("span", "alpha", "count", "last_timestamp", "current")
+    indicator_type = "ema"
+
+    def __init__(self, span):
+        self.span = span
+        self.alpha = 2 / (span + 1)
+        self.count = 0
+        self.last_timestamp = None
+        self.current = NAN
+
+    def update(self, value, timestamp=0, weight=1.0):
+        if self.count == 0:
+            self.current = value
+        else:
+            self.current += self.alpha * (value - self.current)
+        self.count += 1
+        self.last_timestamp = timestamp
+        return self.current
+
+    @property
+    def value(self):
+        return self.current
+
+    def to_state(self):
+        return {
+            "type": self.indicator_type,
+            "span": self.span,
+            "count": self.count,
+            "last_timestamp": self.last_timestamp,
+            "current": self.current
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        indicator = cls(state["span"])
+        indicator.count = state["count"]
+        indicator.last_timestamp = state["last_timestamp"]
+        indicator.current = state["current"]
+        return indicator
+
+
+INDICATOR_TYPES = {indicator.indicator_type: indicator for indicator in (SMA, RollingStd, VWAP, EMA)}
+
+
+def indicator_from_state(state):
+    return INDICATOR_TYPES[state["type"]].from_state(state)
+
+
+def indicator_key(symbol, job_start_time, name):
+    return f"indicators/{symbol}/{job_start_time}/{name}"
+
+
+def load_indicator(store, key, create):
+    state = store.load(key)
+    if state is None:
+        return create()
+    return indicator_from_state(state)
+
+
+def save_indicator(store, key, indicator):
+    store.save(key, indicator.to_state())
@@ -0,0 +1,203 @@
+import base64
+import datetime
+import struct
+import uuid
+from array import array
+from src.order_ledger import OrderLedger, format_order_time, parse_order_time
+from src.indicators import indicator_from_state
+from src.constants import SNAPSHOT_MAX_BYTES
+
+# A job's ledger and close average, packed into a base64 string that is returned in jobStatus and passed back to the
+# next run by the Step Function. Layout (little-endian, version 2):
+#   header: magic b"TJ", version (B)
+#   ledger: start and cursor (q each, microseconds since the epoch), realized_pl (d),
+#           cursor order ids (H count, 16 byte UUIDs),
+#           open orders (H count; UUID, symbol, side, status, filled_qty d, filled_notional d),
+#           positions (H count; symbol, qty d, cost_basis d)
+#   indicator: type, capacity (I), min_periods (I), max_age (q, -1 for none), entry count (I), then the entries'
+#              timestamps (q), values (d) and weights (d) as three packed arrays
+# Strings are a length byte followed by UTF-8.
+
+MAGIC = b"TJ"
+VERSION = 2
+EPOCH = datetime.datetime(1970, 1, 1)
+SIDES = ("buy", "sell")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotWriter:
+    def __init__(self):
+        self.parts = []
+
+    def pack(self, layout, *values):
+        self.parts.append(struct.pack(f"<{layout}", *values))
+
+    def string(self, value):
+        encoded = value.encode()
+        self.pack("B", len(encoded))
+        self.parts.append(encoded)
+
+    def order_id(self, value):
+        self.parts.append(uuid.UUID(value).bytes)
+
+    def values(self, typecode, values):
+        self.parts.append(array(typecode, values).tobytes())
+
+    def getvalue(self):
+        return b"".join(self.parts)
+
+
+class SnapshotReader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, layout):
+        layout = f"<{layout}"
+        values = struct.unpack_from(layout, self.data, self.offset)
+        self.offset += struct.calcsize(layout)
+        return values if len(values) > 1 else values[0]
+
+    def raw(self, length):
+        if self.offset + length > len(self.data):
+            raise SnapshotError("Snapshot is truncated")
+        value = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return value
+
+    def string(self):
+        return self.raw(self.unpack("B")).decode()
+
+    def order_id(self):
+        return str(uuid.UUID(bytes=self.raw(16)))
+
+    def values(self, typecode, count):
+        values = array(typecode)
+        values.frombytes(self.raw(count * values.itemsize))
+        return values
+
+
+def pack_order_time(time):
+    return (parse_order_time(time) - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def unpack_order_time(time):
+    return format_order_time(EPOCH + datetime.timedelta(microseconds=time))
+
+
+def write_ledger(writer, ledger):
+    writer.pack("qqd", pack_order_time(ledger.start), pack_order_time(ledger.cursor), ledger.realized_pl)
+    writer.pack("H", len(ledger.cursor_order_ids))
+    for order_id in sorted(ledger.cursor_order_ids):
+        writer.order_id(order_id)
+    writer.pack("H", len(ledger.open_orders))
+    for order in ledger.open_orders.values():
+        writer.order_id(order["id"])
+        writer.string(order["symbol"])
+        writer.pack("B", SIDES.index(order["side"]))
+        writer.string(order["status"])
+        writer.pack("dd", order["filled_qty"], order["filled_notional"])
+    writer.pack("H", len(ledger.positions))
+    for symbol, position in ledger.positions.items():
+        writer.string(symbol)
+        writer.pack("dd", position["qty"], position["cost_basis"])
+
+
+def read_ledger(reader, symbol):
+    start, cursor, realized_pl = reader.unpack("qqd")
+    cursor_order_ids = [reader.order_id() for _ in range(reader.unpack("H"))]
+    open_orders = {}
+    for _ in range(reader.unpack("H")):
+        order_id = reader.order_id()
+        order_symbol = reader.string()
+        side = SIDES[reader.unpack("B")]
+        status = reader.string()
+        filled_qty, filled_notional = reader.unpack("dd")
+        open_orders[order_id] = {"id": order_id, "symbol": order_symbol, "side": side, "status": status,
+                                 "filled_qty": filled_qty, "filled_notional": filled_notional}
+    positions = {}
+    for _ in range(reader.unpack("H")):
+        position_symbol = reader.string()
+        qty, cost_basis = reader.unpack("dd")
+        positions[position_symbol] = {"qty": qty, "cost_basis": cost_basis}
+    return OrderLedger(symbol, unpack_order_time(cursor), realized_pl, cursor_order_ids, open_orders, positions,
+                       unpack_order_time(start))
+
+
+def write_indicator(writer, indicator):
+    state = indicator.to_state()
+    entries = state["entries"]
+    writer.string(state["type"])
+    writer.pack("IIqI", state["capacity"], state["min_periods"],
+                -1 if state["max_age"] is None else state["max_age"], len(entries))
+    writer.values("q", [entry[0] for entry in entries])
+    writer.values("d", [entry[1] for entry in entries])
+    writer.values("d", [entry[2] for entry in entries])
+
+
+def read_indicator(reader):
+    indicator_type = reader.string()
+    capacity, min_periods, max_age, count = reader.unpack("IIqI")
+    timestamps = reader.values("q", count)
+    values = reader.values("d", count)
+    weights = reader.values("d", count)
+    return indicator_from_state({
+        "type": indicator_type,
+        "capacity": capacity,
+        "min_periods": min_periods,
+        "max_age": None if max_age == -1 else max_age,
+        "entries": list(zip(timestamps, values, weights))
+    })
+
+
+def encode_snapshot(ledger, indicator):
+    writer = SnapshotWriter()
+    writer.parts.append(MAGIC)
+    writer.pack("B", VERSION)
+    write_ledger(writer, ledger)
+    write_indicator(writer, indicator)
+    return base64.b64encode(writer.getvalue()).decode()
+
+
+def decode_snapshot(snapshot, symbol):
+    # Returns the ledger and indicator held in a snapshot, raising SnapshotError if it cannot be read
+    try:
+        reader = SnapshotReader(base64.b64decode(snapshot, validate=True))
+        if reader.raw(2) != MAGIC:
+            raise SnapshotError("Not a job snapshot")
+        version = reader.unpack("B")
+        if version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version}")
+        ledger = read_ledger(reader, symbol)
+        indicator = read_indicator(reader)
+    except (ValueError, KeyError, IndexError, struct.error) as e:
+        raise SnapshotError(f"Snapshot is not readable: {e}") from e
+    return ledger, indicator
+
+
+def snapshot_or_none(ledger, indicator, max_bytes=SNAPSHOT_MAX_BYTES):
+    # The snapshot travels in the Step Function state, which is limited to 256 KB. A snapshot that would not leave
+    # room for the rest of the state is dropped, and the next run falls back to the state store.
+    snapshot = encode_snapshot(ledger, indicator)
+    if len(snapshot) > max_bytes:
+        print(f"Job snapshot is {len(snapshot)} bytes, over the {max_bytes} byte limit; not returning it")
+        return None
+    return snapshot
+
+
+def restore_snapshot(snapshot, symbol, capacity):
+    # Returns the ledger and close average from the previous run's snapshot, or None if there is no usable one
+    if not snapshot:
+        return None
+    try:
+        ledger, indicator = decode_snapshot(snapshot, symbol)
+    except SnapshotError as e:
+        print(f"Discarding unreadable job snapshot, message: {e}")
+        return None
+    if indicator.to_state().get("capacity") != capacity:
+        print("Job snapshot was taken with a different window length, discarding it")
+        return None
+    return ledger, indicator
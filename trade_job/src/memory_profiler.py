@@ -0,0 +1,168 @@
+import collections
+import contextlib
+import contextvars
+import gc
+import json
+import math
+import os
+import threading
+import tracemalloc
+from src.constants import (
+    LAMBDA_MEMORY_STEP_MB,
+    LAMBDA_MIN_MEMORY_MB,
+    MEMORY_HEADROOM_RATIO,
+    MEMORY_PROFILE_FRAMES,
+    MEMORY_PROFILE_TOP
+)
+
+# Opt-in tracemalloc profile of a run, printed as one JSON line at the end of the run. Tracing slows allocations
+# down noticeably, so it is only turned on with TRADE_JOB_MEMORY_PROFILE=1.
+
+MEMORY_PROFILE_ENABLED = os.environ.get("TRADE_JOB_MEMORY_PROFILE", "0") == "1"
+
+current_memory_profile = contextvars.ContextVar("current_memory_profile", default=None)
+
+# tracemalloc is process wide, so it is started by the first profiled run and stopped after the last one
+tracing_lock = threading.Lock()
+tracing_runs = 0
+
+
+def start_tracing(frames):
+    global tracing_runs
+    with tracing_lock:
+        if tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            tracing_runs = 1
+        elif tracing_runs:
+            tracing_runs += 1
+
+
+def stop_tracing():
+    global tracing_runs
+    with tracing_lock:
+        if tracing_runs:
+            tracing_runs -= 1
+            if tracing_runs == 0:
+                tracemalloc.stop()
+
+
+def short_path(filename):
+    parts = filename.replace("\\", "/").split("/")
+    return "/".join(parts[-3:])
+
+
+def top_allocation_sites(snapshot, top):
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    return [{"site": f"{short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+             "size_kb": round(stat.size / 1024, 1),
+             "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:top]]
+
+
+def object_counts(top):
+    # Only objects the garbage collector tracks (containers and class instances, not str or float) are counted
+    counts = collections.Counter(type(item).__name__ for item in gc.get_objects())
+    return dict(counts.most_common(top))
+
+
+class MemoryProfile:
+    # Memory allocated during one run, measured from when the profile started. Each phase records the memory it
+    # left allocated and the peak reached while it ran. When a phase ends with more allocated than any before it,
+    # the largest allocation sites and the most numerous object types are recorded. Runs profiled at the same time
+    # share tracemalloc's peak, so per-phase peaks are only exact for one run at a time.
+
+    def __init__(self, top=MEMORY_PROFILE_TOP, frames=MEMORY_PROFILE_FRAMES):
+        self.top = top
+        self.frames = frames
+        self.baseline = 0
+        self.peak = 0
+        self.phases = {}
+        self.heaviest = None
+        self.heaviest_phase = None
+        self.overhead = 0
+        self.top_sites = []
+        self.object_counts = {}
+
+    def start(self):
+        start_tracing(self.frames)
+        tracemalloc.reset_peak()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+
+    def record_peak(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        self.peak = max(self.peak, peak - self.baseline)
+        return peak
+
+    def stop(self):
+        self.record_peak()
+        stop_tracing()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.record_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            current = tracemalloc.get_traced_memory()[0]
+            peak = self.record_peak()
+            phase = self.phases.setdefault(name, {"allocated_kb": 0.0, "peak_kb": 0.0})
+            phase["allocated_kb"] = round(phase["allocated_kb"] + (current - before) / 1024, 1)
+            phase["peak_kb"] = max(phase["peak_kb"], round((peak - self.baseline) / 1024, 1))
+            # What the profile itself keeps is left out when comparing phases
+            if self.heaviest is None or current - self.overhead > self.heaviest:
+                self.heaviest = current - self.overhead
+                self.heaviest_phase = name
+                self.top_sites = top_allocation_sites(tracemalloc.take_snapshot(), self.top)
+                self.object_counts = object_counts(self.top)
+                self.overhead += tracemalloc.get_traced_memory()[0] - current
+                tracemalloc.reset_peak()
+
+    @property
+    def peak_kb(self):
+        return round(self.peak / 1024, 1)
+
+    def report(self):
+        return {
+            "peak_kb": self.peak_kb,
+            "phases": self.phases,
+            "heaviest_phase": self.heaviest_phase,
+            "top_sites": self.top_sites,
+            "object_counts": self.object_counts
+        }
+
+
+@contextlib.contextmanager
+def memory_profile_scope(enabled=None, emit=True):
+    enabled = MEMORY_PROFILE_ENABLED if enabled is None else enabled
+    if not enabled:
+        yield None
+        return
+    profile = MemoryProfile()
+    profile.start()
+    token = current_memory_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_memory_profile.reset(token)
+        profile.stop()
+        if emit:
+            print(json.dumps({"MemoryProfile": profile.report()}))
+
+
+def memory_phase(name):
+    profile = current_memory_profile.get()
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.phase(name)
+
+
+def recommend_memory_mb(baseline_kb, peak_kb, headroom=MEMORY_HEADROOM_RATIO):
+    # The imports (baseline) plus the run's peak, with headroom on the whole of it, rounded up to a whole step. The
+    # baseline is the resident memory of a fresh interpreter after the imports (ru_maxrss from profile_imports),
+    # which is what Lambda measures. The peak is only what tracemalloc saw the run allocate, which leaves out memory
+    # that C extensions allocate themselves, so the headroom has to cover that too. Lambda gives a function CPU in
+    # proportion to its memory, so a run limited by CPU may still want more.
+    needed_mb = (baseline_kb + peak_kb) * headroom / 1024
+    return max(LAMBDA_MIN_MEMORY_MB, math.ceil(needed_mb / LAMBDA_MEMORY_STEP_MB) * LAMBDA_MEMORY_STEP_MB)
@@ -0,0 +1,138 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from src.constants import METRICS_NAMESPACE
+from src.memory_profiler import memory_phase
+
+# Set TRADE_JOB_METRICS=0 to turn the per-run metrics record off
+METRICS_ENABLED = os.environ.get("TRADE_JOB_METRICS", "1") != "0"
+
+
+def payload_size(payload):
+    # Number of items returned by a broker call: bars in a BarSet, or entries in a list
+    data = getattr(payload, "data", None)
+    if isinstance(data, dict):
+        return sum(len(bars) for bars in data.values())
+    if isinstance(payload, (list, tuple, dict)):
+        return len(payload)
+    return None
+
+
+class RunMetrics:
+    # Durations, counts and properties for one run, written out as a single CloudWatch Embedded Metric Format record
+
+    def __init__(self, dimensions, namespace=METRICS_NAMESPACE, clock=time.perf_counter):
+        self.dimensions = dimensions
+        self.namespace = namespace
+        self.clock = clock
+        self.durations = {}
+        self.counts = {}
+        self.properties = {}
+        # Broker calls made concurrently record into the same run
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        started_at = self.clock()
+        try:
+            yield
+        finally:
+            self.add_duration(name, (self.clock() - started_at) * 1000)
+
+    def add_duration(self, name, milliseconds):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0) + milliseconds
+
+    def add_count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def to_emf(self, timestamp_ms):
+        metric_values = {f"{name}Duration": round(value, 3) for name, value in self.durations.items()}
+        metric_values.update(self.counts)
+        definitions = [{"Name": name, "Unit": "Milliseconds"} for name in metric_values if name.endswith("Duration")]
+        definitions += [{"Name": name, "Unit": "Count"} for name in self.counts]
+        return {
+            "_aws": {
+                "Timestamp": timestamp_ms,
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [list(self.dimensions)],
+                    "Metrics": definitions
+                }]
+            },
+            **self.dimensions,
+            **self.properties,
+            **metric_values
+        }
+
+    def emit(self):
+        print(json.dumps(self.to_emf(int(time.time() * 1000)), default=str))
+
+
+current_metrics = contextvars.ContextVar("run_metrics", default=None)
+
+
+@contextlib.contextmanager
+def metrics_scope(dimensions, enabled=None):
+    # Collects everything recorded in the block, including on pool threads started through src.concurrency, and
+    # emits it as one record when the block exits
+    if not (METRICS_ENABLED if enabled is None else enabled):
+        yield None
+        return
+    metrics = RunMetrics(dimensions)
+    token = current_metrics.set(metrics)
+    try:
+        with metrics.span("Run"):
+            yield metrics
+    except Exception as e:
+        metrics.set_property("Error", type(e).__name__)
+        raise
+    finally:
+        current_metrics.reset(token)
+        metrics.emit()
+
+
+@contextlib.contextmanager
+def span(name):
+    # Phases are also traced when memory profiling is on
+    metrics = current_metrics.get()
+    with (metrics.span(name) if metrics is not None else contextlib.nullcontext()), memory_phase(name):
+        yield
+
+
+def record_call(name, milliseconds, payload):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return
+    metrics.add_duration(name, milliseconds)
+    metrics.add_count(f"{name}Calls")
+    size = payload_size(payload)
+    if size is not None:
+        metrics.add_count(f"{name}Items", size)
+
+
+def record_retries(retry_scope):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return
+    for name, counts in retry_scope.summary().items():
+        metrics.add_count(f"{name}Retries", counts["retries"])
+
+
+def set_property(name, value):
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.set_property(name, value)
+
+
+def add_count(name, value=1):
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.add_count(name, value)
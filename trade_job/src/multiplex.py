@@ -0,0 +1,103 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from alpaca.common.exceptions import APIError
+from requests import HTTPError, Response
+from src.shared_bar_cache import Flight
+from src.constants import MULTIPLEXED_JOB_WORKERS
+
+# Jobs run on their own pool, as each job's broker calls are made concurrently on src.concurrency's pool
+job_executor = ThreadPoolExecutor(max_workers=MULTIPLEXED_JOB_WORKERS)
+
+
+def position_not_found(symbol):
+    # Raised the way the SDK raises a 404 from get_open_position, so get_open_positions treats it the same way
+    response = Response()
+    response.status_code = 404
+    return APIError(json.dumps({"code": 40410000, "message": f"position does not exist for {symbol}"}),
+                    HTTPError(response=response))
+
+
+class SharedTradingClient:
+    # Wraps the trading client for the jobs of one multiplexed invocation. The account's positions are fetched once
+    # and every job's position lookup is answered from them, and identical order requests are made once. Results
+    # are kept for the rest of the invocation, as a run sees the broker as it was when the run started. A failed
+    # call is not kept, so a retry makes the call again. Order submission and everything else is passed through.
+
+    def __init__(self, trading_client):
+        self.trading_client = trading_client
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = {"calls": 0, "shared_calls": 0}
+
+    def __getattr__(self, name):
+        return getattr(self.trading_client, name)
+
+    def call_once(self, key, call):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared_calls"] += 1
+        if not leader:
+            return flight.wait()
+
+        try:
+            flight.value = call()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            with self.lock:
+                del self.flights[key]
+            raise
+        finally:
+            flight.done.set()
+
+    def get_all_positions(self):
+        return self.call_once("positions", self.trading_client.get_all_positions)
+
+    def get_open_position(self, symbol_or_asset_id):
+        for position in self.get_all_positions():
+            if position.symbol == symbol_or_asset_id:
+                return position
+        raise position_not_found(symbol_or_asset_id)
+
+    def get_orders(self, filter=None):
+        key = ("orders", None if filter is None else filter.model_dump_json())
+        return self.call_once(key, lambda: self.trading_client.get_orders(filter))
+
+    def get_order_by_id(self, order_id):
+        return self.call_once(("order", str(order_id)), lambda: self.trading_client.get_order_by_id(order_id))
+
+
+class SharedClients:
+    # Hands every job of a multiplexed invocation the same clients. If an authentication error makes the clients
+    # be refreshed, the jobs share the new clients from then on.
+
+    def __init__(self, get_clients):
+        self.get_clients = get_clients
+        self.lock = threading.Lock()
+        self.clients = None
+        self.shared_clients = None
+
+    def __call__(self):
+        clients = self.get_clients()
+        with self.lock:
+            if clients is not self.clients:
+                stock_client, trading_client = clients
+                self.clients = clients
+                self.shared_clients = (stock_client, SharedTradingClient(trading_client))
+            return self.shared_clients
+
+
+def job_outcome(job, result, error):
+    # The outcome is the job's payload for its next run. A job whose run failed keeps its previous status, so the
+    # run is made again on the next invocation.
+    outcome = {"jobParameters": job["jobParameters"], "jobInfo": job["jobInfo"], "jobStatus": result}
+    if error is not None:
+        outcome["jobStatus"] = job.get("jobStatus")
+        outcome["error"] = f"{type(error).__name__}: {error}"
+    return outcome
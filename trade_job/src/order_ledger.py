@@ -0,0 +1,189 @@
+import datetime
+from src.constants import ORDER_PAGE_LIMIT, ORDER_TIME_FORMAT, TERMINAL_ORDER_STATUSES
+from src.trade_helper import get_orders, get_order_by_id
+
+
+def format_order_time(time):
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return time.strftime(ORDER_TIME_FORMAT)
+
+
+def parse_order_time(time):
+    return datetime.datetime.strptime(time, ORDER_TIME_FORMAT)
+
+
+def order_time_before(time):
+    # The broker's "after" filter is exclusive, so orders at exactly `time` are only returned from just before it
+    return format_order_time(parse_order_time(time) - datetime.timedelta(microseconds=1))
+
+
+def enum_value(value):
+    return getattr(value, "value", value)
+
+
+def realize_fill(positions, symbol, side, qty, notional):
+    # Realized profit/loss is taken at average cost: buys add to the symbol's quantity and cost basis, sells realize
+    # their price less the average cost. Returns what the fill realized.
+    position = positions.setdefault(symbol, {"qty": 0.0, "cost_basis": 0.0})
+    if side == "buy":
+        position["qty"] += qty
+        position["cost_basis"] += notional
+    if side == "sell":
+        # Shares the job did not buy itself have no known cost, so selling them realizes nothing
+        matched_qty = min(qty, position["qty"])
+        if matched_qty > 0:
+            average_cost = position["cost_basis"] / position["qty"]
+            position["cost_basis"] -= average_cost * matched_qty
+            position["qty"] -= matched_qty
+            return (notional / qty - average_cost) * matched_qty
+    return 0.0
+
+
+class OrderLedger:
+    # Running realized profit/loss for a job's orders (one symbol, or a list of symbols for a batch job), kept up
+    # to date from a cursor on order submission time. Orders that have not reached a terminal status are tracked by
+    # id so later fills are still counted.
+
+    def __init__(self, symbol, cursor, realized_pl=0.0, cursor_order_ids=None, open_orders=None, positions=None,
+                 start=None):
+        self.symbol = symbol
+        self.cursor = cursor
+        # The job's start time, which the cursor starts from. No order of the job was submitted before it.
+        self.start = start or cursor
+        self.realized_pl = realized_pl
+        # Quantity and cost basis bought by this job per symbol, used to realize sells at average cost
+        self.positions = positions or {}
+        self.cursor_order_ids = set(cursor_order_ids or [])
+        self.open_orders = open_orders or {}
+        self.stats = {"fetched_orders": 0, "refreshed_orders": 0}
+
+    @staticmethod
+    def key(symbol, job_start_time):
+        if isinstance(symbol, list):
+            symbol = ",".join(symbol)
+        return f"ledger/{symbol}/{job_start_time}"
+
+    @classmethod
+    def load(cls, store, symbol, job_start_time):
+        state = store.load(cls.key(symbol, job_start_time))
+        if state is None:
+            return cls(symbol, job_start_time)
+        return cls.from_state(state)
+
+    def save(self, store, job_start_time):
+        store.save(self.key(self.symbol, job_start_time), self.to_state())
+
+    def to_state(self):
+        return {
+            "symbol": self.symbol,
+            "start": self.start,
+            "cursor": self.cursor,
+            "realized_pl": self.realized_pl,
+            "cursor_order_ids": sorted(self.cursor_order_ids),
+            "open_orders": self.open_orders,
+            "positions": self.positions
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["symbol"],
+                   state["cursor"],
+                   state["realized_pl"],
+                   state["cursor_order_ids"],
+                   state["open_orders"],
+                   state["positions"],
+                   state["start"])
+
+    def apply(self, order):
+        order_id = str(order.id)
+        filled_qty = float(order.filled_qty or 0)
+        filled_notional = filled_qty * float(order.filled_avg_price or 0)
+
+        # Only the fill that has happened since the order was last seen is added to the running total
+        previous = self.open_orders.pop(order_id, None)
+        qty_change = filled_qty - (previous["filled_qty"] if previous else 0)
+        notional_change = filled_notional - (previous["filled_notional"] if previous else 0)
+        if qty_change > 0:
+            self.apply_fill(order.symbol, order.side, qty_change, notional_change)
+
+        if order.status not in TERMINAL_ORDER_STATUSES:
+            self.open_orders[order_id] = {
+                "id": order_id,
+                "symbol": order.symbol,
+                "side": enum_value(order.side),
+                "status": enum_value(order.status),
+                "filled_qty": filled_qty,
+                "filled_notional": filled_notional
+            }
+
+    def apply_fill(self, symbol, side, qty, notional):
+        self.realized_pl += realize_fill(self.positions, symbol, side, qty, notional)
+
+    def advance_cursor(self, order):
+        submitted_at = format_order_time(order.submitted_at)
+        if parse_order_time(submitted_at) > parse_order_time(self.cursor):
+            self.cursor = submitted_at
+            self.cursor_order_ids = {str(order.id)}
+        elif submitted_at == self.cursor:
+            self.cursor_order_ids.add(str(order.id))
+
+    def refresh_open_orders(self, trading_client):
+        # Open orders are almost always among the newest, so they are read from one query over the symbols' orders
+        # since the job started, newest first, paging back until each has been seen. Any the pages missed, such as one
+        # sharing a page's oldest timestamp, is fetched by id.
+        remaining = set(self.open_orders)
+        until = None
+        while remaining:
+            page = get_orders(trading_client, self.symbol, "all", order_time_before(self.start),
+                              limit=ORDER_PAGE_LIMIT, direction="desc", until=until)
+            for order in page:
+                if str(order.id) in remaining:
+                    remaining.discard(str(order.id))
+                    self.stats["refreshed_orders"] += 1
+                    self.apply(order)
+            if len(page) < ORDER_PAGE_LIMIT:
+                break
+            until = page[-1].submitted_at
+        for order_id in remaining:
+            self.stats["refreshed_orders"] += 1
+            self.apply(get_order_by_id(trading_client, order_id))
+
+    def fetch_new_orders(self, trading_client):
+        # Pages back from the newest order to the cursor, each page ending at the oldest submission time the one before
+        # reached, then applies the new orders oldest first. Orders at the cursor's own time that were already applied
+        # are skipped, however many of them there are.
+        new_orders = {}
+        until = None
+        while True:
+            page = get_orders(trading_client, self.symbol, "all", order_time_before(self.cursor),
+                              limit=ORDER_PAGE_LIMIT, direction="desc", until=until)
+            added = 0
+            for order in page:
+                order_id = str(order.id)
+                if order_id not in self.cursor_order_ids and order_id not in new_orders:
+                    new_orders[order_id] = order
+                    added += 1
+            if len(page) < ORDER_PAGE_LIMIT:
+                break
+            # The broker's "until" filter is exclusive, so the next page starts at the oldest time again, which the
+            # orders already collected are skipped from. A page entirely of orders already collected has to move past
+            # that time to make progress.
+            until = page[-1].submitted_at
+            if added:
+                until += datetime.timedelta(microseconds=1)
+        for order in sorted(reversed(list(new_orders.values())), key=lambda order: order.submitted_at):
+            self.stats["fetched_orders"] += 1
+            self.apply(order)
+            self.advance_cursor(order)
+
+    def update(self, trading_client):
+        self.refresh_open_orders(trading_client)
+        self.fetch_new_orders(trading_client)
+        print(f"Order ledger updated, realized profit/loss is ${self.realized_pl}, "
+              f"{len(self.open_orders)} open orders tracked")
+        return self
+
+    def get_open_orders(self, side=None, symbol=None):
+        return [order for order in self.open_orders.values()
+                if (side is None or order["side"] == side) and (symbol is None or order["symbol"] == symbol)]
@@ -0,0 +1,62 @@
+import contextvars
+import uuid
+from alpaca.common.exceptions import APIError
+from src.concurrency import ConcurrentCallError, executor
+from src.metrics import add_count
+from src.constants import DUPLICATE_CLIENT_ORDER_ID_MESSAGE
+
+# Orders a run places are given a client_order_id derived from the job, the run and what the order is for. Alpaca
+# refuses a second order with an id it has already seen, so a retried invocation cannot place the same order twice.
+
+CLIENT_ORDER_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "trade-job/client-order-id")
+
+
+def client_order_id(job_start_time, run_count, intent, symbol):
+    return str(uuid.uuid5(CLIENT_ORDER_ID_NAMESPACE, f"{job_start_time}/{run_count}/{intent}/{symbol}"))
+
+
+def is_duplicate_order(error):
+    return (isinstance(error, APIError) and error.status_code == 422
+            and DUPLICATE_CLIENT_ORDER_ID_MESSAGE in str(error))
+
+
+class OrderPipeline:
+    # The orders of one run. Each is submitted on the shared pool as soon as it is asked for while the run carries
+    # on, so orders asked for together go out as one round of concurrent requests. confirm() waits for the broker
+    # to acknowledge them and is called before the run returns. An intent asked for twice in a run is only
+    # submitted once.
+
+    def __init__(self, job_start_time, run_count, pool=None):
+        self.job_start_time = job_start_time
+        self.run_count = run_count
+        self.pool = pool or executor
+        self.submissions = {}
+
+    def submit(self, intent, symbol, submit):
+        # submit is called with the order's client_order_id and returns the order the broker acknowledged
+        order_id = client_order_id(self.job_start_time, self.run_count, intent, symbol)
+        if order_id in self.submissions:
+            print(f"A {intent} order for {symbol} was already submitted in this run")
+            return order_id
+        future = self.pool.submit(contextvars.copy_context().run, submit, order_id)
+        self.submissions[order_id] = (intent, symbol, future)
+        return order_id
+
+    def confirm(self):
+        # Returns the acknowledged orders by client_order_id. If any submission failed, the errors are raised
+        # together once every submission has finished; resubmitting the run is safe.
+        acknowledged = {}
+        errors = {}
+        for order_id, (intent, symbol, future) in self.submissions.items():
+            try:
+                acknowledged[order_id] = future.result()
+            except Exception as e:
+                print(f"Error submitting {intent} order for {symbol}, message: {e}")
+                errors[f"{intent} {symbol}"] = e
+        self.submissions = {}
+        if acknowledged:
+            print(f"Broker acknowledged {len(acknowledged)} orders")
+            add_count("OrdersAcknowledged", len(acknowledged))
+        if errors:
+            raise ConcurrentCallError(errors) from next(iter(errors.values()))
+        return acknowledged
@@ -0,0 +1,265 @@
+import collections
+import contextlib
+import copy
+import os
+import pickle
+import sys
+import threading
+import time
+from alpaca.common.exceptions import APIError
+from requests import HTTPError, Response
+from src.clock import current_clock_function, use_clock
+from src.constants import RECORDED_CALLS
+
+# Records every response a job's runs receive from the broker and data APIs, along with the time each run read as
+# "now", and replays them. A replayed run gets the recorded responses in place of API calls and the recorded times
+# in place of the clock, so a whole job replays in seconds and makes the same decisions it made live. Calls are
+# matched by method and arguments rather than by order, as a run makes some of them at the same time.
+
+
+class ReplayMismatch(Exception):
+    pass
+
+
+def describe(value):
+    # The fields of request objects, so the key does not depend on an object's address
+    if isinstance(value, dict):
+        return {key: describe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [describe(item) for item in value]
+    if hasattr(value, "model_dump"):
+        return describe(value.model_dump())
+    if hasattr(value, "__dict__") and not isinstance(value, type):
+        return describe(vars(value))
+    return value
+
+
+def call_key(method, args, kwargs):
+    return f"{method}{describe(args)!r}{sorted(describe(kwargs).items())!r}"
+
+
+def encode_error(error):
+    # APIError keeps the status code on the HTTP error, which does not survive pickling, so it is stored alongside
+    if isinstance(error, APIError):
+        return "api_error", (str(error), error.status_code)
+    return "error", error
+
+
+def decode_outcome(outcome):
+    kind, value = outcome
+    if kind == "api_error":
+        message, status_code = value
+        response = Response()
+        response.status_code = status_code
+        raise APIError(message, HTTPError(response=response))
+    if kind == "error":
+        raise copy.copy(value)
+    return copy.deepcopy(value)
+
+
+class RunRecording:
+    # One run: its handler and event, the responses to its calls, the clock readings and what it returned
+
+    def __init__(self, handler, event):
+        self.handler = handler
+        self.event = event
+        self.calls = collections.defaultdict(list)
+        self.clock_readings = []
+        self.outcome = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def record(self, key, outcome):
+        with self.lock:
+            self.calls[key].append(outcome)
+
+    def recording_clock(self, clock):
+        def read():
+            value = clock()
+            with self.lock:
+                self.clock_readings.append(value)
+            return value
+        return read
+
+
+class RecordingClient:
+    # Passes calls through to the client, recording what comes back
+
+    def __init__(self, client, recording):
+        self.client = client
+        self.recording = recording
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name not in RECORDED_CALLS:
+            return attribute
+
+        def call(*args, **kwargs):
+            key = call_key(name, args, kwargs)
+            try:
+                response = attribute(*args, **kwargs)
+            except Exception as e:
+                self.recording.record(key, encode_error(e))
+                raise
+            self.recording.record(key, ("response", response))
+            return response
+        return call
+
+
+class Recorder:
+    # Appends each run to the file as it finishes, so a job that is stopped part way still leaves its runs
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, handler, event, run, clients):
+        recording = RunRecording(handler, copy.deepcopy(event))
+
+        def recording_clients():
+            return tuple(RecordingClient(client, recording) for client in clients())
+
+        try:
+            with use_clock(recording.recording_clock(current_clock_function())):
+                result = run(recording_clients)
+            recording.outcome = ("response", copy.deepcopy(result))
+            return result
+        except Exception as e:
+            recording.outcome = encode_error(e)
+            raise
+        finally:
+            with self.lock, open(self.path, "ab") as f:
+                pickle.dump(recording, f)
+
+
+def load_recording(path, job_start_time=None):
+    # The runs in the file in the order they were recorded, only those of one job if job_start_time is given
+    runs = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                recording = pickle.load(f)
+            except EOFError:
+                break
+            if job_start_time is None or recording.event["jobInfo"] == job_start_time:
+                runs.append(recording)
+    return runs
+
+
+class ReplayRun:
+    # Serves one run's recorded responses and clock readings
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.calls = {key: collections.deque(outcomes) for key, outcomes in recording.calls.items()}
+        self.clock_readings = collections.deque(recording.clock_readings)
+        self.last_reading = recording.clock_readings[-1] if recording.clock_readings else None
+        self.lock = threading.Lock()
+
+    def call(self, key):
+        with self.lock:
+            outcomes = self.calls.get(key)
+            if not outcomes:
+                raise ReplayMismatch(f"Call was not recorded: {key}")
+            outcome = outcomes.popleft()
+        return decode_outcome(outcome)
+
+    def clock(self):
+        with self.lock:
+            if self.clock_readings:
+                self.last_reading = self.clock_readings.popleft()
+            if self.last_reading is None:
+                raise ReplayMismatch("Run read the clock, but no clock readings were recorded")
+            return self.last_reading
+
+    def unused_calls(self):
+        return [key for key, outcomes in self.calls.items() for _ in outcomes]
+
+
+class ReplayClient:
+
+    def __init__(self, replay_run):
+        self.replay_run = replay_run
+
+    def __getattr__(self, name):
+        if name not in RECORDED_CALLS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.replay_run.call(call_key(name, args, kwargs))
+
+
+@contextlib.contextmanager
+def replay_environment():
+    # Replayed runs start from empty state and skip everything that could answer a request without a recorded
+    # call: the bar caches, the trade-updates stream and retry backoff sleeps
+    from src import trade_run
+    from src.retry import default_policy
+    from src.state_store import InMemoryStateStore
+    replaced = {"state_store": InMemoryStateStore(), "bar_store": None, "use_bar_store": False,
+                "shared_bar_cache": None, "trade_state": None, "recorder": None}
+    held = {name: getattr(trade_run, name) for name in replaced}
+    held_sleep = default_policy.sleep
+    for name, value in replaced.items():
+        setattr(trade_run, name, value)
+    default_policy.sleep = lambda delay: None
+    try:
+        yield trade_run
+    finally:
+        for name, value in held.items():
+            setattr(trade_run, name, value)
+        default_policy.sleep = held_sleep
+
+
+def replay_job(runs):
+    # Runs a recorded job again, passing each run's jobStatus to the next as the Step Function does. Raises
+    # ReplayMismatch at the first run that makes a call that was not recorded, leaves a recorded call unmade or
+    # returns something other than what it returned when recorded. Returns each run's result.
+    results = []
+    with replay_environment() as trade_run:
+        event = copy.deepcopy(runs[0].event) if runs else None
+        for run_number, recording in enumerate(runs, 1):
+            replay_run = ReplayRun(recording)
+            clients = (ReplayClient(replay_run), ReplayClient(replay_run))
+            with use_clock(replay_run.clock):
+                try:
+                    outcome = ("response", trade_run.run_with_cached_clients(
+                        getattr(trade_run, recording.handler), event, None, lambda: clients))
+                except ReplayMismatch as e:
+                    raise ReplayMismatch(f"Run {run_number}: {e}")
+                except Exception as e:
+                    outcome = encode_error(e)
+            if replay_run.unused_calls():
+                raise ReplayMismatch(f"Run {run_number} did not make recorded calls: {replay_run.unused_calls()}")
+            if repr(outcome) != repr(recording.outcome):
+                raise ReplayMismatch(f"Run {run_number} returned {outcome}, recorded {recording.outcome}")
+            kind, result = outcome
+            results.append(result)
+            if kind == "response":
+                event = dict(event, jobStatus=result)
+    return results
+
+
+def create_recorder(path=None):
+    # Off unless TRADE_JOB_RECORD is set to the file the runs are appended to
+    path = os.environ.get("TRADE_JOB_RECORD") if path is None else path
+    if not path:
+        return None
+    return Recorder(path)
+
+
+def main(path, job_start_time=None):
+    runs = load_recording(path, job_start_time)
+    started_at = time.perf_counter()
+    results = replay_job(runs)
+    print(f"Replayed {len(results)} runs in {time.perf_counter() - started_at:.2f}s, every run matched the recording")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
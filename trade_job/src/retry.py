@@ -0,0 +1,158 @@
+import collections
+import contextlib
+import contextvars
+import random
+import threading
+import time
+from alpaca.common.exceptions import APIError
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+from src.metrics import record_call
+from src.constants import (
+    MAX_RETRIES,
+    RETRY_BASE_DELAY_SECONDS,
+    RETRY_MAX_DELAY_SECONDS,
+    RETRY_DEADLINE_MARGIN_SECONDS,
+    RETRYABLE_STATUS_CODES
+)
+
+
+def is_retryable(error):
+    # Rate limits, server errors and network failures may succeed on a later attempt; any other API error
+    # (bad request, auth, not found, not cancelable) will not
+    if isinstance(error, APIError):
+        return error.status_code is None or error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (RequestsConnectionError, Timeout, ConnectionError, TimeoutError))
+
+
+def is_retryable_before_sent(error):
+    # For calls such as order submission a retry is only safe if the first request cannot have been acted on:
+    # it was rate limited, or the connection was never made
+    if isinstance(error, APIError):
+        return error.status_code == 429
+    return isinstance(error, RequestsConnectionError) and not isinstance(error, Timeout)
+
+
+class RetryScope:
+    # The retry budget of one run: retries stop once they would run into the margin before the deadline. Retry
+    # counts are recorded per call name.
+
+    def __init__(self, deadline=None, clock=time.monotonic):
+        self.deadline = deadline
+        self.clock = clock
+        self.calls = collections.Counter()
+        self.retries = collections.Counter()
+        self.exhausted = collections.Counter()
+        # Calls made concurrently share the scope
+        self.lock = threading.Lock()
+
+    def record(self, counter, name):
+        with self.lock:
+            counter[name] += 1
+
+    @classmethod
+    def from_context(cls, context, margin=RETRY_DEADLINE_MARGIN_SECONDS, clock=time.monotonic):
+        if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+            return cls(clock=clock)
+        return cls(clock() + context.get_remaining_time_in_millis() / 1000 - margin, clock)
+
+    def time_left(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - self.clock()
+
+    def summary(self):
+        return {name: {"calls": self.calls[name], "retries": self.retries[name]} for name in self.calls}
+
+
+class AttemptTimer:
+    # When the latest attempt of a call (or the backoff before it) started. src.concurrency times out each attempt
+    # rather than the whole call, so retries the run's budget allows are not cut off.
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started_at = clock()
+
+    def restart(self):
+        self.started_at = self.clock()
+
+
+current_attempt = contextvars.ContextVar("attempt_timer", default=None)
+
+
+def restart_attempt_timer():
+    timer = current_attempt.get()
+    if timer is not None:
+        timer.restart()
+
+
+class RetryPolicy:
+
+    def __init__(self, max_attempts=MAX_RETRIES, base_delay=RETRY_BASE_DELAY_SECONDS,
+                 max_delay=RETRY_MAX_DELAY_SECONDS, sleep=time.sleep, jitter=random.random):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        # Full jitter: a random delay up to the exponential backoff for this attempt
+        return self.jitter() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    def call(self, scope, name, function, *args, classifier=is_retryable, **kwargs):
+        scope.record(scope.calls, name)
+        attempt = 0
+        while True:
+            restart_attempt_timer()
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if not classifier(e):
+                    raise
+                if attempt >= self.max_attempts:
+                    print(f"Error during {name}, all {self.max_attempts} attempts failed, message: {e}")
+                    scope.record(scope.exhausted, name)
+                    raise
+                delay = self.delay(attempt - 1)
+                time_left = scope.time_left()
+                if time_left is not None and delay >= time_left:
+                    print(f"Error during {name}, no time left to retry before the deadline, message: {e}")
+                    scope.record(scope.exhausted, name)
+                    raise
+                print(f"Error during {name}, message: {e}. Retrying in {delay:.2f}s...")
+                scope.record(scope.retries, name)
+                restart_attempt_timer()
+                self.sleep(delay)
+
+
+default_policy = RetryPolicy()
+current_scope = contextvars.ContextVar("retry_scope", default=None)
+
+
+@contextlib.contextmanager
+def retry_scope(context=None):
+    # Sets the retry budget for every broker call made in the block, including calls made on pool threads
+    # through src.concurrency
+    scope = RetryScope.from_context(context)
+    token = current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        current_scope.reset(token)
+        retried = {name: counts for name, counts in scope.summary().items() if counts["retries"]}
+        if retried:
+            print(f"Broker call retries: {retried}")
+
+
+def call_with_retry(name, function, *args, classifier=is_retryable, **kwargs):
+    scope = current_scope.get()
+    if scope is None:
+        scope = RetryScope()
+    started_at = time.perf_counter()
+    result = None
+    try:
+        result = default_policy.call(scope, name, function, *args, classifier=classifier, **kwargs)
+        return result
+    finally:
+        record_call(name, (time.perf_counter() - started_at) * 1000, result)
@@ -0,0 +1,149 @@
+import asyncio
+import datetime
+import json
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from src.constants import ORDER_TIME_FORMAT, SCHEDULER_INTERVAL_SECONDS, SCHEDULER_MAX_WORKERS
+
+
+class SchedulerContext:
+    # Stands in for the Lambda context so a run can see how long it has before the next tick
+
+    def __init__(self, deadline, clock):
+        self.deadline = deadline
+        self.clock = clock
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - self.clock()) * 1000))
+
+
+class TradeJob:
+    def __init__(self, job_id, event):
+        self.job_id = job_id
+        self.event = event
+        self.job_status = event.get("jobStatus")
+        self.max_runs = event["jobParameters"].get("maxRuns")
+        self.run_count = 0
+        self.running = False
+        self.finished = False
+        self.cancelled = False
+        self.error = None
+
+
+class TradeJobScheduler:
+    # Runs many trade jobs in one process, triggering each job's run on exact interval boundaries in place of the
+    # Step Function Wait/Lambda Invoke loop. Job status is carried between runs in memory.
+
+    def __init__(self, run_job=None, clock=time.time, sleep=asyncio.sleep, interval=SCHEDULER_INTERVAL_SECONDS,
+                 max_workers=SCHEDULER_MAX_WORKERS):
+        if run_job is None:
+            from src.trade_run import start_trade_run
+            run_job = start_trade_run
+        self.run_job = run_job
+        self.clock = clock
+        self.sleep = sleep
+        self.interval = interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = {}
+        self.tasks = set()
+        self.stats = {"ticks": 0, "runs": 0, "missed_ticks": 0, "skipped_runs": 0, "failed_runs": 0}
+
+    def add_job(self, event, job_id=None):
+        job_id = job_id or str(uuid.uuid4())
+        if "jobInfo" not in event:
+            job_start_time = datetime.datetime.fromtimestamp(self.clock(), datetime.timezone.utc)
+            event = {**event, "jobInfo": job_start_time.replace(tzinfo=None).strftime(ORDER_TIME_FORMAT)}
+        self.jobs[job_id] = TradeJob(job_id, event)
+        return job_id
+
+    def cancel_job(self, job_id):
+        job = self.jobs[job_id]
+        job.cancelled = True
+        job.finished = True
+        print(f"Trade job {job_id} cancelled")
+
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if not job.finished]
+
+    def next_tick(self, now):
+        return (int(now // self.interval) + 1) * self.interval
+
+    async def run(self, max_ticks=None):
+        ticks = 0
+        while self.active_jobs() and (max_ticks is None or ticks < max_ticks):
+            tick_time = self.next_tick(self.clock())
+            await self.sleep(tick_time - self.clock())
+            if not self.active_jobs():
+                break
+            now = self.clock()
+            if now >= tick_time + self.interval:
+                missed = int((now - tick_time) // self.interval)
+                print(f"Scheduler woke {now - tick_time:.3f}s late, {missed} ticks missed")
+                self.stats["missed_ticks"] += missed
+                tick_time += missed * self.interval
+            self.tick(tick_time)
+            ticks += 1
+            # Let the new runs start before sleeping again
+            await asyncio.sleep(0)
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def tick(self, tick_time):
+        self.stats["ticks"] += 1
+        for job in self.active_jobs():
+            if job.running:
+                # A run that is still going when the next tick arrives is not started twice
+                print(f"Trade job {job.job_id} still running, skipping tick")
+                self.stats["skipped_runs"] += 1
+                continue
+            job.running = True
+            task = asyncio.ensure_future(self.run_once(job, tick_time))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_once(self, job, tick_time):
+        event = {**job.event, "jobStatus": job.job_status}
+        context = SchedulerContext(tick_time + self.interval, self.clock)
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, self.run_job, event, context)
+        except Exception as e:
+            print(f"Trade job {job.job_id} run failed, message: {e}")
+            self.stats["failed_runs"] += 1
+            job.error = e
+            job.finished = True
+            return
+        finally:
+            job.running = False
+        self.stats["runs"] += 1
+        job.run_count += 1
+        if job.cancelled:
+            return
+        job.job_status = result
+        if result.get("cancelTradeJob") == 1:
+            print(f"Trade job {job.job_id} returned cancellation indicator")
+            job.finished = True
+        elif job.max_runs is not None and job.run_count >= job.max_runs:
+            print(f"Trade job {job.job_id} reached maxRuns")
+            job.finished = True
+
+
+def main(path):
+    with open(path) as f:
+        events = json.load(f)
+    scheduler = TradeJobScheduler()
+    for event in events:
+        scheduler.add_job(event)
+    try:
+        asyncio.run(scheduler.run())
+    finally:
+        scheduler.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
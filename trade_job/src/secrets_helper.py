@@ -8,17 +8,18 @@ from botocore.exceptions import ClientError
 import json
 
 
-def get_secret():
+def get_secret(client=None):
 
     secret_name = "trading_bot"
     region_name = "eu-west-1"
 
     # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
+    if client is None:
+        session = boto3.session.Session()
+        client = session.client(
+            service_name='secretsmanager',
+            region_name=region_name
+        )
 
     try:
         get_secret_value_response = client.get_secret_value(
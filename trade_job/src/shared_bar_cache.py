@@ -0,0 +1,325 @@
+import collections
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from array import array
+from src.metrics import add_count
+from src.trade_helper import empty_bars, to_epoch_ns
+from src.constants import (
+    BAR_COLUMNS,
+    SHARED_BAR_CACHE_DIR,
+    SHARED_BAR_CACHE_LOCK_SECONDS,
+    SHARED_BAR_CACHE_MAX_ENTRIES,
+    SHARED_BAR_CACHE_POLL_SECONDS,
+    SHARED_BAR_CACHE_TTL_SECONDS
+)
+
+NANOSECONDS_PER_MINUTE = 60 * 1_000_000_000
+
+
+class InMemoryBarCacheBackend:
+    # Entries expire after their ttl, and the least recently used ones are evicted beyond max_entries
+
+    def __init__(self, max_entries=SHARED_BAR_CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def live_entry(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and self.clock() >= entry[1]:
+            del self.entries[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self.lock:
+            entry = self.live_entry(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, ttl):
+        self.entries[key] = (value, self.clock() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.put(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        # Sets the key only if it is not already set, returning whether it was
+        with self.lock:
+            if self.live_entry(key) is not None:
+                return False
+            self.put(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class FileBarCacheBackend:
+    # Shared by every process that can see the directory. Reads refresh a file's modification time, so the least
+    # recently used files are the ones removed beyond max_entries.
+
+    def __init__(self, directory=SHARED_BAR_CACHE_DIR, max_entries=SHARED_BAR_CACHE_MAX_ENTRIES, clock=time.time):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.clock = clock
+
+    def path(self, key):
+        file_name = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+        return os.path.join(self.directory, f"{file_name}.json")
+
+    def read(self, path):
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if self.clock() >= entry["expires_at"]:
+            self.remove(path)
+            return None
+        return entry
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        path = self.path(key)
+        entry = self.read(path)
+        if entry is None:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry["value"]
+
+    def set(self, key, value, ttl):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"expires_at": self.clock() + ttl, "value": value}, f)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def add(self, key, value, ttl):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        # An expired entry is removed first so a lock left behind by a process that died does not block the key
+        self.read(path)
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(descriptor, "w") as f:
+            json.dump({"expires_at": self.clock() + ttl, "value": value}, f)
+        return True
+
+    def delete(self, key):
+        self.remove(self.path(key))
+
+    def evict(self):
+        with os.scandir(self.directory) as entries:
+            files = [(entry.stat().st_mtime, entry.path) for entry in entries if entry.name.endswith(".json")]
+        if len(files) <= self.max_entries:
+            return
+        for _, path in sorted(files)[:len(files) - self.max_entries]:
+            self.remove(path)
+
+
+class RedisBarCacheBackend:
+    # Takes a redis-py client, or anything with the same get, set and delete methods. Expiry is left to Redis,
+    # and eviction to its maxmemory policy.
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, json.dumps(value), px=int(ttl * 1000))
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, json.dumps(value), px=int(ttl * 1000), nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+def create_backend(setting=None):
+    # TRADE_JOB_BAR_CACHE selects the backend: memory (the default), file, a redis:// URL, or off
+    setting = setting if setting is not None else os.environ.get("TRADE_JOB_BAR_CACHE", "memory")
+    if setting == "off":
+        return None
+    if setting == "memory":
+        return InMemoryBarCacheBackend()
+    if setting == "file":
+        return FileBarCacheBackend()
+    if setting.startswith(("redis://", "rediss://")):
+        import redis
+        return RedisBarCacheBackend(redis.Redis.from_url(setting))
+    raise ValueError(f"Unknown bar cache backend {setting}")
+
+
+def minute_range_key(kind, symbols, start, end):
+    # Bars are stamped on whole minutes, so a range covers the same bars as its start rounded up and its end rounded
+    # down to the minute. Requests made at different seconds of the same minute share a key.
+    symbols = [symbols] if isinstance(symbols, str) else sorted(symbols)
+    start_minute = -(-to_epoch_ns(start) // NANOSECONDS_PER_MINUTE)
+    end_minute = to_epoch_ns(end) // NANOSECONDS_PER_MINUTE
+    return f"{kind}/{','.join(symbols)}/{start_minute}/{end_minute}"
+
+
+def encode_closes(closes):
+    timestamps, values = closes
+    return {"timestamps": list(timestamps), "closes": list(values)}
+
+
+def decode_closes(value):
+    return array("q", value["timestamps"]), array("d", value["closes"])
+
+
+def encode_bars(bars):
+    symbols = bars.index.get_level_values("symbol")
+    timestamps = bars.index.get_level_values("timestamp")
+    return {
+        "symbols": list(symbols),
+        "timestamps": [int(timestamp) for timestamp in timestamps.asi8],
+        "values": bars[BAR_COLUMNS].values.tolist()
+    }
+
+
+def decode_bars(value):
+    import pandas as pd
+    if not value["symbols"]:
+        return empty_bars()
+    index = pd.MultiIndex.from_arrays([value["symbols"], pd.to_datetime(value["timestamps"], unit="ns", utc=True)],
+                                      names=["symbol", "timestamp"])
+    return pd.DataFrame(value["values"], index=index, columns=BAR_COLUMNS, dtype=float)
+
+
+class Flight:
+    # One fetch in progress, which the other callers asking for the same key wait on
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SharedBarCache:
+    # Bar responses shared between the jobs that request the same symbols and minute range. Within a process,
+    # callers asking for a key that is already being fetched wait for that fetch rather than starting their own.
+    # Across processes the fetching process holds a lock entry in the backend, and the others poll for its result.
+
+    def __init__(self, backend, ttl=SHARED_BAR_CACHE_TTL_SECONDS, lock_ttl=SHARED_BAR_CACHE_LOCK_SECONDS,
+                 poll_interval=SHARED_BAR_CACHE_POLL_SECONDS, clock=time.monotonic, sleep=time.sleep):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.sleep = sleep
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "lock_timeouts": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+        add_count(f"BarCache{name.title().replace('_', '')}")
+
+    def get_closes(self, symbol, start, end, fetcher):
+        return self.get(minute_range_key("closes", symbol, start, end), fetcher, encode_closes, decode_closes)
+
+    def get_bars(self, symbols, start, end, fetcher):
+        return self.get(minute_range_key("bars", symbols, start, end), fetcher, encode_bars, decode_bars)
+
+    def get(self, key, fetcher, encode, decode):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            self.count("coalesced")
+            # A fetch that is slow or retrying is only waited on as long as another process's lock would be
+            if not flight.done.wait(self.lock_ttl):
+                print(f"Timed out waiting for another fetch of {key}, fetching it directly")
+                self.count("lock_timeouts")
+                return fetcher()
+            return flight.wait()
+
+        try:
+            flight.value = self.load_or_fetch(key, fetcher, encode, decode)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def load_or_fetch(self, key, fetcher, encode, decode):
+        cached = self.backend.get(key)
+        if cached is not None:
+            self.count("hits")
+            return decode(cached)
+
+        lock_key = f"{key}/lock"
+        deadline = self.clock() + self.lock_ttl
+        locked = self.backend.add(lock_key, str(uuid.uuid4()), self.lock_ttl)
+        while not locked:
+            # Another process is fetching the same range
+            self.sleep(self.poll_interval)
+            cached = self.backend.get(key)
+            if cached is not None:
+                self.count("coalesced")
+                return decode(cached)
+            if self.clock() >= deadline:
+                print(f"Timed out waiting for another fetch of {key}, fetching it directly")
+                self.count("lock_timeouts")
+                break
+            locked = self.backend.add(lock_key, str(uuid.uuid4()), self.lock_ttl)
+
+        self.count("misses")
+        try:
+            value = fetcher()
+            self.backend.set(key, encode(value), self.ttl)
+        finally:
+            if locked:
+                self.backend.delete(lock_key)
+        return value
+
+
+def create_shared_bar_cache(setting=None):
+    backend = create_backend(setting)
+    if backend is None:
+        return None
+    return SharedBarCache(backend)
@@ -0,0 +1,63 @@
+import collections
+import subprocess
+import sys
+
+# Imports a module in a fresh interpreter, the same as a Lambda cold start, and reports how long each imported
+# module took using Python's -X importtime output.
+# Run from trade_job/: python -m src.startup_profiler [module] [top]
+
+PEAK_MEMORY_SNIPPET = "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def parse_import_times(output):
+    # Each line is "import time: <self us> | <cumulative us> | <indented module name>"
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative_time, name = line[len("import time:"):].split("|")
+        imports.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_time),
+            "cumulative_us": int(cumulative_time)
+        })
+    return imports
+
+
+def totals_by_package(imports):
+    totals = collections.Counter()
+    for entry in imports:
+        totals[entry["module"].split(".")[0]] += entry["self_us"]
+    return totals
+
+
+def profile_imports(module, python=sys.executable):
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}; {PEAK_MEMORY_SNIPPET}"],
+                            capture_output=True, text=True, check=True)
+    imports = parse_import_times(result.stderr)
+    return {
+        "module": module,
+        "imports": imports,
+        "total_us": sum(entry["self_us"] for entry in imports),
+        "peak_memory_kb": int(result.stdout.split()[-1])
+    }
+
+
+def print_report(profile, top=20):
+    print(f"Importing {profile['module']} took {profile['total_us'] / 1000:.1f}ms across "
+          f"{len(profile['imports'])} modules, peak memory {profile['peak_memory_kb'] / 1024:.1f}MB")
+    print("\nSlowest modules (cumulative, including their own imports):")
+    for entry in sorted(profile["imports"], key=lambda entry: entry["cumulative_us"], reverse=True)[:top]:
+        print(f"{entry['cumulative_us'] / 1000:10.1f}ms {entry['self_us'] / 1000:10.1f}ms self  {entry['module']}")
+    print("\nTime by top-level package:")
+    for package, total in totals_by_package(profile["imports"]).most_common(top):
+        print(f"{total / 1000:10.1f}ms  {package}")
+
+
+def main(module="src.trade_run", top=20):
+    print_report(profile_imports(module), int(top))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
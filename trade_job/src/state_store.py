@@ -0,0 +1,55 @@
+import copy
+import json
+import os
+import re
+from src.constants import STATE_STORE_DIR
+
+
+class InMemoryStateStore:
+    def __init__(self):
+        self.data = {}
+
+    def load(self, key):
+        return copy.deepcopy(self.data.get(key))
+
+    def save(self, key, value):
+        self.data[key] = copy.deepcopy(value)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class LocalFileStateStore:
+    # On Lambda the directory lives in /tmp, which is kept for as long as the execution environment stays warm
+
+    def __init__(self, directory=STATE_STORE_DIR):
+        self.directory = directory
+
+    def path(self, key):
+        file_name = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+        return os.path.join(self.directory, f"{file_name}.json")
+
+    def load(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f"Discarding unreadable state for key {key}, message: {e}")
+            return None
+
+    def save(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(value, f)
+        # Replace atomically so a timed-out run never leaves a half-written file behind
+        os.replace(temp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,141 @@
+import asyncio
+import collections
+import datetime
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.constants import ORDER_TIME_FORMAT, STREAMING_LATENCY_SAMPLES, STREAMING_MAX_WORKERS
+from src.order_ledger import OrderLedger
+from src.indicators import SMA
+from src.trade_helper import (
+    get_open_positions,
+    profit_loss_reached,
+    buying_condition,
+    selling_condition,
+    cancel_orders,
+    buy_stock,
+    close_positions_by_percentage
+)
+
+
+class StreamingJob:
+    # Rolling average of closes for one job, updated one bar at a time as bars arrive from the stream
+
+    def __init__(self, job_parameters, job_start_time):
+        self.symbol = job_parameters["symbol"]
+        self.window_length = job_parameters["windowLength"]
+        self.take_profit = job_parameters["takeProfit"]
+        self.stop_loss = job_parameters["stopLoss"]
+        self.job_start_time = job_start_time
+        # Bars are a minute apart, so the window holds at most windowLength of them
+        self.close_average = SMA(self.window_length, min_periods=1, max_age=self.window_length * 60)
+        self.order_ledger = OrderLedger(self.symbol, job_start_time)
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def add_bar(self, bar):
+        return self.close_average.update(bar.close, bar.timestamp.timestamp())
+
+    def evaluate(self, bar):
+        mean_price = self.add_bar(bar)
+        if buying_condition(mean_price, bar.close):
+            return "buy"
+        if selling_condition(mean_price, bar.close):
+            return "sell"
+        return None
+
+    def execute(self, decision, trading_client):
+        # Runs on a worker thread so broker round trips never hold up the stream's event loop. Executions for the
+        # same job are serialized so the ledger and position are never read mid-update.
+        with self.lock:
+            if self.finished:
+                return
+            self.execute_decision(decision, trading_client)
+
+    def execute_decision(self, decision, trading_client):
+        self.order_ledger.update(trading_client)
+        position = get_open_positions(trading_client, self.symbol)
+        unrealized_pl = float(position.unrealized_pl) if position else 0
+        if profit_loss_reached(self.take_profit, self.stop_loss, self.order_ledger.realized_pl + unrealized_pl):
+            if position:
+                close_positions_by_percentage(trading_client, self.symbol, "100")
+            print(f"Profit/Loss limit reached, stopping streaming job for {self.symbol}")
+            self.finished = True
+            return
+        if decision == "buy":
+            buy_stock(trading_client, self.symbol)
+        elif decision == "sell" and position and not self.order_ledger.get_open_orders("sell"):
+            cancel_orders(self.order_ledger.get_open_orders("buy"), trading_client)
+            close_positions_by_percentage(trading_client, self.symbol, "100")
+
+
+class StreamingTrader:
+
+    def __init__(self, stream, trading_client, max_workers=STREAMING_MAX_WORKERS, clock=time.perf_counter,
+                 latency_samples=STREAMING_LATENCY_SAMPLES):
+        self.stream = stream
+        self.trading_client = trading_client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.clock = clock
+        self.jobs = collections.defaultdict(list)
+        self.pending = set()
+        # The trader runs for the whole session, so only the latest latencies are kept
+        self.decision_latencies = collections.deque(maxlen=latency_samples)
+
+    def add_job(self, job_parameters, job_start_time=None):
+        if job_start_time is None:
+            job_start_time = datetime.datetime.now(datetime.timezone.utc).strftime(ORDER_TIME_FORMAT)
+        job = StreamingJob(job_parameters, job_start_time)
+        self.jobs[job.symbol].append(job)
+        return job
+
+    async def handle_bar(self, bar):
+        received_at = self.clock()
+        loop = asyncio.get_running_loop()
+        for job in self.jobs.get(bar.symbol, []):
+            if job.finished:
+                continue
+            decision = job.evaluate(bar)
+            self.decision_latencies.append(self.clock() - received_at)
+            if decision is not None:
+                future = loop.run_in_executor(self.executor, job.execute, decision, self.trading_client)
+                self.pending.add(future)
+                future.add_done_callback(self.pending.discard)
+
+    async def drain(self):
+        if self.pending:
+            await asyncio.gather(*self.pending)
+
+    def subscribe(self):
+        self.stream.subscribe_bars(self.handle_bar, *self.jobs.keys())
+
+    def run(self):
+        self.subscribe()
+        try:
+            self.stream.run()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+def create_streaming_trader():
+    from alpaca.data.live import StockDataStream
+    from src.client_cache import client_cache
+    secret = client_cache.get_secret()
+    _, trading_client = client_cache.get_clients()
+    stream = StockDataStream(secret['alpaca_api_key'], secret['alpaca_secret_key'])
+    return StreamingTrader(stream, trading_client)
+
+
+def main(path):
+    with open(path) as f:
+        events = json.load(f)
+    trader = create_streaming_trader()
+    for event in events:
+        trader.add_job(event["jobParameters"], event.get("jobInfo"))
+    trader.run()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
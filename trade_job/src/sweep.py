@@ -0,0 +1,96 @@
+import itertools
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from src.backtest import prepare_bars, close_prefix_sums, backtest_arrays
+
+PARAMETER_NAMES = ["windowLength", "offsetTime", "takeProfit", "stopLoss", "maxRuns"]
+
+# Arrays attached from shared memory in each worker process
+shared_bars = {}
+
+
+def build_parameter_grid(parameter_space):
+    values = [parameter_space.get(name, [None]) for name in PARAMETER_NAMES]
+    return [dict(zip(PARAMETER_NAMES, combination)) for combination in itertools.product(*values)]
+
+
+def sample_parameters(parameter_space, sample_size, seed=None):
+    generator = random.Random(seed)
+    return [{name: generator.choice(parameter_space.get(name, [None])) for name in PARAMETER_NAMES}
+            for _ in range(sample_size)]
+
+
+def share_array(array):
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[:] = array
+    return memory
+
+
+def attach_shared_bars(names, bar_count):
+    # Workers map the parent's blocks directly instead of receiving pickled copies of the bars
+    for key, (name, dtype, length) in names.items():
+        memory = shared_memory.SharedMemory(name=name)
+        shared_bars[key] = (memory, np.ndarray((length,), dtype=dtype, buffer=memory.buf))
+    shared_bars["bar_count"] = bar_count
+
+
+def evaluate_parameters(parameter_sets):
+    timestamps = shared_bars["timestamps"][1]
+    closes = shared_bars["closes"][1]
+    prefix_sums = shared_bars["prefix_sums"][1]
+    results = []
+    for parameters in parameter_sets:
+        result = backtest_arrays(timestamps, closes, prefix_sums,
+                                 parameters["windowLength"],
+                                 parameters["offsetTime"],
+                                 parameters["takeProfit"],
+                                 parameters["stopLoss"],
+                                 parameters["maxRuns"])
+        results.append({
+            **parameters,
+            "runs": result["run_count"],
+            "buys": int(result["buy"].sum()),
+            "sells": int(result["sell"].sum()),
+            "stopped_by": result["stopped_by"],
+            "final_pl": result["final_pl"]
+        })
+    return results
+
+
+def chunk(parameter_sets, chunk_size):
+    return [parameter_sets[i:i + chunk_size] for i in range(0, len(parameter_sets), chunk_size)]
+
+
+def run_sweep(bars, parameter_sets, max_workers=None):
+    timestamps, closes = prepare_bars(bars)
+    arrays = {
+        "timestamps": np.ascontiguousarray(timestamps.asi8),
+        "closes": closes,
+        # One cumulative sum serves every window length in the sweep
+        "prefix_sums": close_prefix_sums(closes)
+    }
+    max_workers = max_workers or os.cpu_count()
+    blocks = {key: share_array(array) for key, array in arrays.items()}
+    names = {key: (blocks[key].name, arrays[key].dtype, len(arrays[key])) for key in arrays}
+    try:
+        # A few chunks per worker keeps them all busy without paying for a task per parameter set
+        chunk_size = max(1, math.ceil(len(parameter_sets) / (max_workers * 4)))
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=attach_shared_bars,
+                                 initargs=(names, len(closes))) as executor:
+            results = list(itertools.chain.from_iterable(
+                executor.map(evaluate_parameters, chunk(parameter_sets, chunk_size))))
+    finally:
+        for memory in blocks.values():
+            memory.close()
+            memory.unlink()
+
+    ranked = pd.DataFrame(results, columns=PARAMETER_NAMES + ["runs", "buys", "sells", "stopped_by", "final_pl"])
+    ranked = ranked.sort_values("final_pl", ascending=False, kind="stable").reset_index(drop=True)
+    ranked.index.name = "rank"
+    return ranked
@@ -2,9 +2,17 @@ from alpaca.data.timeframe import TimeFrame
 from alpaca.data.requests import StockBarsRequest
 from alpaca.common.exceptions import APIError
 from alpaca.trading.requests import MarketOrderRequest, ClosePositionRequest, GetOrdersRequest
-from alpaca.trading.enums import OrderSide, TimeInForce
+from alpaca.trading.enums import OrderSide, PositionSide, TimeInForce
+from array import array
+import bisect
 import datetime
-from src.constants import MAX_RETRIES
+from src.clock import now
+from src.concurrency import run_each
+from src.order_pipeline import is_duplicate_order
+from src.retry import call_with_retry, is_retryable_before_sent
+from src.constants import AUTH_ERROR_STATUS_CODES, BAR_COLUMNS
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
 
 
 def get_current_run_count(job_status):
@@ -15,34 +23,119 @@ def get_current_run_count(job_status):
     return run_count
 
 
-def get_stock_data(client, symbol, window_length_mins, offset):
-    window_end = datetime.datetime.now() - datetime.timedelta(minutes=offset)
+def get_window_bounds(window_length_mins, offset):
+    window_end = now() - datetime.timedelta(minutes=offset)
     window_length = datetime.timedelta(minutes=window_length_mins)
-    window_start = window_end - window_length
+    return window_end - window_length, window_end
+
+
+def get_stock_data(client, symbol, window_length_mins, offset, bar_store=None, shared_cache=None):
+    window_start, window_end = get_window_bounds(window_length_mins, offset)
 
+    if bar_store is not None:
+        # Only the part of the window the store has not already got is requested
+        return bar_store.get_bars(symbol,
+                                  window_start,
+                                  window_end,
+                                  lambda symbols, start, end: fetch_bars(client, symbols, start, end, shared_cache))
+    return fetch_bars(client, symbol, window_start, window_end, shared_cache)
+
+
+def fetch_bars(client, symbol, start, end, shared_cache=None):
+    if shared_cache is not None:
+        # Jobs requesting the same symbols and minutes share one request
+        return shared_cache.get_bars(symbol, start, end, lambda: fetch_bars(client, symbol, start, end))
     request_params = StockBarsRequest(
         symbol_or_symbols=symbol,
         timeframe=TimeFrame.Minute,
-        start=window_start,
-        end=window_end
+        start=start,
+        end=end
     )
     try:
-        bars = client.get_stock_bars(request_params)
+        bars = call_with_retry("get_stock_bars", client.get_stock_bars, request_params)
     except AttributeError:
         print("Error getting stock bars, data may not be available")
         raise
+    if isinstance(bars.data, dict) and not bars.data:
+        # BarSet.df cannot build its index from an empty response
+        return empty_bars()
     return bars.df
 
 
+def empty_bars():
+    import pandas as pd
+    index = pd.MultiIndex.from_arrays([pd.Index([], dtype=object), pd.DatetimeIndex([], tz="UTC")],
+                                      names=["symbol", "timestamp"])
+    return pd.DataFrame(columns=BAR_COLUMNS, index=index, dtype=float)
+
+
 def calculate_rolling_average(bars_data, n):
     return bars_data.rolling(n).mean()
 
 
+def to_epoch_ns(timestamp):
+    # Naive datetimes are treated as UTC, as Alpaca does
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return (timestamp - EPOCH) // datetime.timedelta(microseconds=1) * 1000
+
+
+def from_epoch_ns(timestamp):
+    return EPOCH + datetime.timedelta(microseconds=timestamp // 1000)
+
+
+def fetch_closes(client, symbol, start, end, shared_cache=None):
+    # Reads timestamps and closes straight off the Bar objects into flat arrays rather than building BarSet.df
+    if shared_cache is not None:
+        return shared_cache.get_closes(symbol, start, end, lambda: fetch_closes(client, symbol, start, end))
+    request_params = StockBarsRequest(
+        symbol_or_symbols=symbol,
+        timeframe=TimeFrame.Minute,
+        start=start,
+        end=end
+    )
+    try:
+        bars = call_with_retry("get_stock_bars", client.get_stock_bars, request_params)
+    except AttributeError:
+        print("Error getting stock bars, data may not be available")
+        raise
+    symbol_bars = bars.data.get(symbol, [])
+    timestamps = array("q", [to_epoch_ns(bar.timestamp) for bar in symbol_bars])
+    closes = array("d", [bar.close for bar in symbol_bars])
+    return timestamps, closes
+
+
+def update_close_average(close_average, timestamps, closes):
+    # Alpaca treats the start of a request as inclusive, so bars the accumulator has already seen are skipped
+    start = 0
+    if close_average.count:
+        start = bisect.bisect_right(timestamps, close_average.last_timestamp)
+    for i in range(start, len(timestamps)):
+        close_average.update(closes[i], timestamps[i])
+    return close_average.value
+
+
+def get_close_average(client, symbol, window_length_mins, offset, close_average, shared_cache=None):
+    # The accumulator already holds the closes in the window from earlier runs, so only bars after its newest one
+    # are requested. Returns the window average and the last close, which is None when the window has no bars.
+    window_start, window_end = get_window_bounds(window_length_mins, offset)
+    close_average.evict_before(to_epoch_ns(window_start))
+    fetch_start = window_start
+    if close_average.count:
+        fetch_start = from_epoch_ns(close_average.last_timestamp)
+    timestamps, closes = fetch_closes(client, symbol, fetch_start, window_end, shared_cache)
+    update_close_average(close_average, timestamps, closes)
+    return close_average.value, close_average.last_value
+
+
 def get_open_positions(trading_client, symb):
     try:
-        position = trading_client.get_open_position(symb)
+        position = call_with_retry("get_open_position", trading_client.get_open_position, symb)
         return position
     except APIError as e:
+        if e.status_code in AUTH_ERROR_STATUS_CODES:
+            print(f"Authentication error during open position retrieval, message: {e}")
+            raise
         print(f"Error during open position retrieval, potentially no open positions, message: {e}")
         return False
     except Exception as e:
@@ -50,66 +143,103 @@ def get_open_positions(trading_client, symb):
         raise
 
 
-def get_orders(trading_client, symbol, status, time):
+def get_all_open_positions(trading_client, symbols):
+    try:
+        positions = call_with_retry("get_all_positions", trading_client.get_all_positions)
+    except Exception as e:
+        print(f"Error during open positions retrieval, message: {e}")
+        raise
+    return {position.symbol: position for position in positions if position.symbol in symbols}
+
+
+def get_orders(trading_client, symbol, status, time, limit=None, direction=None, until=None):
     print("Getting orders")
-    start_time = datetime.datetime.strptime(time, "%Y-%m-%dT%H:%M:%S.%fZ")
-    attempts = 0
+    start_time = None if time is None else datetime.datetime.strptime(time, "%Y-%m-%dT%H:%M:%S.%fZ")
     request_params = GetOrdersRequest(
         status=status,
-        symbol=symbol,
-        after=start_time
+        symbols=symbol if isinstance(symbol, list) else [symbol],
+        after=start_time,
+        until=until,
+        limit=limit,
+        direction=direction
     )
-    while attempts < MAX_RETRIES:
-        try:
-            orders = trading_client.get_orders(request_params)
-            return orders
-        except Exception as e:
-            print(f"Error during open order retrieval, message: {e}. Retrying...")
-            attempts += 1
-            if attempts == MAX_RETRIES:
-                raise Exception(f"Error during open order retrieval: all {MAX_RETRIES} attempts failed") from e
+    return call_with_retry("get_orders", trading_client.get_orders, request_params)
+
+
+def get_order_by_id(trading_client, order_id):
+    return call_with_retry("get_order_by_id", trading_client.get_order_by_id, order_id)
 
 
 def calculate_realized_pl(orders):
-    pl = 0
-    for order in orders:
-        filled_average_price = float(order.filled_avg_price)
-        filled_qty = float(order.filled_qty)
-        if order.side == "buy":
-            pl -= (filled_average_price * filled_qty)
-        if order.side == "sell":
-            pl += (filled_average_price * filled_qty)
-    return pl
+    # Realized at average cost, as the order ledger does. Accepts Alpaca orders or an OrderStore; callers that reuse
+    # the orders should convert them once themselves. The store needs NumPy, so it is only imported by the helpers
+    # that use it.
+    from src.order_store import as_order_store
+    return as_order_store(orders).realized_pl()
 
 
 def filter_for_order_status(orders, order_status):
-    filtered_orders = []
-    for order in orders:
-        if order.status == order_status:
-            filtered_orders.append(order)
-    return filtered_orders
+    from src.order_store import as_order_store
+    order_store = as_order_store(orders)
+    return order_store.select(order_store.status_mask(order_status))
 
 
 def filter_for_order_side(orders, order_side):
-    filtered_orders = []
-    for order in orders:
-        if order.status == order_side:
-            filtered_orders.append(order)
-    return filtered_orders
+    from src.order_store import as_order_store
+    order_store = as_order_store(orders)
+    return order_store.select(order_store.side_mask(order_side))
+
+
+def get_order_id(order):
+    # Ledger open orders are dicts, orders from the Alpaca API are models
+    return str(order["id"] if isinstance(order, dict) else order.id)
+
+
+def cancel_order(trading_client, order_id):
+    # Orders that are already filled, cancelled or unknown are not retried
+    call_with_retry("cancel_order_by_id", trading_client.cancel_order_by_id, order_id)
+    return order_id
 
 
 def cancel_orders(orders, trading_client):
-    print("Cancelling open orders")
-    for order in orders:
-        attempts = 0
-        while attempts < MAX_RETRIES:
-            try:
-                trading_client.cancel_order_by_id(order["id"])
-            except Exception as e:
-                print(f"Error during open order retrieval, message: {e}. Retrying...")
-                attempts += 1
-                if attempts == MAX_RETRIES:
-                    raise Exception(f"Error during open order retrieval: all {MAX_RETRIES} attempts failed") from e
+    # Each order is cancelled by id, concurrently on the shared pool, so only this job's orders are touched; Alpaca's
+    # bulk cancel would also cancel other jobs' open orders on the account. Returns the ids that were cancelled and
+    # the reason each of the others failed.
+    order_ids = [get_order_id(order) for order in orders]
+    if not order_ids:
+        return {"cancelled": [], "failed": {}}
+    print(f"Cancelling {len(order_ids)} open orders")
+
+    summary = {"cancelled": [], "failed": {}}
+    auth_error = None
+    for order_id, _, error in run_each(lambda order_id: cancel_order(trading_client, order_id), order_ids):
+        if error is None:
+            summary["cancelled"].append(order_id)
+            continue
+        summary["failed"][order_id] = str(error)
+        if isinstance(error, APIError) and error.status_code in AUTH_ERROR_STATUS_CODES:
+            auth_error = error
+    if auth_error is not None:
+        raise auth_error
+
+    print(f"Cancelled {len(summary['cancelled'])} orders, {len(summary['failed'])} could not be cancelled")
+    return summary
+
+
+def calculate_batch_signals(bars):
+    # One grouped pass over the multi-symbol bars; the mean over each symbol's window is the last value of
+    # calculate_rolling_average(bars['close'], len(bars)) for that symbol
+    import pandas as pd
+    closes = bars["close"].groupby(level="symbol", sort=False)
+    signals = pd.DataFrame({
+        "mean_price": closes.mean(),
+        "last_price": closes.last()
+    })
+    mean_prices = signals["mean_price"].to_numpy()
+    last_prices = signals["last_price"].to_numpy()
+    signals["buy"] = mean_prices < last_prices
+    signals["sell"] = mean_prices > last_prices
+    return signals
 
 
 def buying_condition(mean_price, last_price):
@@ -130,18 +260,34 @@ def selling_condition(mean_price, last_price):
         return False
 
 
-def buy_stock(trading_client, symb):
+def place_order(trading_client, order_data, client_order_id=None):
+    if client_order_id is None:
+        # A resubmitted order could be filled twice, so it is only retried if the first request cannot have reached
+        # the broker.
+        return call_with_retry("submit_order", trading_client.submit_order,
+                               order_data=order_data,
+                               classifier=is_retryable_before_sent)
+    # The broker refuses a second order with the same client_order_id, so these are retried like any other call. If
+    # an earlier attempt (or an earlier invocation of the run) placed the order, that order is returned.
+    try:
+        return call_with_retry("submit_order", trading_client.submit_order, order_data=order_data)
+    except APIError as e:
+        if not is_duplicate_order(e):
+            raise
+        print(f"Order {client_order_id} was already submitted, using the existing order")
+        return call_with_retry("get_order_by_client_id", trading_client.get_order_by_client_id, client_order_id)
+
+
+def buy_stock(trading_client, symb, client_order_id=None):
     print(f"Making buy order for symbol {symb}")
     market_order_data = MarketOrderRequest(
         symbol=symb,
         qty=1,
         side=OrderSide.BUY,
-        time_in_force=TimeInForce.DAY
-    )
-    # Market order
-    market_order = trading_client.submit_order(
-        order_data=market_order_data
+        time_in_force=TimeInForce.DAY,
+        client_order_id=client_order_id
     )
+    return place_order(trading_client, market_order_data, client_order_id)
 
 
 def profit_loss_reached(take_profit, stop_loss, unrealized_pl):
@@ -155,15 +301,27 @@ def profit_loss_reached(take_profit, stop_loss, unrealized_pl):
         return False
 
 
-def close_positions_by_percentage(trading_client, symbol, percentage):
-    close_position_request = ClosePositionRequest(
-        percentage=percentage
-    )
+def close_positions_by_percentage(trading_client, symbol, percentage, position=None, client_order_id=None):
     try:
-        close_response = trading_client.close_position(
-            symbol_or_asset_id=symbol,
-            close_options=close_position_request
+        if position and client_order_id is not None:
+            # Alpaca's close position request cannot carry a client_order_id, so a known position is closed with a
+            # market order for its share of the position instead
+            close_order_data = MarketOrderRequest(
+                symbol=symbol,
+                qty=abs(float(position.qty)) * float(percentage) / 100,
+                side=OrderSide.BUY if position.side == PositionSide.SHORT else OrderSide.SELL,
+                time_in_force=TimeInForce.DAY,
+                client_order_id=client_order_id
+            )
+            return place_order(trading_client, close_order_data, client_order_id)
+        close_position_request = ClosePositionRequest(
+            percentage=percentage
         )
+        # Closing by percentage twice would close more than asked, so this is retried on the same terms as orders
+        return call_with_retry("close_position", trading_client.close_position,
+                               symbol_or_asset_id=symbol,
+                               close_options=close_position_request,
+                               classifier=is_retryable_before_sent)
     except Exception as e:
         print(f"Error when closing position, message: {e}")
         raise
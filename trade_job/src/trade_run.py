@@ -1,28 +1,107 @@
-from alpaca.data.historical import StockHistoricalDataClient
-from src.secrets_helper import get_secret
-from alpaca.trading.client import TradingClient
+from src.client_cache import get_clients, invalidate_clients, is_auth_error
+from src.state_store import LocalFileStateStore
+from src.shared_bar_cache import create_shared_bar_cache
+from src.trade_state import create_trade_state
+from src.recorder import create_recorder
+from src.order_ledger import OrderLedger
+from src.order_pipeline import OrderPipeline
+from src.job_snapshot import restore_snapshot, snapshot_or_none
+from src.indicators import SMA, indicator_key, load_indicator, save_indicator
+from src.concurrency import run_concurrently, run_each
+from src.multiplex import SharedClients, job_executor, job_outcome
+from src.retry import retry_scope
+from src.metrics import metrics_scope, span, set_property, record_retries
+from src.memory_profiler import memory_profile_scope
 from src.trade_helper import (
     get_stock_data,
     get_open_positions,
-    calculate_realized_pl,
+    get_all_open_positions,
+    calculate_batch_signals,
     profit_loss_reached,
-    get_orders,
-    filter_for_order_status,
-    filter_for_order_side,
     buying_condition,
     selling_condition,
     cancel_orders,
     buy_stock,
-    calculate_rolling_average,
+    get_close_average,
     close_positions_by_percentage,
     increment_run_count,
     get_current_run_count
 )
 
+# Every broker and data response the runs receive is appended to the file TRADE_JOB_RECORD names. The bar caches and
+# the trade-updates stream answer requests without a call, so they are off while recording.
+recorder = create_recorder()
+state_store = LocalFileStateStore()
+# Bars already fetched by earlier runs of the batch job are read from /tmp rather than requested again. The store
+# needs pandas and NumPy, so it is created by the first batch run rather than when the module loads.
+bar_store = None
+use_bar_store = recorder is None
+# Jobs in the same process (or sharing the configured backend) that request the same bars share one request
+shared_bar_cache = None if recorder else create_shared_bar_cache()
+# Orders and positions kept up to date from the trade-updates stream, when TRADE_JOB_TRADE_UPDATES=1
+trade_state = None if recorder else create_trade_state()
+
 
 def start_trade_run(event, context):
-    secret = get_secret()
+    return run_with_cached_clients(run_trade_job, event, context)
+
+
+def start_batch_trade_run(event, context):
+    return run_with_cached_clients(run_batch_trade_job, event, context)
+
+
+def start_multiplexed_trade_run(event, context):
+    # Runs the single-symbol jobs in event["jobs"] (each with jobParameters, jobInfo and jobStatus) at the same
+    # time. The jobs share one positions request, identical order requests and identical bar requests. Each job's
+    # payload for its next run is returned in the same position of "jobs".
+    clients = SharedClients(get_clients)
+    outcomes = run_each(lambda job: run_with_cached_clients(run_trade_job, job, context, clients),
+                        event["jobs"],
+                        pool=job_executor)
+    for job, _, error in outcomes:
+        if error is not None:
+            print(f"Trade run failed for {job['jobParameters'].get('symbol')} job {job['jobInfo']}, message: {error}")
+    return {"jobs": [job_outcome(job, result, error) for job, result, error in outcomes]}
+
+
+def run_with_cached_clients(run, event, context=None, clients=None):
+    # Broker call retries share one budget, taken from the time the Lambda has left. Timings, retries and the
+    # decision taken are written out as one metrics record per run, along with a memory profile if it is turned on.
+    job_parameters = event["jobParameters"]
+    with metrics_scope({"Handler": run.__name__}), memory_profile_scope(), retry_scope(context) as retries:
+        set_property("Symbol", job_parameters.get("symbol", job_parameters.get("symbols")))
+        try:
+            if recorder is not None:
+                result = recorder.record(run.__name__, event,
+                                         lambda recording_clients: run_with_auth_refresh(run, event, recording_clients),
+                                         clients or get_clients)
+            else:
+                result = run_with_auth_refresh(run, event, clients)
+        finally:
+            record_retries(retries)
+        set_property("CancelTradeJob", result.get("cancelTradeJob"))
+        set_property("RunCount", result.get("runCount"))
+        return result
 
+
+def run_with_auth_refresh(run, event, clients=None):
+    clients = clients or get_clients
+    with span("GetClients"):
+        stock_client, trading_client = clients()
+    try:
+        return run(event, stock_client, trading_client)
+    except Exception as e:
+        if not is_auth_error(e):
+            raise
+        # Credentials may have been rotated since the clients were cached, refresh them and retry once
+        print(f"Authentication failed, refreshing credentials and retrying run, message: {e}")
+        invalidate_clients()
+        with span("GetClients"):
+            stock_client, trading_client = clients()
+        return run(event, stock_client, trading_client)
+
+
+def run_trade_job(event, stock_client, trading_client):
     job_parameters = event["jobParameters"]
     symbol = job_parameters["symbol"]
     offset = job_parameters["offsetTime"]
@@ -35,24 +114,56 @@ def start_trade_run(event, context):
 
     job_status = event.get("jobStatus")
     run_count = get_current_run_count(job_status)
+    # Order ids are derived from the job and run, so a retried invocation cannot place this run's orders twice
+    orders = OrderPipeline(job_start_time, run_count)
 
-    # Setup Alpaca API clients
-    alpaca_api_key = secret['alpaca_api_key']
-    alpaca_secret_key = secret['alpaca_secret_key']
+    with span("LoadState"):
+        # The close average is carried between runs so each run only fetches and adds the bars that arrived since
+        # the last one
+        close_average_key = indicator_key(symbol, job_start_time, "close_sma")
+        # The previous run's snapshot comes back in jobStatus, so a Lambda whose /tmp is empty does not have to
+        # rebuild the ledger and average from the APIs
+        restored = restore_snapshot(job_status.get("snapshot") if job_status else None, symbol, window_length + 1)
+        if restored:
+            order_ledger, close_average = restored
+        else:
+            order_ledger = OrderLedger.load(state_store, symbol, job_start_time)
+            close_average = load_indicator(state_store, close_average_key,
+                                           lambda: SMA(window_length + 1, min_periods=1))
+    set_property("SnapshotRestored", restored is not None)
 
-    stock_client = StockHistoricalDataClient(alpaca_api_key, alpaca_secret_key)
-    trading_client = TradingClient(alpaca_api_key, alpaca_secret_key)
+    # With the trade-updates stream running, the ledger and position the stream keeps up to date are read in place of
+    # the orders and position requests
+    tracked = trade_state is not None and trade_state.is_tracking(symbol, job_start_time)
+    set_property("TradeUpdates", tracked)
 
-    # check profit/loss limits
-    all_orders = get_orders(trading_client, symbol, 'all', job_start_time)
-    closed_orders = filter_for_order_status(all_orders, "closed")
+    # None of the broker calls needs another's result, so the orders, position and bars are fetched at the same time
+    with span("Fetch"):
+        calls = {
+            "bars": lambda: get_close_average(stock_client, symbol, window_length, offset, close_average,
+                                              shared_cache=shared_bar_cache)
+        }
+        if not tracked:
+            calls["orders"] = lambda: order_ledger.update(trading_client)
+            calls["position"] = lambda: get_open_positions(trading_client, symbol)
+        results = run_concurrently(calls)
+        if tracked:
+            if close_average.count:
+                trade_state.mark(symbol, close_average.last_value, close_average.last_timestamp / 1e9)
+            results["orders"] = trade_state.ledger(symbol, job_start_time)
+            results["position"] = trade_state.position(symbol)
+        elif trade_state is not None:
+            trade_state.track(symbol, job_start_time, results["orders"], results["position"])
+    with span("SaveState"):
+        order_ledger = results["orders"]
+        order_ledger.save(state_store, job_start_time)
+        save_indicator(state_store, close_average_key, close_average)
+        snapshot = snapshot_or_none(order_ledger, close_average)
 
-    if closed_orders:
-        realized_pl = calculate_realized_pl(closed_orders)
-    else:
-        realized_pl = 0
+    # check profit/loss limits
+    realized_pl = order_ledger.realized_pl
 
-    position = get_open_positions(trading_client, symbol)
+    position = results["position"]
     if position:
         print(f"Position exists, unrealized pl {position.unrealized_pl}")
         unrealized_pl = float(position.unrealized_pl)
@@ -64,41 +175,175 @@ def start_trade_run(event, context):
     print(f"Realized profit/loss is ${realized_pl}, unrealized profit/loss is ${unrealized_pl}. Theoretical "
           f"profit/loss is ${theoretical_pl}")
     if profit_loss_reached(take_profit, stop_loss, theoretical_pl):
-        close_positions_by_percentage(trading_client, symbol, "100")
+        set_property("Decision", "limit_reached")
+        with span("Orders"):
+            submit_close(orders, trading_client, symbol, position)
+            orders.confirm()
         print("Profit/Loss limit reached, cancelling trade job")
-        return {"cancelTradeJob": 1}
+        return {"cancelTradeJob": 1,
+                "snapshot": snapshot}
 
     # Evaluate buying/selling conditions
-    bars = get_stock_data(stock_client, symbol, window_length, offset)
-    close_rolling_average = calculate_rolling_average(bars['close'], len(bars))
-
-    last_average = close_rolling_average.iloc[-1]
-    last_price = bars["close"].iloc[-1]
-
-    if buying_condition(last_average, last_price):
-        print("Buying condition met")
-        buy_stock(trading_client, symbol)
-    elif selling_condition(last_average, last_price) and position:
-        print("Selling conditions met")
-        open_orders = filter_for_order_status(all_orders, "open")
-
-        open_sell_orders = filter_for_order_side(open_orders, "sell")
-        open_buy_orders = filter_for_order_side(open_orders, "buy")
-        if not open_sell_orders:
-            print("No currently existing sell orders, proceeding to make sell orders")
+    last_average, last_price = results["bars"]
+
+    open_buy_orders = order_ledger.get_open_orders("buy")
+
+    with span("Evaluate"):
+        if last_price is None:
+            print("No bars in the window, not buying or selling...")
+            decision = "no_bars"
+        elif buying_condition(last_average, last_price):
+            print("Buying condition met")
+            decision = "buy"
+        elif selling_condition(last_average, last_price) and position:
+            print("Selling conditions met")
+            decision = "hold"
+            open_sell_orders = order_ledger.get_open_orders("sell")
+            if not open_sell_orders:
+                print("No currently existing sell orders, proceeding to make sell orders")
+                decision = "sell"
+        else:
+            print("Not buying or selling...")
+            decision = "hold"
+    set_property("Decision", decision)
+
+    # Check run count
+    run_count = increment_run_count(run_count)
+    final_run = run_count >= max_runs
+
+    with span("Orders"):
+        # Submitted in the background; the broker's acknowledgement is confirmed before the run returns
+        if decision == "buy" and final_run:
+            # The last run closes the position it started with, so a buy placed now would be left open
+            print("Run limit reached, not buying")
+        elif decision == "buy":
+            submit_buy(orders, trading_client, symbol)
+        elif decision == "sell":
             cancel_orders(open_buy_orders, trading_client)
-            close_positions_by_percentage(trading_client, symbol, "100")
-    else:
-        print("Not buying or selling...")
+            submit_close(orders, trading_client, symbol, position)
+
+    if final_run:
+        with span("Orders"):
+            # A sell decision has already cancelled the buy orders and closed the position in this run
+            if decision != "sell":
+                cancel_orders(open_buy_orders, trading_client)
+                submit_close(orders, trading_client, symbol, position)
+            orders.confirm()
+        print("Run limit reached, job should now be cancelled; returning trade job cancellation indicator")
+        return {"cancelTradeJob": 1,
+                "runCount": run_count,
+                "snapshot": snapshot}
+    with span("Orders"):
+        orders.confirm()
+    print("Run finished, returning to step function")
+    return {"cancelTradeJob": 0,
+            "runCount": run_count,
+            "snapshot": snapshot}
+
+
+def get_bar_store():
+    global bar_store
+    if bar_store is None and use_bar_store:
+        from src.bar_store import BarStore
+        bar_store = BarStore()
+    return bar_store
+
+
+def run_batch_trade_job(event, stock_client, trading_client):
+    job_parameters = event["jobParameters"]
+    symbols = job_parameters["symbols"]
+    offset = job_parameters["offsetTime"]
+    window_length = job_parameters["windowLength"]
+    take_profit = job_parameters["takeProfit"]
+    stop_loss = job_parameters["stopLoss"]
+    max_runs = job_parameters["maxRuns"]
+
+    job_start_time = event["jobInfo"]
+
+    job_status = event.get("jobStatus")
+    run_count = get_current_run_count(job_status)
+    orders = OrderPipeline(job_start_time, run_count)
+
+    with span("LoadState"):
+        order_ledger = OrderLedger.load(state_store, symbols, job_start_time)
+    with span("Fetch"):
+        results = run_concurrently({
+            "orders": lambda: order_ledger.update(trading_client),
+            "positions": lambda: get_all_open_positions(trading_client, symbols),
+            "bars": lambda: get_stock_data(stock_client, symbols, window_length, offset, bar_store=get_bar_store(),
+                                          shared_cache=shared_bar_cache)
+        })
+    with span("SaveState"):
+        order_ledger = results["orders"]
+        order_ledger.save(state_store, job_start_time)
+
+    # check profit/loss limits across every symbol in the batch
+    realized_pl = order_ledger.realized_pl
+
+    positions = results["positions"]
+    unrealized_pl = sum(float(position.unrealized_pl) for position in positions.values())
+
+    theoretical_pl = realized_pl + unrealized_pl
+    print(f"Realized profit/loss is ${realized_pl}, unrealized profit/loss is ${unrealized_pl}. Theoretical "
+          f"profit/loss is ${theoretical_pl}")
+    if profit_loss_reached(take_profit, stop_loss, theoretical_pl):
+        set_property("Decision", "limit_reached")
+        with span("Orders"):
+            for symbol in positions:
+                submit_close(orders, trading_client, symbol, positions[symbol])
+            orders.confirm()
+        print("Profit/Loss limit reached, cancelling trade job")
+        return {"cancelTradeJob": 1}
+
+    # Evaluate buying/selling conditions for all symbols from a single bars request
+    with span("Evaluate"):
+        signals = calculate_batch_signals(results["bars"])
+
+        buy_symbols = list(signals.index[signals["buy"].to_numpy()])
+        sell_symbols = [symbol for symbol in signals.index[signals["sell"].to_numpy()]
+                        if symbol in positions and not order_ledger.get_open_orders("sell", symbol)]
+    print(f"Buying conditions met for {buy_symbols}, selling conditions met for {sell_symbols}")
+    set_property("Decision", {"buy": buy_symbols, "sell": sell_symbols})
 
     # Check run count
     run_count = increment_run_count(run_count)
-    if run_count >= max_runs:
-        cancel_orders(open_buy_orders, trading_client)
-        close_positions_by_percentage(trading_client, symbol, "100")
+    final_run = run_count >= max_runs
+
+    with span("Orders"):
+        # The buys go out as one round of concurrent submissions while the sells' buy orders are cancelled. The
+        # last run closes the positions it started with, so it does not buy.
+        for symbol in [] if final_run else buy_symbols:
+            submit_buy(orders, trading_client, symbol)
+        for symbol in sell_symbols:
+            cancel_orders(order_ledger.get_open_orders("buy", symbol), trading_client)
+            submit_close(orders, trading_client, symbol, positions[symbol])
+
+    if final_run:
+        with span("Orders"):
+            # The symbols sold in this run have already had their buy orders cancelled and positions closed
+            open_buy_orders = [order for order in order_ledger.get_open_orders("buy")
+                               if order["symbol"] not in sell_symbols]
+            cancel_orders(open_buy_orders, trading_client)
+            for symbol in set(positions) - set(sell_symbols):
+                submit_close(orders, trading_client, symbol, positions[symbol])
+            orders.confirm()
         print("Run limit reached, job should now be cancelled; returning trade job cancellation indicator")
         return {"cancelTradeJob": 1,
                 "runCount": run_count}
+    with span("Orders"):
+        orders.confirm()
     print("Run finished, returning to step function")
     return {"cancelTradeJob": 0,
             "runCount": run_count}
+
+
+def submit_buy(orders, trading_client, symbol):
+    orders.submit("buy", symbol, lambda order_id: buy_stock(trading_client, symbol, order_id))
+
+
+def submit_close(orders, trading_client, symbol, position):
+    if not position:
+        print(f"No position to close for {symbol}")
+        return
+    orders.submit("close", symbol,
+                  lambda order_id: close_positions_by_percentage(trading_client, symbol, "100", position, order_id))
@@ -0,0 +1,189 @@
+import collections
+import copy
+import datetime
+import os
+import threading
+import time
+from src.clock import now
+from src.order_ledger import OrderLedger, enum_value, format_order_time, parse_order_time
+from src.constants import TRADE_STATE_MAX_AGE_SECONDS, TRADE_STATE_RECENT_UPDATES
+
+# Orders and positions kept up to date from Alpaca's trade-updates stream, so a run can read its ledger and position
+# without REST calls. A job is tracked once a run has read its ledger and position over REST; every trade update
+# after that is applied to them as it arrives. Tracking lapses after TRADE_STATE_MAX_AGE_SECONDS, and the next run
+# reads them over REST again, which bounds the drift from any updates missed while the stream was reconnecting.
+
+
+class PositionView:
+    # Stands in for the Alpaca Position model where the run reads it: qty, side and unrealized_pl
+
+    def __init__(self, symbol, qty, cost_basis, current_price):
+        self.symbol = symbol
+        self.qty = qty
+        self.side = "long" if qty > 0 else "short"
+        self.cost_basis = cost_basis
+        self.current_price = current_price
+        self.unrealized_pl = 0.0 if current_price is None else qty * current_price - cost_basis
+
+
+def is_unseen(ledger, order):
+    # The same test fetch_new_orders makes against the ledger's cursor, plus orders the ledger is still tracking.
+    # An update older than what the ledger already holds is skipped, so replaying one cannot undo a fill.
+    order_id = str(order.id)
+    previous = ledger.open_orders.get(order_id)
+    if previous is not None:
+        return float(order.filled_qty or 0) >= previous["filled_qty"]
+    submitted_at = format_order_time(order.submitted_at)
+    if submitted_at == ledger.cursor:
+        return order_id not in ledger.cursor_order_ids
+    return parse_order_time(submitted_at) > parse_order_time(ledger.cursor)
+
+
+def apply_order(ledger, order):
+    if not is_unseen(ledger, order):
+        return
+    new_order = str(order.id) not in ledger.open_orders
+    ledger.apply(order)
+    if new_order:
+        ledger.advance_cursor(order)
+
+
+class TradeState:
+
+    def __init__(self, max_age=TRADE_STATE_MAX_AGE_SECONDS, recent=TRADE_STATE_RECENT_UPDATES, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        # Ledgers by symbol, then by job start time, with the time they were read over REST
+        self.ledgers = collections.defaultdict(dict)
+        # Quantity, cost basis and latest price of the account's position per tracked symbol
+        self.positions = {}
+        # Updates are kept for a while so ones that arrive while a run is reading over REST are not lost
+        self.recent = collections.deque(maxlen=recent)
+        self.live = False
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"updates": 0, "tracked": 0, "lapsed": 0}
+
+    async def on_trade_update(self, update):
+        # TradingStream calls its handler on the stream's event loop; applying an update only takes the lock briefly
+        self.apply_update(update)
+
+    def apply_update(self, update):
+        order = update.order
+        with self.lock:
+            self.stats["updates"] += 1
+            self.recent.append(update)
+            for ledger, _ in self.ledgers.get(order.symbol, {}).values():
+                apply_order(ledger, order)
+            if enum_value(update.event) in ("fill", "partial_fill") and order.symbol in self.positions:
+                self.apply_fill(order.symbol, enum_value(order.side), float(update.qty), float(update.price),
+                                update.position_qty, update.timestamp)
+
+    def apply_fill(self, symbol, side, qty, price, position_qty, timestamp):
+        position = self.positions[symbol]
+        if side == "buy":
+            position["cost_basis"] += qty * price
+            position["qty"] += qty
+        elif position["qty"] > 0:
+            position["cost_basis"] -= position["cost_basis"] / position["qty"] * min(qty, position["qty"])
+            position["qty"] -= qty
+        if position_qty is not None:
+            # The broker's count of the position after the fill is authoritative
+            position["qty"] = float(position_qty)
+        if position["qty"] <= 0:
+            position["cost_basis"] = 0.0
+        set_price(position, price, timestamp.timestamp())
+
+    def mark(self, symbol, price, timestamp):
+        # Values the position at the newest price seen for the symbol: a fill, or a bar a run or the stream read
+        with self.lock:
+            position = self.positions.get(symbol)
+            if position is not None and price is not None:
+                set_price(position, price, timestamp)
+
+    def track(self, symbol, job_start_time, ledger, position):
+        # Starts applying trade updates to the job's ledger and the symbol's position, as read over REST by a run
+        with self.lock:
+            if not self.live:
+                return
+            ledger = OrderLedger.from_state(copy.deepcopy(ledger.to_state()))
+            for update in self.recent:
+                if update.order.symbol == symbol:
+                    apply_order(ledger, update.order)
+            self.ledgers[symbol][job_start_time] = (ledger, self.clock())
+            if position:
+                priced_at = now().replace(tzinfo=datetime.timezone.utc).timestamp()
+                self.positions[symbol] = {"qty": float(position.qty), "cost_basis": float(position.cost_basis),
+                                          "price": float(position.current_price), "priced_at": priced_at}
+            else:
+                self.positions[symbol] = {"qty": 0.0, "cost_basis": 0.0, "price": None, "priced_at": 0}
+            self.stats["tracked"] += 1
+
+    def is_tracking(self, symbol, job_start_time):
+        with self.lock:
+            entry = self.ledgers.get(symbol, {}).get(job_start_time)
+            if not self.live or entry is None:
+                return False
+            if self.clock() - entry[1] >= self.max_age:
+                del self.ledgers[symbol][job_start_time]
+                self.stats["lapsed"] += 1
+                return False
+            return True
+
+    def ledger(self, symbol, job_start_time):
+        # A copy, so the run can save and snapshot it while updates keep arriving
+        with self.lock:
+            ledger, _ = self.ledgers[symbol][job_start_time]
+            return OrderLedger.from_state(copy.deepcopy(ledger.to_state()))
+
+    def position(self, symbol):
+        # None when there is no position, as get_open_positions returns False
+        with self.lock:
+            position = self.positions[symbol]
+            if position["qty"] == 0:
+                return None
+            return PositionView(symbol, position["qty"], position["cost_basis"], position["price"])
+
+    def reset(self):
+        # Once the stream stops, updates may be missed, so every job goes back to REST
+        with self.lock:
+            self.live = False
+            self.ledgers.clear()
+            self.positions.clear()
+
+
+def set_price(position, price, timestamp):
+    if timestamp >= position["priced_at"]:
+        position["price"] = price
+        position["priced_at"] = timestamp
+
+
+def run_stream(stream, trade_state):
+    try:
+        stream.run()
+    except Exception as e:
+        print(f"Trade updates stream stopped, message: {e}")
+    finally:
+        trade_state.reset()
+
+
+def start_trade_updates(stream, trade_state=None):
+    # Runs the stream on a daemon thread, with its own event loop as TradingStream.run() creates one
+    trade_state = trade_state or TradeState()
+    stream.subscribe_trade_updates(trade_state.on_trade_update)
+    trade_state.live = True
+    trade_state.thread = threading.Thread(target=run_stream, args=(stream, trade_state), daemon=True)
+    trade_state.thread.start()
+    return trade_state
+
+
+def create_trade_state(setting=None):
+    # Off unless TRADE_JOB_TRADE_UPDATES=1. The stream needs a long-running process (the scheduler or streaming
+    # mode); a frozen Lambda misses updates, and tracking lapses before they would matter.
+    setting = os.environ.get("TRADE_JOB_TRADE_UPDATES", "0") if setting is None else setting
+    if setting != "1":
+        return None
+    from alpaca.trading.stream import TradingStream
+    from src.client_cache import client_cache
+    secret = client_cache.get_secret()
+    return start_trade_updates(TradingStream(secret['alpaca_api_key'], secret['alpaca_secret_key']))
@@ -0,0 +1,129 @@
+import asyncio
+import datetime
+import json
+from unittest.mock import MagicMock
+import numpy as np
+import pandas as pd
+from alpaca.common.exceptions import APIError
+
+BAR_START = datetime.datetime(2024, 8, 2, 13, 30, tzinfo=datetime.timezone.utc)
+
+
+def make_api_error(status_code, message="error"):
+    http_error = MagicMock()
+    http_error.response.status_code = status_code
+    return APIError(json.dumps({"code": status_code * 100000, "message": message}), http_error)
+
+
+def make_bars(symbols=("AAPL",), start=BAR_START, minutes=120, volume=100):
+    # Minute bars in the (symbol, timestamp) indexed frame get_stock_data returns. Closes swing around 190 (plus the
+    # symbol's position in the list) every hour, so a moving average strategy both buys and sells.
+    frames = []
+    for offset, symbol in enumerate(symbols):
+        closes = 190 + offset + 2 * np.sin(np.arange(minutes) / 10)
+        index = pd.MultiIndex.from_product(
+            [[symbol], pd.date_range(start, periods=minutes, freq="min")], names=["symbol", "timestamp"])
+        frames.append(pd.DataFrame({
+            "open": closes - 0.01,
+            "high": closes + 0.05,
+            "low": closes - 0.05,
+            "close": closes,
+            "volume": float(volume),
+            "trade_count": 10.0,
+            "vwap": closes
+        }, index=index))
+    return pd.concat(frames)
+
+
+def make_random_walk_bars(symbols=("AAPL",), start=BAR_START, minutes=120, seed=0, price=190, step=0.05,
+                          drop_fraction=0.0):
+    # A random walk from `price` for each symbol, with about drop_fraction of its minutes missing. Each bar opens at
+    # the previous close, so a market order placed once a bar has closed fills at its close.
+    generator = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, periods=minutes, freq="min")
+    frames = []
+    for symbol in symbols:
+        closes = price + np.cumsum(generator.normal(0, step, minutes))
+        keep = generator.random(minutes) >= drop_fraction
+        index = pd.MultiIndex.from_arrays([[symbol] * keep.sum(), timestamps[keep]], names=["symbol", "timestamp"])
+        closes = closes[keep]
+        opens = np.concatenate([closes[:1], closes[:-1]])
+        frames.append(pd.DataFrame({"open": opens, "high": np.maximum(opens, closes), "low": np.minimum(opens, closes),
+                                    "close": closes, "volume": 100.0, "trade_count": 10.0, "vwap": closes},
+                                   index=index))
+    return pd.concat(frames)
+
+
+def make_price_bars(prices, symbol="AAPL", start=BAR_START, volume=100):
+    # A bar a minute that opens and closes at each price, leaving out the minutes whose price is None. `volume` is
+    # one volume for every bar or a list with one for each price.
+    keep = np.array([price is not None for price in prices])
+    timestamps = pd.date_range(start, periods=len(prices), freq="min")[keep]
+    index = pd.MultiIndex.from_arrays([[symbol] * len(timestamps), timestamps], names=["symbol", "timestamp"])
+    closes = np.array([price for price in prices if price is not None], dtype=np.float64)
+    volumes = np.broadcast_to(np.asarray(volume, dtype=np.float64), keep.shape)[keep]
+    return pd.DataFrame({"open": closes, "high": closes, "low": closes, "close": closes, "volume": volumes,
+                         "trade_count": 10.0, "vwap": closes}, index=index)
+
+
+def place_orders(simulator, count, symbol="AAPL"):
+    # Gives a simulated job `count` filled one share orders, alternating buys and sells, by placing them at the
+    # market time and filling them at the next bar. The orders skip the simulator's request accounting.
+    with simulator.lock:
+        for i in range(count):
+            simulator.accept(symbol, "sell" if i % 2 else "buy", 1.0)
+    simulator.advance()
+
+
+class FakeSecretsManager:
+    def __init__(self, secret):
+        self.secret = secret
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        return {"Name": SecretId, "SecretString": json.dumps(self.secret)}
+
+
+class FakeBarStream:
+    # Local stand-in for StockDataStream that replays a list of bars to the subscribed handlers
+    def __init__(self, bars):
+        self.bars = bars
+        self.handlers = {}
+
+    def subscribe_bars(self, handler, *symbols):
+        for symbol in symbols:
+            self.handlers[symbol] = handler
+
+    async def replay(self):
+        for bar in self.bars:
+            handler = self.handlers.get(bar.symbol)
+            if handler:
+                await handler(bar)
+
+    def run(self):
+        asyncio.run(self.replay())
+
+
+class FakeRedis:
+    # Local stand-in for the redis-py get, set and delete calls, with expiry read from an injectable clock
+    def __init__(self, clock=lambda: 0.0):
+        self.clock = clock
+        self.values = {}
+
+    def get(self, name):
+        value, expires_at = self.values.get(name, (None, None))
+        if expires_at is not None and self.clock() * 1000 >= expires_at:
+            del self.values[name]
+            return None
+        return value
+
+    def set(self, name, value, px=None, nx=False):
+        if nx and self.get(name) is not None:
+            return None
+        self.values[name] = (value.encode(), None if px is None else self.clock() * 1000 + px)
+        return True
+
+    def delete(self, *names):
+        for name in names:
+            self.values.pop(name, None)
@@ -8,6 +8,7 @@ event = {
     "stopLoss": -10,
     "takeProfit": 10
   },
+  "jobInfo": "2024-08-02T21:02:44.952Z",
   "jobStatus": {
     "cancelTradeJob": 0,
     "runCount": 1
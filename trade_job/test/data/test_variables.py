@@ -135,3 +135,16 @@ test_order_json = [
       "source": "access_key"
     }
 ]
+
+multi_symbol_stock_data_df = pd.DataFrame({
+            'close': {
+                ('AAPL', Timestamp('2024-02-09 18:29:00+0000', tz='UTC')): 189.40,
+                ('AAPL', Timestamp('2024-02-09 18:30:00+0000', tz='UTC')): 189.45,
+                ('AAPL', Timestamp('2024-02-09 18:31:00+0000', tz='UTC')): 189.50,
+                ('MSFT', Timestamp('2024-02-09 18:29:00+0000', tz='UTC')): 420.10,
+                ('MSFT', Timestamp('2024-02-09 18:30:00+0000', tz='UTC')): 420.00,
+                ('MSFT', Timestamp('2024-02-09 18:31:00+0000', tz='UTC')): 419.90,
+                ('TSLA', Timestamp('2024-02-09 18:30:00+0000', tz='UTC')): 190.00,
+                ('TSLA', Timestamp('2024-02-09 18:31:00+0000', tz='UTC')): 190.00
+                }
+            }).rename_axis(["symbol", "timestamp"])
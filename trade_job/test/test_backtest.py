@@ -0,0 +1,129 @@
+import unittest
+import sys
+from io import StringIO
+from unittest.mock import patch
+import numpy as np
+from trade_job.src.backtest import run_backtest
+from trade_job.src.broker_simulator import BrokerSimulator
+from trade_job.src.state_store import InMemoryStateStore
+from trade_job.src.trade_helper import to_epoch_ns
+from trade_job.src.trade_run import start_trade_run
+# trade_run reads the time through src.clock, so the simulator's clock has to be set through that module
+from src.clock import use_clock
+from trade_job.test.data.fakes import make_random_walk_bars
+
+
+def make_bars(bar_count, seed=1, drop_fraction=0.1):
+    return make_random_walk_bars(minutes=bar_count, seed=seed, price=100, step=0.2, drop_fraction=drop_fraction)
+
+
+def run_trade_job(bars, window_length, offset, take_profit, stop_loss, max_runs=None):
+    # Calls start_trade_run at each bar against the simulator, as the Step Function would call it once a minute.
+    # Returns whether each run placed a buy and a sell, and the job's profit/loss with any position still held
+    # valued at the last run's close, which is where the simulator fills the closing order.
+    timestamps = bars.index.get_level_values("timestamp")
+    simulator = BrokerSimulator(bars)
+    event = {
+        "jobParameters": {
+            "windowLength": window_length,
+            "symbol": "AAPL",
+            "maxRuns": max_runs or len(timestamps) + 1,
+            "offsetTime": offset,
+            "stopLoss": stop_loss,
+            "takeProfit": take_profit
+        },
+        "jobInfo": timestamps[0].strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "jobStatus": {"cancelTradeJob": 0, "runCount": 0}
+    }
+    runs = []
+    with patch("trade_job.src.trade_run.get_clients", return_value=simulator.clients()), use_clock(simulator.now):
+        with patch("trade_job.src.trade_run.state_store", InMemoryStateStore()), \
+                patch("trade_job.src.trade_run.shared_bar_cache", None), \
+                patch("trade_job.src.trade_run.trade_state", None):
+            for timestamp in timestamps:
+                simulator.advance_to(to_epoch_ns(timestamp.to_pydatetime()))
+                placed = len(simulator.order_ids)
+                event["jobStatus"] = start_trade_run(event, None)
+                sides = [simulator.orders[order_id]["side"] for order_id in simulator.order_ids[placed:]]
+                if "runCount" not in event["jobStatus"]:
+                    # Stopped by the profit/loss limit, without a run being counted
+                    break
+                runs.append(("buy" in sides, "sell" in sides))
+                if event["jobStatus"]["cancelTradeJob"]:
+                    break
+    position = simulator.positions.get("AAPL", {"qty": 0.0, "cost_basis": 0.0})
+    final_pl = simulator.realized_pl + position["qty"] * simulator.last_close("AAPL") - position["cost_basis"]
+    return runs, final_pl
+
+
+class TestBacktest(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def assert_matches_trade_job(self, bars, window_length, offset, take_profit, stop_loss, max_runs=None):
+        runs, summary = run_backtest(bars, window_length, offset, take_profit, stop_loss, max_runs)
+        expected_runs, expected_final_pl = run_trade_job(bars, window_length, offset, take_profit, stop_loss,
+                                                         max_runs)
+
+        self.assertEqual(len(runs), len(expected_runs))
+        self.assertEqual(list(runs["buy"]), [run[0] for run in expected_runs])
+        sells = list(runs["sell"])
+        if summary["stopped_by"] == "max_runs":
+            # The final run closes whatever is held, whether or not the sell condition is met
+            sells[-1] = runs["position"].iloc[-2] > 0 or sells[-1]
+        self.assertEqual(sells, [run[1] for run in expected_runs])
+        self.assertAlmostEqual(summary["final_pl"], expected_final_pl)
+        return runs, summary
+
+    def test_matches_trade_job_runs(self):
+        runs, summary = self.assert_matches_trade_job(make_bars(600), 5, 16, 1000, -1000)
+
+        self.assertIsNone(summary["stopped_by"])
+        self.assertGreater(summary["buys"], 0)
+        self.assertGreater(summary["sells"], 0)
+
+    def test_stops_at_take_profit_or_stop_loss(self):
+        runs, summary = self.assert_matches_trade_job(make_bars(600, seed=3), 10, 2, 1, -1)
+
+        self.assertEqual(summary["stopped_by"], "profit_loss_limit")
+
+    def test_stops_at_max_runs(self):
+        runs, summary = self.assert_matches_trade_job(make_bars(600), 5, 16, 1000, -1000, max_runs=100)
+
+        self.assertEqual(summary["stopped_by"], "max_runs")
+        self.assertEqual(summary["runs"], 100)
+
+    def test_does_not_buy_on_the_final_run(self):
+        bars = make_bars(600)
+        unlimited_runs, _ = run_backtest(bars, 5, 16, 1000, -1000)
+        # A run the buying condition holds at, made the job's last
+        max_runs = int(np.flatnonzero(unlimited_runs["buy"])[10]) + 1
+
+        runs, summary = self.assert_matches_trade_job(bars, 5, 16, 1000, -1000, max_runs=max_runs)
+
+        self.assertEqual(summary["runs"], max_runs)
+        self.assertFalse(runs["buy"].iloc[-1])
+        self.assertEqual(runs["position"].iloc[-1], runs["position"].iloc[-2])
+
+    def test_limits_are_optional(self):
+        runs, summary = run_backtest(make_bars(100, drop_fraction=0), 5, 1)
+
+        self.assertEqual(summary["runs"], 100)
+        self.assertIsNone(summary["stopped_by"])
+
+    def test_runs_without_bars_in_window_make_no_decision(self):
+        runs, summary = run_backtest(make_bars(30, drop_fraction=0), 5, 16)
+
+        self.assertFalse(runs["buy"].iloc[:16].any())
+        self.assertFalse(runs["sell"].iloc[:16].any())
+        self.assertTrue(runs["mean_price"].iloc[:16].isna().all())
+        self.assertFalse(np.isnan(runs["mean_price"].iloc[16]))
+
+
+if __name__ == '__main__':
+    unittest.main()
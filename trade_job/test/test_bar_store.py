@@ -0,0 +1,136 @@
+import unittest
+import sys
+import datetime
+import tempfile
+from io import StringIO
+from unittest.mock import MagicMock
+import pandas as pd
+from trade_job.src.bar_store import BarStore, subtract_intervals, merge_interval, to_ns
+from trade_job.src.trade_helper import fetch_bars
+from trade_job.src.broker_simulator import BrokerSimulator
+from trade_job.test.data.fakes import BAR_START as START, make_bars
+
+
+def minutes(count):
+    return datetime.timedelta(minutes=count)
+
+
+class TestBarStore(unittest.TestCase):
+
+    def setUp(self):
+        # Redirect stdout to capture print statements
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = BarStore(directory.name)
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_subtract_intervals(self):
+        self.assertEqual(subtract_intervals(0, 100, []), [(0, 100)])
+        self.assertEqual(subtract_intervals(0, 100, [[10, 20], [50, 60]]), [(0, 9), (21, 49), (61, 100)])
+        self.assertEqual(subtract_intervals(0, 100, [[-10, 200]]), [])
+
+    def test_merge_interval(self):
+        self.assertEqual(merge_interval([[0, 10], [30, 40]], 11, 20), [[0, 20], [30, 40]])
+        self.assertEqual(merge_interval([[0, 10], [30, 40]], 5, 35), [[0, 40]])
+
+    def test_read_returns_stored_range(self):
+        bars = make_bars(("AAPL", "MSFT"), minutes=30)
+        self.store.ingest(bars, START, START + minutes(29), ["AAPL", "MSFT"])
+
+        read = self.store.read(["AAPL", "MSFT"], START + minutes(5), START + minutes(9))
+
+        expected = bars[(bars.index.get_level_values("timestamp") >= START + minutes(5)) &
+                        (bars.index.get_level_values("timestamp") <= START + minutes(9))]
+        pd.testing.assert_frame_equal(read, expected, check_freq=False)
+
+    def test_read_spans_days(self):
+        bars = make_bars(start=datetime.datetime(2024, 8, 2, 23, 50, tzinfo=datetime.timezone.utc), minutes=30)
+        self.store.ingest(bars, bars.index[0][1], bars.index[-1][1], ["AAPL"])
+
+        read = self.store.read("AAPL", bars.index[0][1], bars.index[-1][1])
+
+        self.assertEqual(len(read), 30)
+        self.assertEqual(read["close"].tolist(), bars["close"].tolist())
+
+    def test_read_of_missing_symbol_is_empty(self):
+        read = self.store.read(["AAPL"], START, START + minutes(5))
+
+        self.assertTrue(read.empty)
+        self.assertEqual(read.index.names, ["symbol", "timestamp"])
+
+    def test_ingest_replaces_bars_fetched_again(self):
+        bars = make_bars(minutes=30)
+        self.store.ingest(bars, START, START + minutes(29), ["AAPL"])
+        corrected = bars.iloc[[3]].copy()
+        corrected["close"] = 1.0
+
+        self.store.ingest(corrected, START + minutes(3), START + minutes(3), ["AAPL"])
+
+        read = self.store.read("AAPL", START, START + minutes(29))
+        self.assertEqual(len(read), 30)
+        self.assertEqual(read["close"].iloc[3], 1.0)
+
+    def test_missing_ranges_include_minutes_without_bars(self):
+        self.store.ingest(make_bars(minutes=10), START, START + minutes(19), ["AAPL", "MSFT"])
+
+        # The range ends as the 19th minute starts, before that minute's bar could have been published
+        self.assertEqual(self.store.missing_ranges("AAPL", START, START + minutes(29)),
+                         [(to_ns(START + minutes(19)), to_ns(START + minutes(29)))])
+        self.assertEqual(self.store.missing_ranges("MSFT", START + minutes(5), START + minutes(15)), [])
+
+    def test_get_bars_fetches_only_missing_range(self):
+        fetcher = MagicMock(side_effect=[make_bars(minutes=10), make_bars(minutes=30).iloc[10:]])
+
+        first = self.store.get_bars("AAPL", START, START + minutes(9), fetcher)
+        second = self.store.get_bars("AAPL", START + minutes(5), START + minutes(29), fetcher)
+        third = self.store.get_bars("AAPL", START, START + minutes(29), fetcher)
+
+        self.assertEqual(len(first), 10)
+        self.assertEqual(len(second), 25)
+        self.assertEqual(len(third), 30)
+        self.assertEqual(fetcher.call_count, 2)
+        _, fetch_start, fetch_end = fetcher.call_args.args
+        self.assertGreater(fetch_start, START + minutes(9))
+        self.assertEqual(fetch_end, START + minutes(29))
+
+    def test_minute_whose_bar_has_not_arrived_is_fetched_again(self):
+        bars = make_bars(minutes=11)
+        # The first window ends 20 seconds into the minute after its 10 bars, before that minute's bar is published
+        fetcher = MagicMock(side_effect=[bars.iloc[:10], bars.iloc[10:]])
+        end = START + minutes(10) + datetime.timedelta(seconds=20)
+
+        self.store.get_bars("AAPL", START, end, fetcher)
+        read = self.store.get_bars("AAPL", START, end + minutes(1), fetcher)
+
+        self.assertEqual(fetcher.call_count, 2)
+        _, fetch_start, _ = fetcher.call_args.args
+        self.assertEqual(fetch_start, START + minutes(10))
+        self.assertEqual(len(read), 11)
+
+    def test_range_is_covered_up_to_the_newest_bar(self):
+        self.store.ingest(make_bars(minutes=11), START, START + minutes(10) + datetime.timedelta(seconds=20), ["AAPL"])
+
+        self.assertEqual(self.store.missing_ranges("AAPL", START, START + minutes(10)), [])
+
+    def test_get_bars_from_client(self):
+        bars = make_bars(("AAPL", "MSFT"), minutes=30)
+        client = BrokerSimulator(bars, start=START + minutes(30))
+
+        def fetcher(symbols, start, end):
+            return fetch_bars(client, symbols, start, end)
+
+        self.store.get_bars(["AAPL", "MSFT"], START, START + minutes(19), fetcher)
+        read = self.store.get_bars(["AAPL", "MSFT"], START + minutes(10), START + minutes(29), fetcher)
+
+        self.assertEqual(client.requests["get_stock_bars"], 2)
+        self.assertEqual(len(read), 40)
+        self.assertEqual(read.loc["MSFT"]["close"].tolist(), bars.loc["MSFT"]["close"].iloc[10:].tolist())
+        self.assertEqual(self.store.stats["fetches"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
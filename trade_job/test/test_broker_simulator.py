@@ -0,0 +1,243 @@
+import unittest
+import sys
+import datetime
+from io import StringIO
+from unittest.mock import patch
+import pandas as pd
+from alpaca.common.exceptions import APIError
+from alpaca.data.requests import StockBarsRequest
+from alpaca.data.timeframe import TimeFrame
+from alpaca.trading.requests import MarketOrderRequest, ClosePositionRequest, GetOrdersRequest
+from trade_job.src.broker_simulator import BrokerSimulator, RateLimiter
+from trade_job.src.order_ledger import OrderLedger
+from trade_job.src.state_store import InMemoryStateStore
+from trade_job.src.shared_bar_cache import create_shared_bar_cache
+from trade_job.src.job_snapshot import decode_snapshot
+from trade_job.src.trade_run import start_trade_run
+# trade_run imports its helpers as src.*, so the clock has to be set through that module
+from src.clock import use_clock
+from trade_job.test.data.fakes import BAR_START as START, make_bars
+
+
+def market_order(symbol, side, qty):
+    return MarketOrderRequest(symbol=symbol, qty=qty, side=side, time_in_force="day")
+
+
+class TestBrokerSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.bars = make_bars(("AAPL", "MSFT"))
+        self.simulator = BrokerSimulator(self.bars)
+
+    def test_market_order_fills_at_next_bar_open(self):
+        order = self.simulator.submit_order(market_order("AAPL", "buy", 2))
+        self.assertEqual(order.status, "new")
+
+        self.simulator.advance()
+
+        filled = self.simulator.get_order_by_id(order.id)
+        self.assertEqual(filled.status, "filled")
+        self.assertEqual(float(filled.filled_qty), 2)
+        self.assertAlmostEqual(float(filled.filled_avg_price), self.bars.loc["AAPL"]["open"].iloc[1])
+        position = self.simulator.get_open_position("AAPL")
+        self.assertEqual(float(position.qty), 2)
+
+    def test_fills_are_limited_by_bar_volume(self):
+        simulator = BrokerSimulator(make_bars(volume=10), max_participation=0.5)
+        order = simulator.submit_order(market_order("AAPL", "buy", 12))
+
+        simulator.advance()
+        self.assertEqual(simulator.get_order_by_id(order.id).status, "partially_filled")
+        self.assertEqual(float(simulator.get_order_by_id(order.id).filled_qty), 5)
+
+        simulator.advance(2)
+        self.assertEqual(simulator.get_order_by_id(order.id).status, "filled")
+
+    def test_selling_realizes_profit_at_average_cost(self):
+        self.simulator.submit_order(market_order("AAPL", "buy", 2))
+        self.simulator.advance()
+        self.simulator.close_position("AAPL", ClosePositionRequest(percentage="50"))
+        self.simulator.advance(5)
+
+        opens = self.bars.loc["AAPL"]["open"]
+        self.assertAlmostEqual(self.simulator.realized_pl, opens.iloc[2] - opens.iloc[1])
+        self.assertEqual(float(self.simulator.get_open_position("AAPL").qty), 1)
+
+    def test_selling_more_than_held_is_rejected(self):
+        self.simulator.submit_order(market_order("AAPL", "buy", 1))
+        self.simulator.advance()
+        self.simulator.submit_order(market_order("AAPL", "sell", 1))
+
+        with self.assertRaises(APIError) as error:
+            self.simulator.submit_order(market_order("AAPL", "sell", 1))
+        self.assertEqual(error.exception.status_code, 403)
+
+    def test_missing_position_is_not_found(self):
+        with self.assertRaises(APIError) as error:
+            self.simulator.get_open_position("AAPL")
+        self.assertEqual(error.exception.status_code, 404)
+
+    def test_cancel_order(self):
+        order = self.simulator.submit_order(market_order("AAPL", "buy", 1))
+
+        self.simulator.cancel_order_by_id(order.id)
+        self.simulator.advance()
+
+        self.assertEqual(self.simulator.get_order_by_id(order.id).status, "canceled")
+        self.assertEqual(self.simulator.get_all_positions(), [])
+        with self.assertRaises(APIError) as error:
+            self.simulator.cancel_order_by_id(order.id)
+        self.assertEqual(error.exception.status_code, 422)
+
+    def test_get_orders_filters_and_pages(self):
+        first = self.simulator.submit_order(market_order("AAPL", "buy", 1))
+        self.simulator.advance()
+        second = self.simulator.submit_order(market_order("AAPL", "buy", 1))
+        third = self.simulator.submit_order(market_order("MSFT", "buy", 1))
+
+        open_orders = self.simulator.get_orders(GetOrdersRequest(status="open"))
+        self.assertEqual([order.id for order in open_orders], [third.id, second.id])
+
+        after_first = self.simulator.get_orders(GetOrdersRequest(
+            status="all", symbols=["AAPL"], after=first.submitted_at, direction="asc", limit=5))
+        self.assertEqual([order.id for order in after_first], [second.id])
+
+        closed = self.simulator.get_orders(GetOrdersRequest(status="closed"))
+        self.assertEqual([order.id for order in closed], [first.id])
+
+    def test_get_stock_bars_returns_no_future_bars(self):
+        self.simulator.advance(10)
+
+        bars = self.simulator.get_stock_bars(StockBarsRequest(symbol_or_symbols=["AAPL"],
+                                                              timeframe=TimeFrame.Minute,
+                                                              start=START,
+                                                              end=START + datetime.timedelta(hours=1)))
+
+        self.assertEqual(len(bars.data["AAPL"]), 11)
+        self.assertEqual(bars.data["AAPL"][-1].timestamp, START + datetime.timedelta(minutes=10))
+
+    def test_now_reads_market_clock(self):
+        self.simulator.advance(10)
+
+        self.assertEqual(self.simulator.now(), datetime.datetime(2024, 8, 2, 13, 40))
+        self.assertEqual(self.simulator.submit_order(market_order("AAPL", "buy", 1)).submitted_at,
+                         START + datetime.timedelta(minutes=10))
+
+    def test_injected_errors(self):
+        simulator = BrokerSimulator(self.bars, error_rate=1.0)
+        with self.assertRaises(APIError) as error:
+            simulator.get_all_positions()
+        self.assertEqual(error.exception.status_code, 500)
+
+        self.simulator.fail_next("get_orders", ConnectionError("reset"))
+        with self.assertRaises(ConnectionError):
+            self.simulator.get_orders()
+        self.assertEqual(self.simulator.get_orders(), [])
+
+    def test_rate_limit(self):
+        now = [0.0]
+        simulator = BrokerSimulator(self.bars)
+        simulator.rate_limiter = RateLimiter(2, clock=lambda: now[0])
+
+        simulator.get_all_positions()
+        simulator.get_all_positions()
+        with self.assertRaises(APIError) as error:
+            simulator.get_all_positions()
+        self.assertEqual(error.exception.status_code, 429)
+
+        now[0] = 0.5
+        simulator.get_all_positions()
+
+
+class TestTradeRunAgainstSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def make_event(self):
+        return {
+            "jobParameters": {
+                "windowLength": 5,
+                "symbol": "AAPL",
+                "maxRuns": 100,
+                "offsetTime": 1,
+                "stopLoss": -1000,
+                "takeProfit": 1000
+            },
+            "jobInfo": "2024-08-02T13:30:00.000Z",
+            "jobStatus": {"cancelTradeJob": 0, "runCount": 0}
+        }
+
+    def test_trade_runs_track_simulated_profit_and_loss(self):
+        simulator = BrokerSimulator(make_bars(), start=START + datetime.timedelta(minutes=45))
+        event = self.make_event()
+        store = InMemoryStateStore()
+
+        with patch("trade_job.src.trade_run.get_clients", return_value=simulator.clients()):
+            with patch("trade_job.src.trade_run.state_store", store), use_clock(simulator.now):
+                with patch("trade_job.src.trade_run.shared_bar_cache", create_shared_bar_cache("memory")):
+                    for _ in range(60):
+                        event["jobStatus"] = start_trade_run(event, None)
+                        simulator.advance()
+
+        self.assertEqual(event["jobStatus"]["cancelTradeJob"], 0)
+        self.assertEqual(event["jobStatus"]["runCount"], 60)
+        self.assertGreater(simulator.requests["submit_order"], 0)
+        self.assertTrue(any(order["side"] == "sell" for order in simulator.orders.values()))
+        # The ledger realizes the same profit/loss from the broker's orders as the broker did
+        ledger = OrderLedger.load(store, "AAPL", event["jobInfo"])
+        self.assertNotEqual(simulator.realized_pl, 0)
+        self.assertAlmostEqual(ledger.update(simulator).realized_pl, simulator.realized_pl)
+
+    def test_snapshot_carries_state_between_runs_without_local_state(self):
+        simulator = BrokerSimulator(make_bars(), start=START + datetime.timedelta(minutes=45))
+        event = self.make_event()
+
+        with patch("trade_job.src.trade_run.get_clients", return_value=simulator.clients()), use_clock(simulator.now):
+            with patch("trade_job.src.trade_run.shared_bar_cache", None):
+                for _ in range(60):
+                    # Every run starts with nothing in /tmp, as on a cold Lambda
+                    with patch("trade_job.src.trade_run.state_store", InMemoryStateStore()):
+                        event["jobStatus"] = start_trade_run(event, None)
+                    simulator.advance()
+
+        ledger, close_average = decode_snapshot(event["jobStatus"]["snapshot"], "AAPL")
+        self.assertNotEqual(simulator.realized_pl, 0)
+        self.assertAlmostEqual(ledger.update(simulator).realized_pl, simulator.realized_pl)
+        self.assertEqual(close_average.count, 6)
+        self.assertEqual(close_average.last_timestamp, pd.Timestamp(START + datetime.timedelta(minutes=103)).value)
+
+    def test_retried_runs_do_not_place_orders_twice(self):
+        simulator = BrokerSimulator(make_bars(), start=START + datetime.timedelta(minutes=45))
+        event = self.make_event()
+        retried = 0
+
+        with patch("trade_job.src.trade_run.get_clients", return_value=simulator.clients()), use_clock(simulator.now):
+            with patch("trade_job.src.trade_run.state_store", InMemoryStateStore()):
+                with patch("trade_job.src.trade_run.shared_bar_cache", None):
+                    for _ in range(60):
+                        order_count = len(simulator.orders)
+                        result = start_trade_run(event, None)
+                        if len(simulator.orders) > order_count:
+                            # The Step Function retries an invocation with the same input. Its snapshot also holds
+                            # the order the first attempt placed.
+                            retry = start_trade_run(event, None)
+                            self.assertEqual((retry["cancelTradeJob"], retry["runCount"]),
+                                             (result["cancelTradeJob"], result["runCount"]))
+                            self.assertEqual(len(simulator.orders), order_count + 1)
+                            retried += 1
+                        event["jobStatus"] = result
+                        simulator.advance()
+
+        self.assertGreater(retried, 1)
+        self.assertGreater(simulator.requests["get_order_by_client_id"], 1)
+        client_order_ids = [order["client_order_id"] for order in simulator.orders.values()]
+        self.assertEqual(len(set(client_order_ids)), len(client_order_ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+from unittest.mock import patch
+from alpaca.common.exceptions import APIError
+from requests import Response
+from trade_job.src.secrets_helper import get_secret
+from trade_job.src.client_cache import ClientCache, is_auth_error
+from trade_job.test.data.fakes import FakeSecretsManager, make_api_error
+import sys
+from io import StringIO
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@patch("trade_job.src.client_cache.TradingClient")
+@patch("trade_job.src.client_cache.StockHistoricalDataClient")
+class TestClientCache(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        self.secrets_manager = FakeSecretsManager({"alpaca_api_key": "key", "alpaca_secret_key": "secret"})
+        self.clock = FakeClock()
+        self.cache = ClientCache(secret_loader=lambda: get_secret(self.secrets_manager), ttl=900, clock=self.clock)
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_warm_run_makes_no_secret_calls(self, mock_stock_client, mock_trading_client):
+        cold_clients = self.cache.get_clients()
+        self.assertEqual(self.secrets_manager.calls, 1)
+
+        warm_clients = self.cache.get_clients()
+
+        self.assertIs(cold_clients, warm_clients)
+        self.assertEqual(self.secrets_manager.calls, 1)
+        mock_stock_client.assert_called_once_with("key", "secret")
+        mock_trading_client.assert_called_once_with("key", "secret")
+        self.assertEqual(self.cache.stats["secret_hits"], 1)
+        self.assertEqual(self.cache.stats["secret_misses"], 1)
+        self.assertEqual(self.cache.stats["client_hits"], 1)
+        self.assertEqual(self.cache.stats["client_misses"], 1)
+        # Retries are left to src.retry rather than the SDK's fixed-wait retry
+        self.assertEqual(cold_clients[0]._retry, 0)
+        self.assertEqual(cold_clients[1]._retry, 0)
+
+    def test_expired_secret_is_refetched_but_clients_kept(self, mock_stock_client, mock_trading_client):
+        self.cache.get_clients()
+        self.clock.now = 900
+
+        self.cache.get_clients()
+
+        self.assertEqual(self.secrets_manager.calls, 2)
+        self.assertEqual(mock_trading_client.call_count, 1)
+        self.assertEqual(self.cache.stats["rotations"], 0)
+
+    def test_rotated_secret_rebuilds_clients(self, mock_stock_client, mock_trading_client):
+        self.cache.get_clients()
+        self.secrets_manager.secret = {"alpaca_api_key": "new_key", "alpaca_secret_key": "new_secret"}
+        self.clock.now = 901
+
+        self.cache.get_clients()
+
+        self.assertEqual(self.cache.stats["rotations"], 1)
+        mock_trading_client.assert_called_with("new_key", "new_secret")
+        self.assertEqual(mock_trading_client.call_count, 2)
+
+    def test_invalidate_forces_refresh(self, mock_stock_client, mock_trading_client):
+        self.cache.get_clients()
+        self.cache.invalidate()
+
+        self.cache.get_clients()
+
+        self.assertEqual(self.secrets_manager.calls, 2)
+        self.assertEqual(mock_trading_client.call_count, 2)
+        self.assertEqual(self.cache.stats["invalidations"], 1)
+
+    def test_is_auth_error(self, mock_stock_client, mock_trading_client):
+        self.assertTrue(is_auth_error(make_api_error(401)))
+        self.assertTrue(is_auth_error(make_api_error(403)))
+        self.assertFalse(is_auth_error(make_api_error(500)))
+        self.assertFalse(is_auth_error(ValueError("error")))
+
+        try:
+            try:
+                raise make_api_error(401)
+            except APIError as e:
+                raise Exception("Error during open order retrieval") from e
+        except Exception as wrapped:
+            self.assertTrue(is_auth_error(wrapped))
+
+
+
+class TestClientRetry(unittest.TestCase):
+    # Against the installed alpaca-py, as turning its retry off relies on a private attribute of RESTClient
+
+    def test_clients_do_not_retry_rate_limits_themselves(self):
+        cache = ClientCache(secret_loader=lambda: {"alpaca_api_key": "key", "alpaca_secret_key": "secret"})
+        response = Response()
+        response.status_code = 429
+        response.url = "https://paper-api.alpaca.markets/v2/clock"
+        response._content = b'{"code": 42910000, "message": "rate limit exceeded"}'
+
+        for client in cache.get_clients():
+            with patch.object(client._session, "request", return_value=response) as mock_request, \
+                    patch("alpaca.common.rest.time.sleep") as mock_sleep:
+                with self.assertRaises(APIError) as raised:
+                    client.get("/clock")
+
+            self.assertEqual(raised.exception.status_code, 429)
+            self.assertEqual(mock_request.call_count, 1)
+            mock_sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import sys
+import time
+from io import StringIO
+from unittest.mock import MagicMock, patch
+from alpaca.common.exceptions import APIError
+from trade_job.src.client_cache import is_auth_error
+from trade_job.src.concurrency import run_concurrently, ConcurrentCallError, CallTimeoutError
+# concurrency imports its attempt timer from src.retry, so the retried call has to go through that module
+from src.retry import call_with_retry
+
+
+def slow_call(seconds, result):
+    def call():
+        time.sleep(seconds)
+        return result
+    return call
+
+
+class TestRunConcurrently(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_calls_run_at_the_same_time(self):
+        started_at = time.monotonic()
+
+        results = run_concurrently({
+            "orders": slow_call(0.2, []),
+            "position": slow_call(0.2, "position"),
+            "bars": slow_call(0.3, (1.0, 2.0))
+        })
+
+        self.assertEqual(results, {"orders": [], "position": "position", "bars": (1.0, 2.0)})
+        self.assertLess(time.monotonic() - started_at, 0.6)
+
+    def test_timeout_is_tied_to_the_slow_call(self):
+        with self.assertRaises(ConcurrentCallError) as raised:
+            run_concurrently({"orders": slow_call(0.01, []), "bars": slow_call(0.5, None)},
+                             timeouts={"bars": 0.1})
+
+        self.assertEqual(list(raised.exception.errors), ["bars"])
+        self.assertIsInstance(raised.exception.errors["bars"], CallTimeoutError)
+        self.assertEqual(raised.exception.errors["bars"].name, "bars")
+
+    @patch("src.retry.default_policy.sleep")
+    def test_timeout_applies_to_each_retried_attempt(self, mock_sleep):
+        attempts = [ConnectionError("reset"), ConnectionError("reset"), None]
+
+        def flaky():
+            time.sleep(0.06)
+            error = attempts.pop(0)
+            if error is not None:
+                raise error
+            return "position"
+
+        started_at = time.monotonic()
+        results = run_concurrently({"position": lambda: call_with_retry("get_open_position", flaky)},
+                                   timeouts={"position": 0.1})
+
+        # Three attempts take longer than the timeout, but none of them does on its own
+        self.assertEqual(results, {"position": "position"})
+        self.assertGreater(time.monotonic() - started_at, 0.15)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    def test_errors_keep_their_call_name_and_cause(self):
+        http_error = MagicMock()
+        http_error.response.status_code = 401
+
+        def unauthorized():
+            raise APIError("unauthorized", http_error)
+
+        def missing():
+            raise KeyError("AAPL")
+
+        with self.assertRaises(ConcurrentCallError) as raised:
+            run_concurrently({"position": missing, "orders": unauthorized, "bars": slow_call(0, None)})
+
+        self.assertEqual(set(raised.exception.errors), {"orders", "position"})
+        self.assertIsInstance(raised.exception.errors["position"], KeyError)
+        self.assertIsInstance(raised.exception.__cause__, KeyError)
+        self.assertTrue(is_auth_error(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import json
+import math
+import numpy as np
+import pandas as pd
+from trade_job.src.indicators import (
+    SMA,
+    EMA,
+    RollingStd,
+    VWAP,
+    indicator_from_state,
+    load_indicator,
+    save_indicator
+)
+from trade_job.src.state_store import InMemoryStateStore
+
+
+def random_walk(length, seed=7):
+    generator = np.random.default_rng(seed)
+    closes = 190 + np.cumsum(generator.normal(0, 0.05, length))
+    volumes = generator.integers(100, 5000, length).astype(float)
+    return closes, volumes
+
+
+class TestIndicators(unittest.TestCase):
+
+    def setUp(self):
+        self.closes, self.volumes = random_walk(5000)
+        self.series = pd.Series(self.closes)
+
+    def assert_matches(self, indicator, expected, weights=None):
+        # pandas keeps its own running sums, so the two only agree to within their accumulated rounding
+        for i, close in enumerate(self.closes):
+            weight = 1.0 if weights is None else weights[i]
+            value = indicator.update(close, i, weight)
+            if math.isnan(expected[i]):
+                self.assertTrue(math.isnan(value))
+            else:
+                self.assertAlmostEqual(value, expected[i], delta=1e-8 * abs(expected[i]))
+
+    def test_sma_matches_pandas_rolling_mean(self):
+        self.assert_matches(SMA(20), self.series.rolling(20).mean().to_numpy())
+
+    def test_sma_min_periods_matches_pandas(self):
+        self.assert_matches(SMA(20, min_periods=1), self.series.rolling(20, min_periods=1).mean().to_numpy())
+
+    def test_ema_matches_pandas_ewm(self):
+        self.assert_matches(EMA(20), self.series.ewm(span=20, adjust=False).mean().to_numpy())
+
+    def test_rolling_std_matches_pandas(self):
+        self.assert_matches(RollingStd(20), self.series.rolling(20).std().to_numpy())
+
+    def test_vwap_matches_rolling_volume_weighted_mean(self):
+        volumes = pd.Series(self.volumes)
+        expected = ((self.series * volumes).rolling(20).sum() / volumes.rolling(20).sum()).to_numpy()
+        self.assert_matches(VWAP(20), expected, self.volumes)
+
+    def test_max_age_evicts_values_outside_time_window(self):
+        sma = SMA(10, min_periods=1, max_age=3)
+
+        sma.update(10, 0)
+        sma.update(20, 1)
+        sma.update(30, 5)
+
+        self.assertEqual(sma.count, 1)
+        self.assertEqual(sma.value, 30)
+
+    def test_restored_indicators_continue_where_they_left_off(self):
+        for indicator, expected in ((SMA(20), self.series.rolling(20).mean()),
+                                    (EMA(20), self.series.ewm(span=20, adjust=False).mean()),
+                                    (RollingStd(20), self.series.rolling(20).std())):
+            for i, close in enumerate(self.closes[:2500]):
+                indicator.update(close, i)
+            restored = indicator_from_state(json.loads(json.dumps(indicator.to_state())))
+            for i, close in enumerate(self.closes[2500:], start=2500):
+                restored.update(close, i)
+            self.assertAlmostEqual(restored.value, expected.iloc[-1], delta=1e-8 * abs(expected.iloc[-1]))
+            self.assertEqual(restored.last_timestamp, len(self.closes) - 1)
+
+    def test_load_indicator_creates_missing_state(self):
+        store = InMemoryStateStore()
+        sma = load_indicator(store, "indicators/AAPL/job/close_sma", lambda: SMA(5, min_periods=1))
+        sma.update(10, 1)
+        save_indicator(store, "indicators/AAPL/job/close_sma", sma)
+
+        restored = load_indicator(store, "indicators/AAPL/job/close_sma", lambda: SMA(5, min_periods=1))
+
+        self.assertEqual(restored.value, 10)
+        self.assertEqual(restored.last_timestamp, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
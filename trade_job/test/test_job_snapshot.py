@@ -0,0 +1,97 @@
+import unittest
+import sys
+import base64
+import json
+from io import StringIO
+from trade_job.src.job_snapshot import (
+    SnapshotError,
+    encode_snapshot,
+    decode_snapshot,
+    restore_snapshot,
+    snapshot_or_none
+)
+from trade_job.src.indicators import SMA
+from trade_job.src.order_ledger import OrderLedger
+
+
+def make_ledger():
+    ledger = OrderLedger("AAPL", "2024-08-02T21:02:44.952000Z", realized_pl=12.5,
+                         cursor_order_ids=["880938f0-6b96-4de1-9232-f3c25c0af224"], start="2024-08-02T13:30:00.000000Z")
+    ledger.open_orders["cc7767c2-45ce-47d5-bb88-6d114856a209"] = {
+        "id": "cc7767c2-45ce-47d5-bb88-6d114856a209",
+        "symbol": "AAPL",
+        "side": "sell",
+        "status": "partially_filled",
+        "filled_qty": 1.0,
+        "filled_notional": 190.25
+    }
+    ledger.positions["AAPL"] = {"qty": 2.0, "cost_basis": 380.5}
+    return ledger
+
+
+def make_close_average():
+    close_average = SMA(6, min_periods=1)
+    for i in range(8):
+        close_average.update(190.0 + i / 4, 1722632400000000000 + i * 60000000000)
+    return close_average
+
+
+class TestJobSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        # Redirect stdout to capture print statements
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_round_trip(self):
+        ledger = make_ledger()
+        close_average = make_close_average()
+
+        restored_ledger, restored_average = decode_snapshot(encode_snapshot(ledger, close_average), "AAPL")
+
+        self.assertEqual(restored_ledger.to_state(), ledger.to_state())
+        self.assertEqual(restored_average.to_state(), close_average.to_state())
+        self.assertEqual(restored_average.value, close_average.value)
+        self.assertEqual(restored_average.last_timestamp, close_average.last_timestamp)
+
+    def test_snapshot_is_smaller_than_json_state(self):
+        ledger = make_ledger()
+        close_average = make_close_average()
+
+        snapshot = encode_snapshot(ledger, close_average)
+
+        self.assertLess(len(snapshot), len(json.dumps([ledger.to_state(), close_average.to_state()])))
+
+    def test_unreadable_snapshots_are_rejected(self):
+        snapshot = base64.b64decode(encode_snapshot(make_ledger(), make_close_average()))
+
+        for data in [b"XX" + snapshot[2:], snapshot[:2] + bytes([1]) + snapshot[3:], snapshot[:-5]]:
+            with self.assertRaises(SnapshotError):
+                decode_snapshot(base64.b64encode(data).decode(), "AAPL")
+        with self.assertRaises(SnapshotError):
+            decode_snapshot("not base64!", "AAPL")
+
+    def test_restore_snapshot(self):
+        snapshot = encode_snapshot(make_ledger(), make_close_average())
+
+        self.assertIsNone(restore_snapshot(None, "AAPL", 6))
+        self.assertIsNone(restore_snapshot("bm90IGEgc25hcHNob3Q=", "AAPL", 6))
+        # A job whose window length changed starts its average again
+        self.assertIsNone(restore_snapshot(snapshot, "AAPL", 11))
+        ledger, close_average = restore_snapshot(snapshot, "AAPL", 6)
+        self.assertEqual(ledger.realized_pl, 12.5)
+
+    def test_snapshot_over_size_limit_is_dropped(self):
+        ledger = make_ledger()
+        close_average = make_close_average()
+        size = len(encode_snapshot(ledger, close_average))
+
+        self.assertIsNotNone(snapshot_or_none(ledger, close_average, max_bytes=size))
+        self.assertIsNone(snapshot_or_none(ledger, close_average, max_bytes=size - 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
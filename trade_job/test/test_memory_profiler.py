@@ -0,0 +1,63 @@
+import unittest
+import sys
+import json
+import tracemalloc
+from io import StringIO
+from trade_job.src.memory_profiler import memory_profile_scope, memory_phase, recommend_memory_mb
+
+
+class TestMemoryProfiler(unittest.TestCase):
+
+    def setUp(self):
+        # Redirect stdout to capture print statements
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_disabled_profile_does_not_trace(self):
+        with memory_profile_scope(enabled=False) as profile:
+            with memory_phase("Fetch"):
+                pass
+
+        self.assertIsNone(profile)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_profile_records_phases_and_allocation_sites(self):
+        with memory_profile_scope(enabled=True) as profile:
+            with memory_phase("Fetch"):
+                retained = [bytearray(1024) for _ in range(1000)]
+            with memory_phase("Evaluate"):
+                temporary = bytearray(4 * 1024 * 1024)
+                del temporary
+
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertGreaterEqual(profile.phases["Fetch"]["allocated_kb"], 1000)
+        self.assertGreaterEqual(profile.phases["Evaluate"]["peak_kb"], 4096)
+        self.assertLess(profile.phases["Evaluate"]["allocated_kb"], 100)
+        self.assertGreaterEqual(profile.peak_kb, 5096)
+        self.assertEqual(profile.heaviest_phase, "Fetch")
+        self.assertIn("test_memory_profiler.py", profile.top_sites[0]["site"])
+        self.assertIn("list", profile.object_counts)
+        self.assertEqual(len(retained), 1000)
+
+        report = json.loads(sys.stdout.getvalue().splitlines()[-1])["MemoryProfile"]
+        self.assertEqual(report["peak_kb"], profile.peak_kb)
+
+    def test_overlapping_profiles_share_tracing(self):
+        with memory_profile_scope(enabled=True, emit=False):
+            with memory_profile_scope(enabled=True, emit=False):
+                pass
+            self.assertTrue(tracemalloc.is_tracing())
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_recommend_memory_mb(self):
+        self.assertEqual(recommend_memory_mb(50 * 1024, 10 * 1024), 128)
+        # The headroom covers the baseline as well as the run's peak
+        self.assertEqual(recommend_memory_mb(100 * 1024, 10 * 1024), 192)
+        self.assertEqual(recommend_memory_mb(130 * 1024, 100 * 1024, headroom=2), 512)
+
+
+if __name__ == '__main__':
+    unittest.main()
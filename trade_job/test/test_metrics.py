@@ -0,0 +1,183 @@
+import unittest
+import sys
+import json
+import time
+from io import StringIO
+from unittest.mock import MagicMock, patch, ANY
+from trade_job.src.metrics import (
+    RunMetrics,
+    metrics_scope,
+    span,
+    record_call,
+    record_retries,
+    payload_size
+)
+from trade_job.src.retry import RetryScope, call_with_retry
+from trade_job.src.trade_run import start_batch_trade_run
+from trade_job.src.state_store import InMemoryStateStore
+from trade_job.test.data.test_variables import multi_symbol_stock_data_df
+
+
+class FakeClock:
+    def __init__(self, *times):
+        self.times = list(times)
+
+    def __call__(self):
+        return self.times.pop(0)
+
+
+def emitted_records(output):
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{"_aws"')]
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.held_output = StringIO()
+        sys.stdout = self.held_output
+
+    def tearDown(self):
+        sys.stdout = sys.__stdout__
+
+    def test_span_adds_up_repeated_phases(self):
+        metrics = RunMetrics({"Handler": "run_trade_job"}, clock=FakeClock(1.0, 1.25, 2.0, 2.5))
+
+        with metrics.span("Orders"):
+            pass
+        with metrics.span("Orders"):
+            pass
+
+        self.assertEqual(metrics.durations, {"Orders": 750})
+
+    def test_to_emf_declares_durations_and_counts(self):
+        metrics = RunMetrics({"Handler": "run_trade_job"}, namespace="Test")
+        metrics.add_duration("Fetch", 12.3456)
+        metrics.add_count("get_ordersCalls")
+        metrics.set_property("Decision", "buy")
+
+        record = metrics.to_emf(1000)
+
+        self.assertEqual(record["_aws"]["Timestamp"], 1000)
+        self.assertEqual(record["_aws"]["CloudWatchMetrics"], [{
+            "Namespace": "Test",
+            "Dimensions": [["Handler"]],
+            "Metrics": [{"Name": "FetchDuration", "Unit": "Milliseconds"},
+                        {"Name": "get_ordersCalls", "Unit": "Count"}]
+        }])
+        self.assertEqual(record["Handler"], "run_trade_job")
+        self.assertEqual(record["Decision"], "buy")
+        self.assertEqual(record["FetchDuration"], 12.346)
+        self.assertEqual(record["get_ordersCalls"], 1)
+
+    def test_metrics_scope_emits_one_record_including_errors(self):
+        with self.assertRaises(ValueError):
+            with metrics_scope({"Handler": "run_trade_job"}, enabled=True):
+                with span("Fetch"):
+                    raise ValueError("failed")
+
+        records = emitted_records(self.held_output.getvalue())
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["Error"], "ValueError")
+        self.assertIn("FetchDuration", records[0])
+        self.assertIn("RunDuration", records[0])
+
+    def test_disabled_metrics_record_nothing(self):
+        with metrics_scope({"Handler": "run_trade_job"}, enabled=False) as metrics:
+            with span("Fetch"):
+                record_call("get_orders", 1.0, [])
+
+        self.assertIsNone(metrics)
+        self.assertEqual(emitted_records(self.held_output.getvalue()), [])
+
+    def test_record_call_adds_duration_and_payload_size(self):
+        with metrics_scope({"Handler": "run_trade_job"}, enabled=True) as metrics:
+            record_call("get_orders", 2.0, [1, 2, 3])
+            record_call("get_orders", 1.5, [4])
+
+        self.assertEqual(metrics.counts["get_ordersCalls"], 2)
+        self.assertEqual(metrics.counts["get_ordersItems"], 4)
+        self.assertEqual(metrics.durations["get_orders"], 3.5)
+
+    @patch("trade_job.src.retry.record_call")
+    def test_call_with_retry_records_failed_calls(self, mock_record_call):
+        with self.assertRaises(ValueError):
+            call_with_retry("get_orders", MagicMock(side_effect=ValueError("bad request")))
+
+        mock_record_call.assert_called_once_with("get_orders", ANY, None)
+
+    def test_payload_size_counts_bars_in_bar_set(self):
+        bar_set = MagicMock(data={"AAPL": [1, 2], "MSFT": [3]})
+
+        self.assertEqual(payload_size(bar_set), 3)
+        self.assertIsNone(payload_size(object()))
+
+    def test_span_overhead_is_negligible(self):
+        # A run opens around ten spans; their cost should be far below a single broker call
+        with metrics_scope({"Handler": "run_trade_job"}, enabled=True):
+            started_at = time.perf_counter()
+            for _ in range(1000):
+                with span("Evaluate"):
+                    pass
+            per_span = (time.perf_counter() - started_at) / 1000
+
+        self.assertLess(per_span, 0.0005)
+
+    def test_record_retries_adds_counts_per_call(self):
+        scope = RetryScope()
+        scope.record(scope.calls, "submit_order")
+        scope.record(scope.retries, "submit_order")
+
+        with metrics_scope({"Handler": "run_trade_job"}, enabled=True) as metrics:
+            record_retries(scope)
+
+        self.assertEqual(metrics.counts, {"submit_orderRetries": 1})
+
+    @patch("trade_job.src.trade_run.state_store", InMemoryStateStore())
+    @patch("trade_job.src.trade_run.get_stock_data")
+    @patch("trade_job.src.trade_run.OrderLedger")
+    @patch("trade_job.src.trade_run.get_clients")
+    def test_trade_run_emits_one_record_with_phases_and_decision(self,
+                                                                 mock_get_clients,
+                                                                 mock_order_ledger,
+                                                                 mock_get_stock_data):
+        trading_client = MagicMock()
+        trading_client.get_all_positions.return_value = []
+        mock_get_clients.return_value = (MagicMock(), trading_client)
+        order_ledger = mock_order_ledger.load.return_value.update.return_value
+        order_ledger.realized_pl = 0
+        order_ledger.get_open_orders.return_value = []
+        mock_get_stock_data.return_value = multi_symbol_stock_data_df
+        event = {
+            "jobParameters": {
+                "windowLength": 5,
+                "symbols": ["AAPL", "MSFT", "TSLA"],
+                "maxRuns": 3,
+                "offsetTime": 16,
+                "stopLoss": -10,
+                "takeProfit": 10
+            },
+            "jobInfo": "2024-08-02T21:02:44.952Z",
+            "jobStatus": {
+                "cancelTradeJob": 0,
+                "runCount": 1
+            }
+        }
+
+        with patch("trade_job.src.trade_run.buy_stock"):
+            start_batch_trade_run(event, MagicMock(get_remaining_time_in_millis=lambda: 60000))
+
+        records = emitted_records(self.held_output.getvalue())
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record["Handler"], "run_batch_trade_job")
+        self.assertEqual(record["Symbol"], ["AAPL", "MSFT", "TSLA"])
+        self.assertEqual(record["Decision"], {"buy": ["AAPL"], "sell": []})
+        self.assertEqual(record["CancelTradeJob"], 0)
+        self.assertEqual(record["get_all_positionsCalls"], 1)
+        self.assertEqual(record["get_all_positionsRetries"], 0)
+        for phase in ("Run", "GetClients", "LoadState", "Fetch", "SaveState", "Evaluate", "Orders"):
+            self.assertIn(f"{phase}Duration", record)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import sys
+import threading
+from io import StringIO
+from unittest.mock import MagicMock
+from alpaca.trading.requests import GetOrdersRequest
+from trade_job.src.multiplex import SharedTradingClient, SharedClients, job_outcome
+from trade_job.src.trade_helper import get_open_positions
+
+
+class TestSharedTradingClient(unittest.TestCase):
+
+    def setUp(self):
+        # Redirect stdout to capture print statements
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.trading_client = MagicMock()
+        self.position = MagicMock(symbol="AAPL", unrealized_pl="1.5")
+        self.trading_client.get_all_positions.return_value = [self.position]
+        self.shared_client = SharedTradingClient(self.trading_client)
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_positions_are_fetched_once(self):
+        self.assertEqual(get_open_positions(self.shared_client, "AAPL"), self.position)
+        self.assertFalse(get_open_positions(self.shared_client, "MSFT"))
+        self.assertEqual(self.shared_client.get_all_positions(), [self.position])
+
+        self.trading_client.get_all_positions.assert_called_once()
+        self.trading_client.get_open_position.assert_not_called()
+
+    def test_concurrent_calls_wait_for_the_first(self):
+        release = threading.Event()
+        self.trading_client.get_all_positions.side_effect = lambda: release.wait() and [self.position]
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.shared_client.get_all_positions()))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while self.shared_client.stats["shared_calls"] < 3:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.trading_client.get_all_positions.assert_called_once()
+        self.assertEqual(results, [[self.position]] * 4)
+
+    def test_failed_call_is_made_again(self):
+        self.trading_client.get_all_positions.side_effect = [ConnectionError("reset"), [self.position]]
+
+        with self.assertRaises(ConnectionError):
+            self.shared_client.get_all_positions()
+
+        self.assertEqual(self.shared_client.get_all_positions(), [self.position])
+        self.assertEqual(self.trading_client.get_all_positions.call_count, 2)
+
+    def test_identical_order_requests_are_made_once(self):
+        self.shared_client.get_orders(GetOrdersRequest(status="all", symbols=["AAPL"]))
+        self.shared_client.get_orders(GetOrdersRequest(status="all", symbols=["AAPL"]))
+        self.shared_client.get_orders(GetOrdersRequest(status="all", symbols=["MSFT"]))
+        self.shared_client.get_order_by_id("1")
+        self.shared_client.get_order_by_id("1")
+
+        self.assertEqual(self.trading_client.get_orders.call_count, 2)
+        self.trading_client.get_order_by_id.assert_called_once_with("1")
+
+    def test_other_calls_are_passed_through(self):
+        self.shared_client.submit_order("order")
+        self.shared_client.submit_order("order")
+
+        self.assertEqual(self.trading_client.submit_order.call_count, 2)
+
+
+class TestSharedClients(unittest.TestCase):
+
+    def test_refreshed_clients_are_shared_from_then_on(self):
+        first_clients = (MagicMock(), MagicMock())
+        refreshed_clients = (MagicMock(), MagicMock())
+        get_clients = MagicMock(side_effect=[first_clients, first_clients, refreshed_clients])
+        clients = SharedClients(get_clients)
+
+        first = clients()
+        self.assertIs(clients(), first)
+        refreshed = clients()
+
+        self.assertIsNot(refreshed, first)
+        self.assertIs(refreshed[1].trading_client, refreshed_clients[1])
+
+
+class TestJobOutcome(unittest.TestCase):
+
+    def test_job_outcome(self):
+        job = {"jobParameters": {"symbol": "AAPL"}, "jobInfo": "2024-08-02T21:02:44.952Z",
+               "jobStatus": {"cancelTradeJob": 0, "runCount": 1}}
+
+        self.assertEqual(job_outcome(job, {"cancelTradeJob": 0, "runCount": 2}, None),
+                         {"jobParameters": {"symbol": "AAPL"}, "jobInfo": "2024-08-02T21:02:44.952Z",
+                          "jobStatus": {"cancelTradeJob": 0, "runCount": 2}})
+        self.assertEqual(job_outcome(job, None, ConnectionError("reset")),
+                         {"jobParameters": {"symbol": "AAPL"}, "jobInfo": "2024-08-02T21:02:44.952Z",
+                          "jobStatus": {"cancelTradeJob": 0, "runCount": 1}, "error": "ConnectionError: reset"})
+
+
+if __name__ == '__main__':
+    unittest.main()
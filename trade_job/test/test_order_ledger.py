@@ -0,0 +1,211 @@
+import unittest
+import sys
+import datetime
+from io import StringIO
+from unittest.mock import MagicMock
+from alpaca.trading.requests import MarketOrderRequest
+from trade_job.src.broker_simulator import BrokerSimulator
+from trade_job.src.order_ledger import OrderLedger
+from trade_job.src.state_store import InMemoryStateStore
+from trade_job.src.constants import ORDER_PAGE_LIMIT
+from trade_job.test.data.fakes import make_price_bars
+
+JOB_START_TIME = "2024-07-29T08:00:00.000000Z"
+JOB_START = datetime.datetime(2024, 7, 29, 8, 0)
+
+
+def make_simulator(prices, volume=100, start=JOB_START, **options):
+    # An AAPL bar a minute from `start` at each price. The market clock starts at the first bar, so orders placed
+    # before an advance() fill at the next bar's price.
+    return BrokerSimulator(make_price_bars(prices, start=start, volume=volume), start=start, **options)
+
+
+def submit(simulator, side, qty):
+    return simulator.submit_order(MarketOrderRequest(symbol="AAPL", qty=qty, side=side, time_in_force="day"))
+
+
+class TestOrderLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_update_calculates_realized_pl(self):
+        simulator = make_simulator([1, 1, 2])
+        submit(simulator, "buy", 3)
+        simulator.advance()
+        submit(simulator, "sell", 1)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.realized_pl, 1)
+        self.assertEqual(ledger.positions["AAPL"], {"qty": 2, "cost_basis": 2})
+        self.assertEqual(ledger.cursor, "2024-07-29T08:01:00.000000Z")
+        self.assertEqual(ledger.get_open_orders(), [])
+
+    def test_orders_before_job_start_are_ignored(self):
+        simulator = make_simulator([1, 1], start=JOB_START - datetime.timedelta(minutes=1))
+        submit(simulator, "buy", 3)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.positions, {})
+        self.assertEqual(ledger.stats["fetched_orders"], 0)
+
+    def test_second_update_only_applies_new_orders(self):
+        simulator = make_simulator([1, 1, 5])
+        submit(simulator, "buy", 3)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+        ledger.update(simulator)
+
+        submit(simulator, "sell", 2)
+        simulator.advance()
+        ledger.update(simulator)
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.realized_pl, 8)
+        self.assertEqual(ledger.stats["fetched_orders"], 2)
+
+    def test_partially_filled_order_is_completed_later(self):
+        # Each bar's volume limits how much of an order it fills
+        simulator = make_simulator([10, 10, 11.5, 15, 12], volume=[100, 1, 2, 1, 2])
+        buy = submit(simulator, "buy", 3)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.positions["AAPL"], {"qty": 1, "cost_basis": 10})
+        self.assertEqual([order["id"] for order in ledger.get_open_orders("buy")], [str(buy.id)])
+
+        simulator.advance()
+        submit(simulator, "sell", 3)
+        simulator.advance()
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.positions["AAPL"], {"qty": 2, "cost_basis": 22})
+        self.assertEqual(ledger.realized_pl, 4)
+        self.assertEqual(ledger.get_open_orders("buy"), [])
+        self.assertEqual(len(ledger.get_open_orders("sell")), 1)
+
+        simulator.advance()
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.positions["AAPL"], {"qty": 0, "cost_basis": 0})
+        self.assertEqual(ledger.realized_pl, 6)
+        self.assertEqual(ledger.get_open_orders(), [])
+        self.assertEqual(ledger.stats["refreshed_orders"], 2)
+
+    def test_selling_shares_not_bought_by_job_realizes_nothing(self):
+        simulator = make_simulator([4, 4, 5], start=JOB_START - datetime.timedelta(minutes=1))
+        submit(simulator, "buy", 2)
+        simulator.advance()
+        submit(simulator, "sell", 2)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.realized_pl, 0)
+
+    def test_orders_sharing_cursor_timestamp_are_not_double_counted(self):
+        simulator = make_simulator([4, 4], order_time_step=0)
+        submit(simulator, "buy", 2)
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+        ledger.update(simulator)
+
+        submit(simulator, "buy", 1)
+        ledger.update(simulator)
+        ledger.update(simulator)
+        simulator.advance()
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.positions["AAPL"], {"qty": 3, "cost_basis": 12})
+        self.assertEqual(ledger.stats["fetched_orders"], 2)
+
+    def test_update_pages_through_orders(self):
+        simulator = make_simulator([1, 1], volume=ORDER_PAGE_LIMIT + 10)
+        for _ in range(ORDER_PAGE_LIMIT + 10):
+            submit(simulator, "buy", 1)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.positions["AAPL"]["qty"], ORDER_PAGE_LIMIT + 10)
+        self.assertEqual(simulator.requests["get_orders"], 2)
+
+    def test_open_orders_are_refreshed_from_one_query(self):
+        simulator = make_simulator([10, 10, 10], volume=[100, 3, 3])
+        for _ in range(3):
+            submit(simulator, "buy", 2)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+        ledger.update(simulator)
+
+        self.assertEqual(len(ledger.get_open_orders()), 2)
+
+        simulator.advance()
+        simulator.requests.clear()
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.positions["AAPL"], {"qty": 6, "cost_basis": 60})
+        self.assertEqual(ledger.get_open_orders(), [])
+        self.assertEqual(ledger.stats["refreshed_orders"], 2)
+        # One query for the open orders and one for new orders, however many orders are open
+        self.assertEqual(simulator.requests["get_orders"], 2)
+        self.assertEqual(simulator.requests["get_order_by_id"], 0)
+
+    def test_open_orders_are_only_looked_for_since_the_job_started(self):
+        simulator = make_simulator([10, 10], volume=[100, 1])
+        submit(simulator, "buy", 3)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+        ledger.update(simulator)
+        simulator.get_orders = MagicMock(side_effect=simulator.get_orders)
+
+        ledger.update(simulator)
+
+        refresh_filter = simulator.get_orders.call_args_list[0].args[0]
+        self.assertEqual(refresh_filter.after.isoformat(), "2024-07-29T07:59:59.999999")
+        self.assertEqual(ledger.start, JOB_START_TIME)
+
+    def test_orders_after_a_full_page_at_the_cursor_time_are_fetched(self):
+        simulator = make_simulator([1, 1, 3], volume=ORDER_PAGE_LIMIT, order_time_step=0)
+        for _ in range(ORDER_PAGE_LIMIT):
+            submit(simulator, "buy", 1)
+        simulator.advance()
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+        ledger.update(simulator)
+
+        submit(simulator, "sell", 2)
+        simulator.advance()
+        ledger.update(simulator)
+
+        self.assertEqual(ledger.positions["AAPL"]["qty"], ORDER_PAGE_LIMIT - 2)
+        self.assertEqual(ledger.realized_pl, 4)
+        self.assertEqual(ledger.cursor, "2024-07-29T08:01:00.000000Z")
+
+    def test_ledger_round_trips_through_store(self):
+        simulator = make_simulator([10, 10], volume=[100, 1])
+        submit(simulator, "buy", 3)
+        simulator.advance()
+        store = InMemoryStateStore()
+        OrderLedger.load(store, "AAPL", JOB_START_TIME).update(simulator).save(store, JOB_START_TIME)
+
+        ledger = OrderLedger.load(store, "AAPL", JOB_START_TIME)
+
+        self.assertEqual(ledger.positions["AAPL"], {"qty": 1, "cost_basis": 10})
+        self.assertEqual(ledger.cursor, "2024-07-29T08:00:00.000000Z")
+        self.assertEqual(len(ledger.get_open_orders("buy")), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
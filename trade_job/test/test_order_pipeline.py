@@ -0,0 +1,82 @@
+import unittest
+import sys
+import threading
+from io import StringIO
+from unittest.mock import MagicMock
+from trade_job.src.client_cache import is_auth_error
+# order_pipeline imports its helpers as src.*, so the error it raises is the one from that module
+from src.concurrency import ConcurrentCallError
+from trade_job.src.order_pipeline import OrderPipeline, client_order_id, is_duplicate_order
+from trade_job.test.data.fakes import make_api_error
+
+JOB_START_TIME = "2024-08-02T21:02:44.952Z"
+
+
+class TestOrderPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_client_order_id_is_derived_from_job_run_and_intent(self):
+        order_id = client_order_id(JOB_START_TIME, 3, "buy", "AAPL")
+
+        self.assertEqual(order_id, client_order_id(JOB_START_TIME, 3, "buy", "AAPL"))
+        self.assertNotEqual(order_id, client_order_id(JOB_START_TIME, 4, "buy", "AAPL"))
+        self.assertNotEqual(order_id, client_order_id(JOB_START_TIME, 3, "close", "AAPL"))
+        self.assertNotEqual(order_id, client_order_id(JOB_START_TIME, 3, "buy", "MSFT"))
+        self.assertNotEqual(order_id, client_order_id("2024-08-03T21:02:44.952Z", 3, "buy", "AAPL"))
+
+    def test_is_duplicate_order(self):
+        self.assertTrue(is_duplicate_order(make_api_error(422, "client_order_id must be unique")))
+        self.assertFalse(is_duplicate_order(make_api_error(422, "asset not found")))
+        self.assertFalse(is_duplicate_order(make_api_error(500, "client_order_id must be unique")))
+
+    def test_orders_are_submitted_together_and_confirmed(self):
+        pipeline = OrderPipeline(JOB_START_TIME, 3)
+        # Both submissions have to be running at once to get past the barrier
+        barrier = threading.Barrier(2, timeout=1)
+
+        def submit(order_id):
+            barrier.wait()
+            return order_id
+
+        buy_id = pipeline.submit("buy", "AAPL", submit)
+        close_id = pipeline.submit("close", "MSFT", submit)
+
+        self.assertEqual(pipeline.confirm(), {buy_id: buy_id, close_id: close_id})
+        self.assertEqual(pipeline.confirm(), {})
+
+    def test_an_intent_is_only_submitted_once_per_run(self):
+        pipeline = OrderPipeline(JOB_START_TIME, 3)
+        submit = MagicMock(return_value="order")
+
+        first = pipeline.submit("close", "AAPL", submit)
+        second = pipeline.submit("close", "AAPL", submit)
+
+        self.assertEqual(first, second)
+        self.assertEqual(pipeline.confirm(), {first: "order"})
+        submit.assert_called_once_with(first)
+
+    def test_failures_are_raised_after_every_submission_finishes(self):
+        pipeline = OrderPipeline(JOB_START_TIME, 3)
+        submit = MagicMock(return_value="order")
+
+        def unauthorized(order_id):
+            raise make_api_error(401)
+
+        pipeline.submit("buy", "AAPL", unauthorized)
+        pipeline.submit("buy", "MSFT", submit)
+
+        with self.assertRaises(ConcurrentCallError) as raised:
+            pipeline.confirm()
+        self.assertEqual(list(raised.exception.errors), ["buy AAPL"])
+        self.assertTrue(is_auth_error(raised.exception))
+        submit.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import copy
+import numpy as np
+from alpaca.trading.enums import OrderStatus
+from alpaca.trading.models import Order
+from trade_job.src.order_ledger import OrderLedger
+from trade_job.src.order_store import OrderStore, as_order_store
+from trade_job.test.data.test_variables import test_order_json
+
+
+def make_order(order_id, side, status, filled_qty, filled_avg_price, symbol="AAPL"):
+    order_json = copy.deepcopy(test_order_json[0])
+    order_json.update({
+        "id": f"00000000-0000-0000-0000-{order_id:012d}",
+        "submitted_at": f"2024-08-02T14:{order_id:02d}:00Z",
+        "symbol": symbol,
+        "side": side,
+        "status": status,
+        "filled_qty": filled_qty,
+        "filled_avg_price": filled_avg_price
+    })
+    return Order(**order_json)
+
+
+class TestOrderStore(unittest.TestCase):
+
+    def setUp(self):
+        self.orders = [
+            make_order(1, "buy", "filled", "3", "10.5"),
+            make_order(2, "sell", "filled", "2", "12"),
+            make_order(3, "sell", "partially_filled", "1", "11"),
+            make_order(4, "buy", "new", None, None),
+            make_order(5, "buy", "canceled", "0", None, symbol="MSFT")
+        ]
+        self.order_store = OrderStore.from_orders(self.orders)
+
+    def test_from_orders_stores_columns(self):
+        self.assertEqual(len(self.order_store), 5)
+        self.assertEqual(list(self.order_store.ids), [str(order.id) for order in self.orders])
+        self.assertEqual(self.order_store.sides.dtype, np.int8)
+        np.testing.assert_array_equal(self.order_store.filled_qty, [3, 2, 1, 0, 0])
+        np.testing.assert_array_equal(self.order_store.filled_avg_price, [10.5, 12, 11, 0, 0])
+
+    def test_realized_pl_is_taken_at_average_cost(self):
+        # Both sells, the partial fill included, realize their price less the 10.5 average cost of the buy
+        self.assertAlmostEqual(self.order_store.realized_pl(), (12 - 10.5) * 2 + (11 - 10.5) * 1)
+        # Newest first, as the orders API returns them by default, gives the same result
+        self.assertAlmostEqual(OrderStore.from_orders(self.orders[::-1]).realized_pl(), 3.5)
+
+    def test_realized_pl_matches_the_order_ledger(self):
+        ledger = OrderLedger("AAPL", "2024-08-02T14:00:00.000Z")
+        for order in self.orders:
+            ledger.apply(order)
+
+        self.assertAlmostEqual(self.order_store.realized_pl(), ledger.realized_pl)
+
+    def test_select_by_side_and_status(self):
+        mask = self.order_store.side_mask("sell") & self.order_store.status_mask(OrderStatus.FILLED)
+
+        selected = self.order_store.select(mask)
+
+        self.assertEqual(list(selected.ids), [str(self.orders[1].id)])
+        # A sell without the buy it closed has no known cost, so realizes nothing
+        self.assertEqual(selected.realized_pl(), 0)
+
+    def test_iterates_orders_as_ledger_dicts(self):
+        orders = list(self.order_store.select(self.order_store.side_mask("buy")))
+
+        self.assertEqual([order["id"] for order in orders], [str(self.orders[i].id) for i in (0, 3, 4)])
+        self.assertEqual(orders[0], {"id": str(self.orders[0].id), "symbol": "AAPL", "side": "buy", "status": "filled",
+                                     "filled_qty": 3.0, "filled_notional": 31.5})
+        self.assertEqual(orders[2]["symbol"], "MSFT")
+
+    def test_unknown_side_matches_nothing(self):
+        self.assertFalse(self.order_store.side_mask("short").any())
+
+    def test_as_order_store_converts_once(self):
+        self.assertIs(as_order_store(self.order_store), self.order_store)
+        self.assertEqual(len(as_order_store([])), 0)
+        self.assertEqual(as_order_store([]).realized_pl(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
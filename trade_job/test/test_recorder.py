@@ -0,0 +1,94 @@
+import unittest
+import sys
+import datetime
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+from trade_job.src.broker_simulator import BrokerSimulator
+from trade_job.src.state_store import InMemoryStateStore
+from trade_job.src.trade_run import start_trade_run
+# trade_run imports its helpers as src.*, so the clock and the replay driver are used through those modules
+from src.clock import use_clock
+from src.recorder import Recorder, ReplayMismatch, load_recording, replay_job
+from trade_job.test.data.fakes import BAR_START as START, make_bars
+
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "recording.pkl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+        sys.stdout = self.held_stdout
+
+    def record_job(self, max_runs, **simulator_options):
+        simulator = BrokerSimulator(make_bars(minutes=max_runs + 60), start=START + datetime.timedelta(minutes=45),
+                                    **simulator_options)
+        event = {
+            "jobParameters": {
+                "windowLength": 5,
+                "symbol": "AAPL",
+                "maxRuns": max_runs,
+                "offsetTime": 1,
+                "stopLoss": -1000,
+                "takeProfit": 1000
+            },
+            "jobInfo": "2024-08-02T13:30:00.000Z",
+            "jobStatus": {"cancelTradeJob": 0, "runCount": 0}
+        }
+        results = []
+        with patch("trade_job.src.trade_run.get_clients", return_value=simulator.clients()), use_clock(simulator.now):
+            with patch("trade_job.src.trade_run.state_store", InMemoryStateStore()):
+                with patch("trade_job.src.trade_run.shared_bar_cache", None):
+                    with patch("trade_job.src.trade_run.recorder", Recorder(self.path)), \
+                            patch("src.retry.default_policy.sleep"):
+                        while not event["jobStatus"]["cancelTradeJob"]:
+                            try:
+                                event["jobStatus"] = start_trade_run(event, None)
+                                results.append(event["jobStatus"])
+                            except Exception:
+                                # The Step Function retries the run with the same input
+                                pass
+                            simulator.advance()
+        return simulator, results
+
+    def test_full_job_replays_with_the_recorded_decisions(self):
+        simulator, recorded = self.record_job(540)
+        runs = load_recording(self.path)
+
+        started_at = time.perf_counter()
+        replayed = replay_job(runs)
+
+        self.assertLess(time.perf_counter() - started_at, 30)
+        self.assertEqual(len(runs), 540)
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(replayed[-1]["runCount"], 540)
+        self.assertGreater(simulator.requests["submit_order"], 10)
+
+    def test_failed_runs_and_retries_are_replayed(self):
+        simulator, recorded = self.record_job(60, error_rate=0.1)
+        runs = load_recording(self.path)
+
+        errors = [outcome for run in runs for outcomes in run.calls.values() for outcome in outcomes
+                  if outcome[0] == "api_error"]
+        self.assertGreater(len(errors), 1)
+        self.assertEqual([result for result in replay_job(runs) if isinstance(result, dict)], recorded)
+
+    def test_replay_stops_at_a_run_that_differs_from_the_recording(self):
+        self.record_job(60)
+        runs = load_recording(self.path)
+        runs[0].event["jobParameters"]["windowLength"] = 10
+
+        with self.assertRaises(ReplayMismatch) as raised:
+            replay_job(runs)
+        self.assertIn("Run 1", str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import sys
+from io import StringIO
+from unittest.mock import MagicMock
+from alpaca.common.exceptions import APIError
+from requests.exceptions import ConnectionError as RequestsConnectionError, ReadTimeout
+from trade_job.src.concurrency import run_concurrently
+from trade_job.src.retry import (
+    RetryPolicy,
+    RetryScope,
+    retry_scope,
+    call_with_retry,
+    current_scope,
+    is_retryable,
+    is_retryable_before_sent
+)
+from trade_job.test.data.fakes import make_api_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Flaky:
+    def __init__(self, errors, result="ok"):
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.clock = FakeClock()
+        self.policy = RetryPolicy(max_attempts=4, base_delay=0.5, max_delay=3, sleep=self.clock.sleep,
+                                  jitter=lambda: 1.0)
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_classifier(self):
+        self.assertTrue(is_retryable(make_api_error(429)))
+        self.assertTrue(is_retryable(make_api_error(503)))
+        self.assertTrue(is_retryable(RequestsConnectionError()))
+        self.assertTrue(is_retryable(ReadTimeout()))
+        self.assertFalse(is_retryable(make_api_error(401)))
+        self.assertFalse(is_retryable(make_api_error(422)))
+        self.assertFalse(is_retryable(ValueError()))
+        self.assertTrue(is_retryable_before_sent(make_api_error(429)))
+        self.assertFalse(is_retryable_before_sent(make_api_error(503)))
+        self.assertFalse(is_retryable_before_sent(ReadTimeout()))
+
+    def test_backs_off_exponentially_and_records_retries(self):
+        scope = RetryScope(clock=self.clock)
+        call = Flaky([make_api_error(503), make_api_error(429), RequestsConnectionError()])
+
+        result = self.policy.call(scope, "get_orders", call)
+
+        self.assertEqual(result, "ok")
+        self.assertEqual(self.clock.sleeps, [0.5, 1.0, 2.0])
+        self.assertEqual(scope.summary(), {"get_orders": {"calls": 1, "retries": 3}})
+
+    def test_jitter_scales_delay(self):
+        policy = RetryPolicy(base_delay=1, max_delay=3, jitter=lambda: 0.25)
+
+        self.assertEqual([policy.delay(attempt) for attempt in range(4)], [0.25, 0.5, 0.75, 0.75])
+
+    def test_non_retryable_error_is_raised_immediately(self):
+        scope = RetryScope(clock=self.clock)
+        call = Flaky([make_api_error(422)])
+
+        with self.assertRaises(APIError):
+            self.policy.call(scope, "cancel_order_by_id", call)
+
+        self.assertEqual(call.calls, 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_gives_up_after_max_attempts(self):
+        scope = RetryScope(clock=self.clock)
+        call = Flaky([make_api_error(500)] * 5)
+
+        with self.assertRaises(APIError):
+            self.policy.call(scope, "get_stock_bars", call)
+
+        self.assertEqual(call.calls, 4)
+        self.assertEqual(scope.exhausted["get_stock_bars"], 1)
+
+    def test_stops_retrying_before_the_deadline(self):
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 3000
+        # One second of the remaining three is kept back for the rest of the run
+        scope = RetryScope.from_context(context, margin=1, clock=self.clock)
+        call = Flaky([make_api_error(503)] * 5)
+
+        with self.assertRaises(APIError):
+            self.policy.call(scope, "get_orders", call)
+
+        self.assertEqual(self.clock.sleeps, [0.5, 1.0])
+        self.assertLessEqual(self.clock.now, 102.0)
+        self.assertEqual(scope.exhausted["get_orders"], 1)
+
+    def test_scope_is_shared_with_concurrent_calls(self):
+        with retry_scope() as scope:
+            results = run_concurrently({
+                "orders": lambda: current_scope.get(),
+                "position": lambda: call_with_retry("get_open_position", Flaky([])),
+            })
+            self.assertIs(results["orders"], scope)
+
+        self.assertEqual(scope.calls["get_open_position"], 1)
+        self.assertIsNone(current_scope.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
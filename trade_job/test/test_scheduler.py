@@ -0,0 +1,203 @@
+import unittest
+import asyncio
+import sys
+import datetime
+import threading
+from io import StringIO
+from unittest.mock import patch
+from trade_job.src.broker_simulator import BrokerSimulator
+from trade_job.src.scheduler import TradeJobScheduler
+from trade_job.src.state_store import InMemoryStateStore
+from trade_job.src.trade_helper import to_epoch_ns
+from trade_job.src.trade_run import start_trade_run
+# trade_run imports its helpers as src.*, so the clock has to be set through that module
+from src.clock import use_clock
+from trade_job.test.data.fakes import BAR_START, make_bars
+
+SYMBOLS = [f"SYM{i}" for i in range(20)]
+
+
+def make_event(symbol, max_runs):
+    return {
+        "jobParameters": {
+            "windowLength": 5,
+            "symbol": symbol,
+            "maxRuns": max_runs,
+            "offsetTime": 1,
+            "stopLoss": -1000,
+            "takeProfit": 1000
+        }
+    }
+
+
+class FakeClock:
+    # The scheduler's clock and the simulator's market clock. Sleeping yields to the event loop for a moment of real
+    # time and then moves the clock on, without waiting for runs to finish: runs that take longer than that are still
+    # going at the next tick, as a slow broker would leave them.
+
+    def __init__(self, simulator, pause=0.01):
+        self.simulator = simulator
+        self.now = (simulator.market_time + 12_500_000_000) / 1e9
+        self.pause = pause
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(self.pause)
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.now += seconds
+        self.simulator.advance_to(to_epoch_ns(datetime.datetime.fromtimestamp(self.now, datetime.timezone.utc)))
+
+
+class SimulatedRuns:
+    # Runs start_trade_run against the simulator, recording the tick each run was started for. Fails the test if a
+    # job's runs ever overlap.
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.ticks = {}
+        self.running = set()
+        self.overlapping = []
+        self.lock = threading.Lock()
+
+    def __call__(self, event, context):
+        symbol = event["jobParameters"]["symbol"]
+        with self.lock:
+            if symbol in self.running:
+                self.overlapping.append(symbol)
+            self.running.add(symbol)
+            self.ticks.setdefault(symbol, []).append(context.deadline - 60)
+        try:
+            with use_clock(self.simulator.now):
+                return start_trade_run(event, context)
+        finally:
+            with self.lock:
+                self.running.discard(symbol)
+
+
+class TestTradeJobScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.schedulers = []
+        self.patches = []
+
+    def tearDown(self):
+        for scheduler in self.schedulers:
+            scheduler.close()
+        for patcher in reversed(self.patches):
+            patcher.stop()
+        sys.stdout = self.held_stdout
+
+    def make_scheduler(self, latency=0.0):
+        simulator = BrokerSimulator(make_bars(SYMBOLS, minutes=240), start=BAR_START + datetime.timedelta(minutes=45),
+                                    latency=latency)
+        for target, value in (("get_clients", lambda: simulator.clients()),
+                              ("state_store", InMemoryStateStore()),
+                              ("shared_bar_cache", None),
+                              ("trade_state", None)):
+            patcher = patch(f"trade_job.src.trade_run.{target}", value)
+            patcher.start()
+            self.patches.append(patcher)
+        self.clock = FakeClock(simulator)
+        self.runs = SimulatedRuns(simulator)
+        scheduler = TradeJobScheduler(run_job=self.runs, clock=self.clock, sleep=self.clock.sleep)
+        self.schedulers.append(scheduler)
+        return scheduler, simulator
+
+    def test_jobs_run_on_minute_boundaries_until_max_runs(self):
+        scheduler, simulator = self.make_scheduler()
+        job_ids = [scheduler.add_job(make_event(symbol, 3)) for symbol in SYMBOLS]
+
+        asyncio.run(scheduler.run())
+
+        for job_id in job_ids:
+            job = scheduler.jobs[job_id]
+            self.assertTrue(job.finished)
+            self.assertIsNone(job.error)
+            self.assertEqual(job.job_status["runCount"], 3)
+            self.assertEqual(job.job_status["cancelTradeJob"], 1)
+        self.assertEqual(scheduler.stats["runs"], 60)
+        self.assertTrue(all(tick % 60 == 0 for ticks in self.runs.ticks.values() for tick in ticks))
+        self.assertEqual(self.runs.overlapping, [])
+        self.assertGreater(simulator.requests["get_stock_bars"], 0)
+
+    def test_slow_runs_skip_ticks_instead_of_overlapping(self):
+        # Each broker call takes longer than the scheduler waits between ticks
+        scheduler, simulator = self.make_scheduler(latency=0.05)
+        job_ids = [scheduler.add_job(make_event(symbol, 2)) for symbol in SYMBOLS[:4]]
+
+        asyncio.run(scheduler.run())
+
+        self.assertGreater(scheduler.stats["skipped_runs"], 0)
+        self.assertEqual(scheduler.stats["missed_ticks"], 0)
+        self.assertEqual(self.runs.overlapping, [])
+        for job_id in job_ids:
+            job = scheduler.jobs[job_id]
+            self.assertEqual(job.job_status["runCount"], 2)
+            ticks = self.runs.ticks[job.event["jobParameters"]["symbol"]]
+            # The second run starts at a later tick than the one straight after the first
+            self.assertGreater(ticks[1] - ticks[0], 60)
+
+    def test_job_status_is_carried_between_runs(self):
+        scheduler, simulator = self.make_scheduler()
+        job_id = scheduler.add_job(make_event("SYM0", 10))
+
+        asyncio.run(scheduler.run())
+
+        job = scheduler.jobs[job_id]
+        self.assertEqual(job.run_count, 10)
+        self.assertEqual(job.job_status["runCount"], 10)
+        self.assertIn("snapshot", job.job_status)
+        self.assertEqual(job.event["jobInfo"], "2024-08-02T14:15:12.500000Z")
+
+    def test_cancelled_job_stops_running(self):
+        scheduler, simulator = self.make_scheduler()
+        cancelled_job_id = scheduler.add_job(make_event("SYM0", 5))
+        scheduler.add_job(make_event("SYM1", 3))
+
+        async def cancel_after_first_tick():
+            await scheduler.run(max_ticks=1)
+            scheduler.cancel_job(cancelled_job_id)
+            await scheduler.run()
+
+        asyncio.run(cancel_after_first_tick())
+
+        self.assertEqual(len(self.runs.ticks["SYM0"]), 1)
+        self.assertEqual(len(self.runs.ticks["SYM1"]), 3)
+        self.assertTrue(scheduler.jobs[cancelled_job_id].cancelled)
+
+    def test_failed_run_finishes_job(self):
+        scheduler, simulator = self.make_scheduler()
+        job_id = scheduler.add_job(make_event("SYM0", 5))
+        simulator.fail_next("get_stock_bars", ValueError("broker unavailable"))
+
+        asyncio.run(scheduler.run())
+
+        self.assertTrue(scheduler.jobs[job_id].finished)
+        self.assertIn("broker unavailable", str(scheduler.jobs[job_id].error))
+        self.assertEqual(scheduler.stats["failed_runs"], 1)
+
+    def test_late_wake_up_counts_missed_ticks(self):
+        scheduler, simulator = self.make_scheduler()
+        scheduler.add_job(make_event("SYM0", 1))
+
+        async def late_sleep(seconds):
+            scheduler.sleep = self.clock.sleep
+            self.clock.advance(seconds + 125)
+
+        scheduler.sleep = late_sleep
+        asyncio.run(scheduler.run())
+
+        self.assertEqual(scheduler.stats["missed_ticks"], 2)
+        # Woken at 14:18:05 for the 14:16 tick, the run is started for 14:18
+        self.assertEqual(self.runs.ticks["SYM0"][0],
+                         datetime.datetime(2024, 8, 2, 14, 18, tzinfo=datetime.timezone.utc).timestamp())
+
+
+if __name__ == '__main__':
+    unittest.main()
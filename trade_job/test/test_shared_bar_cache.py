@@ -0,0 +1,255 @@
+import unittest
+import sys
+import datetime
+import os
+import tempfile
+import threading
+import time
+from array import array
+from io import StringIO
+from unittest.mock import MagicMock
+import pandas as pd
+from trade_job.src.shared_bar_cache import (
+    InMemoryBarCacheBackend,
+    FileBarCacheBackend,
+    RedisBarCacheBackend,
+    SharedBarCache,
+    create_backend,
+    minute_range_key,
+    encode_bars,
+    decode_bars
+)
+from trade_job.src.trade_helper import fetch_closes, fetch_bars, empty_bars
+from trade_job.src.broker_simulator import BrokerSimulator
+from trade_job.src.concurrency import run_concurrently
+from trade_job.src.constants import BROKER_CALL_TIMEOUT_SECONDS, SHARED_BAR_CACHE_LOCK_SECONDS
+# concurrency times calls through src.retry, so the attempt timer has to be restarted through that module
+from src.retry import call_with_retry
+from trade_job.test.data.fakes import FakeRedis, make_bars
+
+START = datetime.datetime(2024, 8, 2, 13, 30, tzinfo=datetime.timezone.utc)
+
+
+def make_simulator(symbols=("AAPL",), minutes=10):
+    # Serves the bars once they have all closed
+    return BrokerSimulator(make_bars(symbols, START, minutes), start=START + datetime.timedelta(minutes=minutes))
+
+
+class TestBarCacheBackends(unittest.TestCase):
+
+    def test_in_memory_backend_evicts_least_recently_used(self):
+        backend = InMemoryBarCacheBackend(max_entries=2)
+        backend.set("a", 1, 60)
+        backend.set("b", 2, 60)
+        backend.get("a")
+        backend.set("c", 3, 60)
+
+        self.assertEqual(backend.get("a"), 1)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), 3)
+
+    def test_in_memory_backend_expires_entries(self):
+        now = [0.0]
+        backend = InMemoryBarCacheBackend(clock=lambda: now[0])
+        backend.set("a", 1, 60)
+        self.assertFalse(backend.add("a", 2, 60))
+
+        now[0] = 60
+        self.assertIsNone(backend.get("a"))
+        self.assertTrue(backend.add("a", 2, 60))
+        self.assertEqual(backend.get("a"), 2)
+
+    def test_file_backend(self):
+        now = [1000.0]
+        with tempfile.TemporaryDirectory() as directory:
+            backend = FileBarCacheBackend(directory, max_entries=2, clock=lambda: now[0])
+            backend.set("bars/AAPL/1/2", {"closes": [1.5]}, 60)
+            self.assertEqual(backend.get("bars/AAPL/1/2"), {"closes": [1.5]})
+
+            self.assertTrue(backend.add("bars/AAPL/1/2/lock", "token", 10))
+            self.assertFalse(backend.add("bars/AAPL/1/2/lock", "token", 10))
+            # A lock left behind by a process that died is taken over once it expires
+            now[0] += 10
+            self.assertTrue(backend.add("bars/AAPL/1/2/lock", "token", 10))
+            backend.delete("bars/AAPL/1/2/lock")
+
+            now[0] += 60
+            self.assertIsNone(backend.get("bars/AAPL/1/2"))
+
+    def test_file_backend_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = FileBarCacheBackend(directory, max_entries=2)
+            backend.set("a", 1, 60)
+            backend.set("b", 2, 60)
+            os.utime(backend.path("a"), (0, 0))
+            backend.set("c", 3, 60)
+
+            self.assertIsNone(backend.get("a"))
+            self.assertEqual(backend.get("b"), 2)
+            self.assertEqual(backend.get("c"), 3)
+
+    def test_redis_backend(self):
+        now = [0.0]
+        backend = RedisBarCacheBackend(FakeRedis(clock=lambda: now[0]))
+        backend.set("a", {"closes": [1.5]}, 60)
+        self.assertEqual(backend.get("a"), {"closes": [1.5]})
+        self.assertTrue(backend.add("lock", "token", 10))
+        self.assertFalse(backend.add("lock", "token", 10))
+
+        now[0] = 60
+        self.assertIsNone(backend.get("a"))
+        self.assertTrue(backend.add("lock", "token", 10))
+
+    def test_create_backend(self):
+        self.assertIsInstance(create_backend("memory"), InMemoryBarCacheBackend)
+        self.assertIsInstance(create_backend("file"), FileBarCacheBackend)
+        self.assertIsNone(create_backend("off"))
+        with self.assertRaises(ValueError):
+            create_backend("memcached://localhost")
+
+
+class TestSharedBarCache(unittest.TestCase):
+
+    def setUp(self):
+        # Redirect stdout to capture print statements
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.cache = SharedBarCache(InMemoryBarCacheBackend())
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_minute_range_key_rounds_to_whole_minutes(self):
+        self.assertEqual(minute_range_key("closes", "AAPL", START - datetime.timedelta(seconds=30),
+                                          START + datetime.timedelta(minutes=5, seconds=59)),
+                         minute_range_key("closes", "AAPL", START, START + datetime.timedelta(minutes=5)))
+        self.assertEqual(minute_range_key("bars", ["MSFT", "AAPL"], START, START),
+                         minute_range_key("bars", ["AAPL", "MSFT"], START, START))
+        self.assertNotEqual(minute_range_key("bars", "AAPL", START, START),
+                            minute_range_key("bars", "MSFT", START, START))
+
+    def test_concurrent_requests_share_one_fetch(self):
+        release = threading.Event()
+        fetcher = MagicMock(side_effect=lambda: release.wait() and (array("q", [1]), array("d", [2.0])))
+        results = []
+
+        def request():
+            results.append(self.cache.get_closes("AAPL", START, START + datetime.timedelta(minutes=5), fetcher))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while self.cache.stats["coalesced"] < 7:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        fetcher.assert_called_once()
+        self.assertEqual(results, [(array("q", [1]), array("d", [2.0]))] * 8)
+        self.assertEqual(self.cache.stats["misses"], 1)
+
+    def test_failed_fetch_is_not_cached(self):
+        fetcher = MagicMock(side_effect=[ConnectionError("reset"), (array("q", [1]), array("d", [2.0]))])
+
+        with self.assertRaises(ConnectionError):
+            self.cache.get_closes("AAPL", START, START, fetcher)
+        self.assertEqual(self.cache.get_closes("AAPL", START, START, fetcher), (array("q", [1]), array("d", [2.0])))
+        self.assertEqual(self.cache.get_closes("AAPL", START, START, fetcher), (array("q", [1]), array("d", [2.0])))
+
+        self.assertEqual(fetcher.call_count, 2)
+        self.assertEqual(self.cache.stats["hits"], 1)
+
+    def test_waits_for_fetch_in_another_process(self):
+        redis = FakeRedis()
+        other_process = SharedBarCache(RedisBarCacheBackend(redis))
+        key = minute_range_key("closes", "AAPL", START, START)
+        redis.set(f"{key}/lock", "other", px=10000)
+
+        def other_process_finishes(seconds):
+            other_process.backend.set(key, {"timestamps": [1], "closes": [2.0]}, 60)
+
+        cache = SharedBarCache(RedisBarCacheBackend(redis), sleep=other_process_finishes)
+        fetcher = MagicMock()
+
+        self.assertEqual(cache.get_closes("AAPL", START, START, fetcher), (array("q", [1]), array("d", [2.0])))
+        fetcher.assert_not_called()
+        self.assertEqual(cache.stats["coalesced"], 1)
+
+    def test_fetches_directly_when_lock_is_held_too_long(self):
+        now = [0.0]
+        backend = InMemoryBarCacheBackend()
+        backend.set(f"{minute_range_key('closes', 'AAPL', START, START)}/lock", "other", 60)
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        cache = SharedBarCache(backend, lock_ttl=1, poll_interval=0.5, clock=lambda: now[0], sleep=sleep)
+        fetcher = MagicMock(return_value=(array("q", [1]), array("d", [2.0])))
+
+        cache.get_closes("AAPL", START, START, fetcher)
+
+        fetcher.assert_called_once()
+        self.assertEqual(cache.stats["lock_timeouts"], 1)
+        # The other process's lock is left for it to release
+        self.assertIsNotNone(backend.get(f"{minute_range_key('closes', 'AAPL', START, START)}/lock"))
+
+    def test_lock_wait_leaves_time_for_the_fetch_within_the_call_timeout(self):
+        self.assertLessEqual(SHARED_BAR_CACHE_LOCK_SECONDS * 2, BROKER_CALL_TIMEOUT_SECONDS)
+        # The same proportions, scaled down: a 0.2s wait for another process's lock then a 0.2s fetch of its own
+        # finish within a 0.5s timeout on each attempt, as the timeout restarts when the fetch is attempted
+        backend = InMemoryBarCacheBackend()
+        backend.set(f"{minute_range_key('closes', 'AAPL', START, START)}/lock", "other", 60)
+        cache = SharedBarCache(backend, lock_ttl=0.2, poll_interval=0.02)
+
+        def fetch():
+            time.sleep(0.2)
+            return array("q", [1]), array("d", [2.0])
+
+        results = run_concurrently({"bars": lambda: cache.get_closes(
+            "AAPL", START, START, lambda: call_with_retry("get_stock_bars", fetch))}, default_timeout=0.3)
+
+        self.assertEqual(results["bars"], (array("q", [1]), array("d", [2.0])))
+        self.assertEqual(cache.stats["lock_timeouts"], 1)
+
+    def test_stops_waiting_for_a_slow_fetch_in_the_same_process(self):
+        cache = SharedBarCache(InMemoryBarCacheBackend(), lock_ttl=0.05)
+        release = threading.Event()
+        leader = threading.Thread(target=cache.get_closes,
+                                  args=("AAPL", START, START, lambda: release.wait() and (array("q"), array("d"))))
+        leader.start()
+        while not cache.flights:
+            threading.Event().wait(0.001)
+
+        result = cache.get_closes("AAPL", START, START, lambda: (array("q", [1]), array("d", [2.0])))
+        release.set()
+        leader.join()
+
+        self.assertEqual(result, (array("q", [1]), array("d", [2.0])))
+        self.assertEqual(cache.stats["lock_timeouts"], 1)
+
+    def test_bars_round_trip(self):
+        client = make_simulator(("AAPL", "MSFT"))
+        bars = fetch_bars(client, ["AAPL", "MSFT"], START, START + datetime.timedelta(minutes=9))
+
+        # Alpaca and pandas build their UTC timezones differently, so only the values are compared
+        pd.testing.assert_frame_equal(decode_bars(encode_bars(bars)), bars, check_index_type=False)
+        pd.testing.assert_frame_equal(decode_bars(encode_bars(empty_bars())), empty_bars())
+
+    def test_fetch_with_shared_cache(self):
+        client = make_simulator()
+        end = START + datetime.timedelta(minutes=9)
+
+        first = fetch_closes(client, "AAPL", START, end, self.cache)
+        second = fetch_closes(client, "AAPL", START, end + datetime.timedelta(seconds=20), self.cache)
+        bars = fetch_bars(client, "AAPL", START, end, self.cache)
+        fetch_bars(client, "AAPL", START, end, self.cache)
+
+        self.assertEqual(client.requests["get_stock_bars"], 2)
+        self.assertEqual(first, second)
+        self.assertEqual(list(first[1]), client.bars["AAPL"]["c"].tolist())
+        self.assertEqual(bars["close"].tolist(), list(first[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import os
+from unittest.mock import patch
+from trade_job.src.startup_profiler import parse_import_times, totals_by_package, profile_imports
+
+IMPORT_TIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     numpy.version
+import time:      3500 |       3620 |   numpy
+import time:       400 |        400 |     pandas.core
+import time:       700 |       4720 |   pandas
+import time:        50 |       4770 | src.trade_helper
+"""
+
+
+class TestStartupProfiler(unittest.TestCase):
+
+    def test_parse_import_times(self):
+        imports = parse_import_times(IMPORT_TIME_OUTPUT)
+
+        self.assertEqual([entry["module"] for entry in imports],
+                         ["numpy.version", "numpy", "pandas.core", "pandas", "src.trade_helper"])
+        self.assertEqual([entry["depth"] for entry in imports], [2, 1, 2, 1, 0])
+        self.assertEqual(imports[3]["self_us"], 700)
+        self.assertEqual(imports[3]["cumulative_us"], 4720)
+
+    def test_totals_by_package(self):
+        totals = totals_by_package(parse_import_times(IMPORT_TIME_OUTPUT))
+
+        self.assertEqual(totals, {"numpy": 3620, "pandas": 1100, "src": 50})
+
+    def test_profile_imports_runs_in_a_fresh_interpreter(self):
+        profile = profile_imports("colorsys")
+
+        self.assertIn("colorsys", [entry["module"] for entry in profile["imports"]])
+        self.assertGreater(profile["peak_memory_kb"], 0)
+        self.assertEqual(profile["total_us"], sum(entry["self_us"] for entry in profile["imports"]))
+
+    def test_trade_run_does_not_import_the_numpy_stores(self):
+        # The bar and order stores are imported by the code that uses them, not when a run's module loads
+        trade_job_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with patch.dict(os.environ, {"PYTHONPATH": trade_job_directory}):
+            profile = profile_imports("src.trade_run")
+
+        modules = [entry["module"] for entry in profile["imports"]]
+        self.assertIn("src.trade_helper", modules)
+        self.assertNotIn("src.bar_store", modules)
+        self.assertNotIn("src.order_store", modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
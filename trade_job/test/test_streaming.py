@@ -0,0 +1,124 @@
+import unittest
+import asyncio
+import sys
+from io import StringIO
+from unittest.mock import create_autospec, MagicMock
+import pandas as pd
+from alpaca.data.models import Bar
+from alpaca.trading.client import TradingClient
+from alpaca.common.exceptions import APIError
+from trade_job.src.streaming import StreamingTrader
+from trade_job.src.trade_helper import calculate_rolling_average
+from trade_job.test.data.fakes import FakeBarStream
+
+JOB_PARAMETERS = {
+    "windowLength": 3,
+    "symbol": "AAPL",
+    "maxRuns": 540,
+    "offsetTime": 0,
+    "stopLoss": -1000,
+    "takeProfit": 1000
+}
+
+
+def make_bar(symbol, minute, close):
+    return Bar(symbol, {"t": f"2024-02-09T18:{minute:02d}:00Z", "o": close, "h": close, "l": close, "c": close,
+                        "v": 100, "n": 1, "vw": close})
+
+
+class TestStreamingTrader(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.trading_client = create_autospec(TradingClient)
+        self.trading_client.get_orders.return_value = []
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def replay(self, trader, stream):
+        async def replay_and_drain():
+            await stream.replay()
+            await trader.drain()
+
+        trader.subscribe()
+        asyncio.run(replay_and_drain())
+        trader.executor.shutdown(wait=True)
+
+    def test_rolling_window_matches_pandas_mean(self):
+        closes = [10, 11, 13, 12, 9, 15, 16]
+        trader = StreamingTrader(FakeBarStream([]), self.trading_client)
+        job = trader.add_job(JOB_PARAMETERS, "2024-02-09T18:00:00.000000Z")
+
+        for minute, close in enumerate(closes):
+            mean_price = job.add_bar(make_bar("AAPL", minute, close))
+            window = pd.Series(closes[max(0, minute - 2):minute + 1], dtype=float)
+            self.assertAlmostEqual(mean_price,
+                                   calculate_rolling_average(window, len(window)).iloc[-1])
+
+    def test_missing_bars_are_evicted_by_time(self):
+        trader = StreamingTrader(FakeBarStream([]), self.trading_client)
+        job = trader.add_job(JOB_PARAMETERS, "2024-02-09T18:00:00.000000Z")
+
+        job.add_bar(make_bar("AAPL", 0, 10))
+        job.add_bar(make_bar("AAPL", 1, 20))
+        job.add_bar(make_bar("AAPL", 5, 30))
+
+        self.assertEqual([close for _, close, _ in job.close_average.buffer.entries()], [30])
+        self.assertEqual(job.close_average.value, 30)
+
+    def test_bars_trigger_orders_as_they_arrive(self):
+        stream = FakeBarStream([make_bar("AAPL", 0, 10), make_bar("AAPL", 1, 11), make_bar("MSFT", 1, 400),
+                                make_bar("AAPL", 2, 9)])
+        trader = StreamingTrader(stream, self.trading_client)
+        trader.add_job(JOB_PARAMETERS, "2024-02-09T18:00:00.000000Z")
+        position = MagicMock()
+        position.unrealized_pl = "-1"
+        self.trading_client.get_open_position.return_value = position
+
+        self.replay(trader, stream)
+
+        self.trading_client.submit_order.assert_called_once()
+        self.assertEqual(self.trading_client.submit_order.call_args.kwargs["order_data"].symbol, "AAPL")
+        self.trading_client.close_position.assert_called_once()
+        self.assertEqual(len(trader.decision_latencies), 3)
+        self.assertLess(max(trader.decision_latencies), 0.05)
+
+    def test_only_the_latest_decision_latencies_are_kept(self):
+        stream = FakeBarStream([make_bar("AAPL", minute, 10) for minute in range(5)])
+        trader = StreamingTrader(stream, self.trading_client, latency_samples=2)
+        trader.add_job(JOB_PARAMETERS, "2024-02-09T18:00:00.000000Z")
+
+        self.replay(trader, stream)
+
+        self.assertEqual(len(trader.decision_latencies), 2)
+
+    def test_sell_without_position_does_nothing(self):
+        stream = FakeBarStream([make_bar("AAPL", 0, 10), make_bar("AAPL", 1, 9)])
+        trader = StreamingTrader(stream, self.trading_client)
+        trader.add_job(JOB_PARAMETERS, "2024-02-09T18:00:00.000000Z")
+        self.trading_client.get_open_position.side_effect = APIError("position does not exist")
+
+        self.replay(trader, stream)
+
+        self.trading_client.submit_order.assert_not_called()
+        self.trading_client.close_position.assert_not_called()
+
+    def test_profit_loss_limit_stops_job(self):
+        stream = FakeBarStream([make_bar("AAPL", 0, 10), make_bar("AAPL", 1, 11), make_bar("AAPL", 2, 12)])
+        trader = StreamingTrader(stream, self.trading_client)
+        job = trader.add_job({**JOB_PARAMETERS, "takeProfit": 5}, "2024-02-09T18:00:00.000000Z")
+        position = MagicMock()
+        position.unrealized_pl = "6"
+        self.trading_client.get_open_position.return_value = position
+
+        self.replay(trader, stream)
+
+        self.assertTrue(job.finished)
+        self.trading_client.submit_order.assert_not_called()
+        self.trading_client.close_position.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import sys
+from io import StringIO
+from trade_job.src.sweep import build_parameter_grid, sample_parameters, run_sweep
+from trade_job.src.backtest import run_backtest
+from trade_job.test.test_backtest import make_bars
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.parameter_space = {
+            "windowLength": [3, 5, 10],
+            "offsetTime": [1, 16],
+            "takeProfit": [5, None],
+            "stopLoss": [-5],
+            "maxRuns": [540]
+        }
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def test_build_parameter_grid(self):
+        grid = build_parameter_grid(self.parameter_space)
+
+        self.assertEqual(len(grid), 12)
+        self.assertIn({"windowLength": 5, "offsetTime": 16, "takeProfit": None, "stopLoss": -5, "maxRuns": 540},
+                      grid)
+
+    def test_sample_parameters_is_reproducible(self):
+        sample = sample_parameters(self.parameter_space, 20, seed=7)
+
+        self.assertEqual(sample, sample_parameters(self.parameter_space, 20, seed=7))
+        for parameters in sample:
+            self.assertIn(parameters["windowLength"], [3, 5, 10])
+
+    def test_run_sweep_ranks_results_matching_backtest(self):
+        bars = make_bars(800)
+        grid = build_parameter_grid(self.parameter_space)
+
+        results = run_sweep(bars, grid, max_workers=2)
+
+        self.assertEqual(len(results), len(grid))
+        self.assertTrue(results["final_pl"].is_monotonic_decreasing)
+        for parameters in results.to_dict("records"):
+            _, summary = run_backtest(bars,
+                                      parameters["windowLength"],
+                                      parameters["offsetTime"],
+                                      parameters["takeProfit"],
+                                      parameters["stopLoss"],
+                                      parameters["maxRuns"])
+            self.assertAlmostEqual(parameters["final_pl"], summary["final_pl"])
+            self.assertEqual(parameters["runs"], summary["runs"])
+
+
+if __name__ == '__main__':
+    unittest.main()
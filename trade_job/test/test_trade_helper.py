@@ -1,27 +1,40 @@
 import unittest
-from unittest.mock import create_autospec, patch, MagicMock
+from unittest.mock import create_autospec, patch, MagicMock, ANY
 from alpaca.data.historical import StockHistoricalDataClient
 from alpaca.trading.client import TradingClient
 from alpaca.common.exceptions import APIError
 from alpaca.trading.models import Order
+import uuid
+from alpaca.data.models import BarSet
 import pandas as pd
 import numpy as np
 import sys
 import datetime
 from io import StringIO
 from trade_job.test.data.test_variables import (
-    test_order_json
+    test_order_json,
+    multi_symbol_stock_data_df
 )
+from trade_job.src.indicators import SMA
+from trade_job.src.broker_simulator import BrokerSimulator
+from trade_job.test.data.fakes import make_api_error, make_price_bars
 from trade_job.src.trade_helper import (
     get_stock_data,
+    fetch_bars,
     calculate_rolling_average,
+    get_close_average,
+    calculate_batch_signals,
     get_open_positions,
+    get_all_open_positions,
     get_orders,
     calculate_realized_pl,
+    filter_for_order_status,
+    filter_for_order_side,
     profit_loss_reached,
     buying_condition,
     selling_condition,
     buy_stock,
+    cancel_orders,
     close_positions_by_percentage
 )
 
@@ -45,16 +58,18 @@ class TestTradeHelper(unittest.TestCase):
 
     @patch("trade_job.src.trade_helper.TimeFrame.Minute")
     @patch("trade_job.src.trade_helper.StockBarsRequest")
+    @patch("trade_job.src.trade_helper.now")
     @patch("trade_job.src.trade_helper.datetime")
     def test_get_stock_data(self,
                             mock_datetime,
+                            mock_now,
                             mock_stock_bars_request,
                             mock_timeframe):
         symbol = 'AAPL'
         offset = 30
         window_size = 5
 
-        mock_datetime.datetime.now.return_value = 2
+        mock_now.return_value = 2
         mock_datetime.timedelta.return_value = 1
         mock_client = create_autospec(StockHistoricalDataClient)
         mock_stock_bars_request.return_value = 1
@@ -71,6 +86,38 @@ class TestTradeHelper(unittest.TestCase):
                                                         end=1)
         mock_client.get_stock_bars.assert_called_once_with(1)
 
+    @patch("trade_job.src.trade_helper.StockBarsRequest")
+    @patch("trade_job.src.trade_helper.now")
+    @patch("trade_job.src.trade_helper.datetime")
+    def test_get_stock_data_with_bar_store(self,
+                                           mock_datetime,
+                                           mock_now,
+                                           mock_stock_bars_request):
+        mock_now.return_value = 2
+        mock_datetime.timedelta.return_value = 1
+        mock_client = create_autospec(StockHistoricalDataClient)
+        mock_client.get_stock_bars.return_value.df = 3
+        mock_bar_store = MagicMock()
+        mock_bar_store.get_bars.side_effect = lambda symbols, start, end, fetcher: fetcher(symbols, start, end)
+
+        result = get_stock_data(mock_client, ['AAPL', 'MSFT'], 5, 30, bar_store=mock_bar_store)
+
+        self.assertEqual(result, 3)
+        mock_bar_store.get_bars.assert_called_once_with(['AAPL', 'MSFT'], 0, 1, ANY)
+        mock_stock_bars_request.assert_called_once_with(symbol_or_symbols=['AAPL', 'MSFT'],
+                                                        timeframe=ANY,
+                                                        start=0,
+                                                        end=1)
+
+    def test_fetch_bars_empty_response(self):
+        mock_client = create_autospec(StockHistoricalDataClient)
+        mock_client.get_stock_bars.return_value = BarSet({})
+
+        result = fetch_bars(mock_client, 'AAPL', datetime.datetime(2024, 2, 9), datetime.datetime(2024, 2, 10))
+
+        self.assertTrue(result.empty)
+        self.assertEqual(list(result.index.names), ["symbol", "timestamp"])
+
     def test_calculate_rolling_average(self):
         bars = pd.Series({
             "2024-02-09 23:58:00+00:00": "100",
@@ -89,6 +136,71 @@ class TestTradeHelper(unittest.TestCase):
         result = calculate_rolling_average(bars, n)
         pd.testing.assert_series_equal(result, expected)
 
+    @patch("trade_job.src.trade_helper.get_window_bounds")
+    def test_get_close_average_only_fetches_new_bars(self, mock_get_window_bounds):
+        base = datetime.datetime(2024, 2, 9, 18, 0)
+        closes = [100 + i + (i % 3) * 0.5 for i in range(30)]
+        bars = make_price_bars([close if i != 8 else None for i, close in enumerate(closes)], start=base)
+        client = BrokerSimulator(bars, start=base + datetime.timedelta(minutes=30))
+        client.get_stock_bars = MagicMock(side_effect=client.get_stock_bars)
+        close_average = SMA(6, min_periods=1)
+
+        # Consecutive runs with a 5 minute window, including a bar that never arrived
+        for end in [5, 6, 7, 9, 15, 16]:
+            window_start = base + datetime.timedelta(minutes=end - 5)
+            window_end = base + datetime.timedelta(minutes=end)
+            mock_get_window_bounds.return_value = (window_start, window_end)
+            window = pd.Series([close for i, close in enumerate(closes) if end - 5 <= i <= end and i != 8])
+
+            mean_price, last_price = get_close_average(client, "AAPL", 5, 0, close_average)
+
+            self.assertAlmostEqual(mean_price, calculate_rolling_average(window, len(window)).iloc[-1])
+            self.assertEqual(last_price, window.iloc[-1])
+            self.assertEqual(close_average.count, len(window))
+
+        requests = [call.args[0] for call in client.get_stock_bars.call_args_list]
+        self.assertEqual(requests[0].start, base)
+        self.assertEqual(requests[1].start, base + datetime.timedelta(minutes=5))
+
+    @patch("trade_job.src.trade_helper.get_window_bounds")
+    def test_get_close_average_with_no_bars(self, mock_get_window_bounds):
+        mock_get_window_bounds.return_value = (datetime.datetime(2024, 2, 9, 18, 0),
+                                               datetime.datetime(2024, 2, 9, 18, 5))
+
+        # The simulator's only bars are after the window
+        client = BrokerSimulator(make_price_bars([100], start=datetime.datetime(2024, 2, 9, 19, 0)))
+
+        mean_price, last_price = get_close_average(client, "AAPL", 5, 0, SMA(6, min_periods=1))
+
+        self.assertTrue(np.isnan(mean_price))
+        self.assertIsNone(last_price)
+
+    def test_calculate_batch_signals_matches_single_symbol_evaluation(self):
+        signals = calculate_batch_signals(multi_symbol_stock_data_df)
+
+        self.assertEqual(list(signals.index), ["AAPL", "MSFT", "TSLA"])
+        for symbol, symbol_bars in multi_symbol_stock_data_df.groupby(level="symbol"):
+            closes = symbol_bars["close"]
+            mean_price = calculate_rolling_average(closes, len(closes)).iloc[-1]
+            last_price = closes.iloc[-1]
+            self.assertAlmostEqual(signals.loc[symbol, "mean_price"], mean_price)
+            self.assertEqual(signals.loc[symbol, "last_price"], last_price)
+            self.assertEqual(signals.loc[symbol, "buy"], buying_condition(mean_price, last_price))
+            self.assertEqual(signals.loc[symbol, "sell"], selling_condition(mean_price, last_price))
+        self.assertEqual(list(signals["buy"]), [True, False, False])
+        self.assertEqual(list(signals["sell"]), [False, True, False])
+
+    def test_get_all_open_positions(self):
+        mock_client = create_autospec(TradingClient)
+        aapl_position = MagicMock(symbol="AAPL")
+        nvda_position = MagicMock(symbol="NVDA")
+        mock_client.get_all_positions.return_value = [aapl_position, nvda_position]
+
+        positions = get_all_open_positions(mock_client, ["AAPL", "MSFT"])
+
+        self.assertEqual(positions, {"AAPL": aapl_position})
+        mock_client.get_all_positions.assert_called_once()
+
     def test_get_open_positions_returns_true(self):
         mock_client = create_autospec(TradingClient)
         symbol = 'AAPL'
@@ -119,8 +231,11 @@ class TestTradeHelper(unittest.TestCase):
         orders = get_orders(mock_client, symbol, status, time)
 
         mock_get_orders_request.assert_called_once_with(status="open",
-                                                        symbol=symbol,
-                                                        after=datetime.datetime.strptime(time, "%Y-%m-%dT%H:%M:%S.%fZ"))
+                                                        symbols=[symbol],
+                                                        after=datetime.datetime.strptime(time, "%Y-%m-%dT%H:%M:%S.%fZ"),
+                                                        until=None,
+                                                        limit=None,
+                                                        direction=None)
         mock_client.get_orders.assert_called_once()
         self.assertEqual(orders, [{
                                       "orderid": 1
@@ -130,6 +245,28 @@ class TestTradeHelper(unittest.TestCase):
         realized_pl = calculate_realized_pl(self.test_order_objects)
         self.assertEqual(realized_pl, 1)
 
+    def test_filter_for_order_side_selects_by_side(self):
+        sell_orders = filter_for_order_side(self.test_order_objects, "sell")
+
+        self.assertEqual(list(sell_orders.ids), [str(order.id) for order in self.test_order_objects[:2]])
+        # Without the buy they closed, the sells have no known cost
+        self.assertEqual(calculate_realized_pl(sell_orders), 0)
+
+    def test_filtered_orders_can_be_cancelled(self):
+        trading_client = create_autospec(TradingClient)
+
+        summary = cancel_orders(filter_for_order_side(self.test_order_objects, "sell"), trading_client)
+
+        self.assertEqual(summary["cancelled"], [str(order.id) for order in self.test_order_objects[:2]])
+        self.assertEqual(trading_client.cancel_order_by_id.call_count, 2)
+
+    def test_filter_for_order_status_selects_by_status(self):
+        self.test_order_objects[0].status = "canceled"
+
+        filled_orders = filter_for_order_status(self.test_order_objects, "filled")
+
+        self.assertEqual(list(filled_orders.ids), [str(order.id) for order in self.test_order_objects[1:]])
+
     def test_profit_loss_reached_profit_reached(self):
         self.assertTrue(profit_loss_reached(100, -50, 150))
         output = self.stdout.getvalue().strip()
@@ -206,7 +343,8 @@ class TestTradeHelper(unittest.TestCase):
             symbol=symb,
             qty=1,
             side=mock_buy.BUY,
-            time_in_force=mock_day.DAY)
+            time_in_force=mock_day.DAY,
+            client_order_id=None)
 
         mock_client.submit_order.assert_called_once_with(order_data=1)
 
@@ -228,6 +366,95 @@ class TestTradeHelper(unittest.TestCase):
                                                               close_options=mock_close_position_request(
                                                                   percentage=percentage))
 
+    def test_buy_stock_with_client_order_id_is_retried(self):
+        trading_client = create_autospec(TradingClient)
+        trading_client.submit_order.side_effect = [make_api_error(500), self.test_order_objects[0]]
+
+        # trade_helper imports its retry helper as src.retry
+        with patch("src.retry.default_policy.sleep") as sleep:
+            order = buy_stock(trading_client, "AAPL", "bee9f504-6549-438b-be0f-57e114373453")
+
+        self.assertEqual(order, self.test_order_objects[0])
+        self.assertEqual(trading_client.submit_order.call_count, 2)
+        sleep.assert_called_once()
+        order_data = trading_client.submit_order.call_args.kwargs["order_data"]
+        self.assertEqual(order_data.client_order_id, "bee9f504-6549-438b-be0f-57e114373453")
+
+    def test_buy_stock_returns_order_already_submitted(self):
+        trading_client = create_autospec(TradingClient)
+        http_error = MagicMock()
+        http_error.response.status_code = 422
+        trading_client.submit_order.side_effect = APIError(
+            '{"code": 40010001, "message": "client_order_id must be unique"}', http_error)
+        trading_client.get_order_by_client_id.return_value = self.test_order_objects[0]
+
+        order = buy_stock(trading_client, "AAPL", "bee9f504-6549-438b-be0f-57e114373453")
+
+        self.assertEqual(order, self.test_order_objects[0])
+        trading_client.get_order_by_client_id.assert_called_once_with("bee9f504-6549-438b-be0f-57e114373453")
+
+    def test_close_known_position_with_client_order_id(self):
+        trading_client = create_autospec(TradingClient)
+        position = MagicMock()
+        position.qty = "4"
+        position.side = "long"
+
+        close_positions_by_percentage(trading_client, "AAPL", "50", position, "bee9f504-6549-438b-be0f-57e114373453")
+
+        trading_client.close_position.assert_not_called()
+        order_data = trading_client.submit_order.call_args.kwargs["order_data"]
+        self.assertEqual((order_data.symbol, order_data.qty, order_data.side), ("AAPL", 2.0, "sell"))
+        self.assertEqual(order_data.client_order_id, "bee9f504-6549-438b-be0f-57e114373453")
+
+    def test_cancel_orders_cancels_each_order_once(self):
+        trading_client = create_autospec(TradingClient)
+        ledger_orders = [{"id": str(uuid.uuid4()), "side": "buy"} for _ in range(3)]
+
+        summary = cancel_orders(ledger_orders + self.test_order_objects, trading_client)
+
+        expected_ids = [order["id"] for order in ledger_orders] + [str(order.id) for order in self.test_order_objects]
+        self.assertEqual(summary, {"cancelled": expected_ids, "failed": {}})
+        self.assertEqual(trading_client.cancel_order_by_id.call_count, len(expected_ids))
+        trading_client.get_orders.assert_not_called()
+
+    def test_cancel_orders_retries_each_order_separately(self):
+        trading_client = create_autospec(TradingClient)
+        orders = [{"id": str(uuid.uuid4())} for _ in range(3)]
+        responses = {orders[0]["id"]: [ConnectionError("reset"), None],
+                     orders[1]["id"]: [make_api_error(422)],
+                     orders[2]["id"]: [None]}
+
+        def cancel_order_by_id(order_id):
+            response = responses[order_id].pop(0)
+            if response is not None:
+                raise response
+
+        trading_client.cancel_order_by_id.side_effect = cancel_order_by_id
+
+        summary = cancel_orders(orders, trading_client)
+
+        self.assertEqual(summary["cancelled"], [orders[0]["id"], orders[2]["id"]])
+        self.assertEqual(list(summary["failed"]), [orders[1]["id"]])
+        self.assertEqual(trading_client.cancel_order_by_id.call_count, 4)
+
+    def test_cancel_orders_raises_auth_errors(self):
+        trading_client = create_autospec(TradingClient)
+        trading_client.cancel_order_by_id.side_effect = make_api_error(401)
+
+        with self.assertRaises(APIError):
+            cancel_orders([{"id": str(uuid.uuid4())}], trading_client)
+
+    def test_cancel_orders_never_cancels_every_order_on_the_account(self):
+        trading_client = create_autospec(TradingClient)
+        orders = [MagicMock(id=uuid.uuid4()) for _ in range(200)]
+
+        summary = cancel_orders(orders, trading_client)
+
+        self.assertEqual(len(summary["cancelled"]), 200)
+        trading_client.cancel_orders.assert_not_called()
+        trading_client.get_orders.assert_not_called()
+        self.assertEqual(trading_client.cancel_order_by_id.call_count, 200)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,19 +1,19 @@
 import unittest
-from unittest.mock import MagicMock, patch
-from trade_job.src.trade_run import start_trade_run
+from unittest.mock import MagicMock, patch, ANY
+from alpaca.common.exceptions import APIError
+from trade_job.src.trade_run import start_trade_run, start_batch_trade_run, start_multiplexed_trade_run
+from trade_job.src.state_store import InMemoryStateStore
 from trade_job.test.data import payload
 from trade_job.test.data.test_variables import (
     stock_data_df,
-    rolling_average_values
+    rolling_average_values,
+    multi_symbol_stock_data_df
 )
-import pandas.testing as pd_testing
 
 
-@patch("trade_job.src.trade_run.get_secret")
-@patch("trade_job.src.trade_run.StockHistoricalDataClient")
-@patch("trade_job.src.trade_run.TradingClient")
-@patch("trade_job.src.trade_run.get_stock_data")
-@patch("trade_job.src.trade_run.calculate_rolling_average")
+@patch("trade_job.src.trade_run.get_clients")
+@patch("trade_job.src.trade_run.OrderLedger")
+@patch("trade_job.src.trade_run.get_close_average")
 @patch("trade_job.src.trade_run.get_open_positions")
 @patch("trade_job.src.trade_run.profit_loss_reached")
 @patch("trade_job.src.trade_run.buying_condition")
@@ -21,6 +21,14 @@ import pandas.testing as pd_testing
 @patch("trade_job.src.trade_run.buy_stock")
 @patch("trade_job.src.trade_run.increment_run_count")
 class TestTradeRun(unittest.TestCase):
+    def setUp(self):
+        state_store_patcher = patch("trade_job.src.trade_run.state_store", InMemoryStateStore())
+        state_store_patcher.start()
+        self.addCleanup(state_store_patcher.stop)
+        snapshot_patcher = patch("trade_job.src.trade_run.snapshot_or_none", return_value="snapshot")
+        snapshot_patcher.start()
+        self.addCleanup(snapshot_patcher.stop)
+
     def test_start_trade_run_with_buying_condition(self,
                                                    mock_increment_run_count,
                                                    mock_buy_stock,
@@ -28,26 +36,23 @@ class TestTradeRun(unittest.TestCase):
                                                    mock_buying_condition,
                                                    mock_profit_loss_reached,
                                                    mock_get_open_positions,
-                                                   mock_calculate_rolling_average,
-                                                   mock_get_stock_data,
-                                                   mock_trading_client,
-                                                   mock_stock_client,
-                                                   mock_get_secret):
+                                                   mock_get_close_average,
+                                                   mock_order_ledger,
+                                                   mock_get_clients):
         # Mocking return values and behaviors
         context = MagicMock()
 
-        secret = {"alpaca_api_key": "fake_api_key", "alpaca_secret_key": "fake_secret_key"}
-        mock_get_secret.return_value = secret
-
-        alpaca_api_key = secret['alpaca_api_key']
-        alpaca_secret_key = secret['alpaca_secret_key']
+        mock_stock_client = MagicMock()
+        mock_trading_client = MagicMock()
+        mock_get_clients.return_value = (mock_stock_client, mock_trading_client)
+        order_ledger = mock_order_ledger.load.return_value.update.return_value
+        order_ledger.realized_pl = 0
+        order_ledger.get_open_orders.return_value = []
 
         last_average = rolling_average_values.iloc[-1]
         last_price = stock_data_df['close'].iloc[-1]
 
-        mock_get_stock_data.return_value = stock_data_df
-
-        mock_calculate_rolling_average.return_value = rolling_average_values
+        mock_get_close_average.return_value = (last_average, last_price)
 
         position = MagicMock()
         position.unrealized_pl = 1
@@ -64,25 +69,18 @@ class TestTradeRun(unittest.TestCase):
         # Run the function
         trade_run_result = start_trade_run(payload.event, context)
 
-        # Test get secret
-        mock_get_secret.assert_called_once()
-
-        # Test setup stock clients
-        mock_stock_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
-        mock_trading_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
+        # Test cached clients retrieved
+        mock_get_clients.assert_called_once()
 
         # Test check open positions for PnL
-        mock_get_open_positions.assert_called_once_with(mock_trading_client.return_value, 'AAPL')
+        mock_get_open_positions.assert_called_once_with(mock_trading_client, 'AAPL')
         mock_profit_loss_reached.assert_called_once_with(10, -10, 1)
 
         # Test evaluate buy/sell conditions
-        mock_get_stock_data.assert_called_once_with(mock_stock_client.return_value, 'AAPL', 5, 16)
-        pd_testing.assert_series_equal(mock_calculate_rolling_average.call_args[0][0], stock_data_df['close']) # checking calculate_rolling_average called with close prices in stock data df
-        self.assertEqual(mock_calculate_rolling_average.call_args[0][1], len(stock_data_df))
-        mock_calculate_rolling_average.assert_called_once_with(stock_data_df['close'], len(stock_data_df))
+        mock_get_close_average.assert_called_once_with(mock_stock_client, 'AAPL', 5, 16, ANY, shared_cache=ANY)
 
         mock_buying_condition.assert_called_once_with(last_average, last_price)
-        mock_buy_stock.assert_called_once_with(mock_trading_client.return_value, 'AAPL')
+        mock_buy_stock.assert_called_once_with(mock_trading_client, 'AAPL', ANY)
         mock_selling_condition.assert_not_called()
 
         # Test check/update run count
@@ -92,7 +90,8 @@ class TestTradeRun(unittest.TestCase):
         # Test trade run result correct
         self.assertEqual(trade_run_result, {
             "cancelTradeJob": 0,
-            "runCount": 1
+            "runCount": 1,
+            "snapshot": "snapshot"
             })
 
 
@@ -103,29 +102,23 @@ class TestTradeRun(unittest.TestCase):
                                                               mock_buying_condition,
                                                               mock_profit_loss_reached,
                                                               mock_get_open_positions,
-                                                              mock_calculate_rolling_average,
-                                                              mock_get_stock_data,
-                                                              mock_trading_client,
-                                                              mock_stock_client,
-                                                              mock_get_secret):
+                                                              mock_get_close_average,
+                                                              mock_order_ledger,
+                                                              mock_get_clients):
         # Mocking return values and behaviors
         context = MagicMock()
 
-        secret = {
-            "alpaca_api_key": "fake_api_key",
-            "alpaca_secret_key": "fake_secret_key"
-            }
-        mock_get_secret.return_value = secret
-
-        alpaca_api_key = secret['alpaca_api_key']
-        alpaca_secret_key = secret['alpaca_secret_key']
+        mock_stock_client = MagicMock()
+        mock_trading_client = MagicMock()
+        mock_get_clients.return_value = (mock_stock_client, mock_trading_client)
+        order_ledger = mock_order_ledger.load.return_value.update.return_value
+        order_ledger.realized_pl = 0
+        order_ledger.get_open_orders.return_value = []
 
         last_average = rolling_average_values.iloc[-1]
         last_price = stock_data_df['close'].iloc[-1]
 
-        mock_get_stock_data.return_value = stock_data_df
-
-        mock_calculate_rolling_average.return_value = rolling_average_values
+        mock_get_close_average.return_value = (last_average, last_price)
 
         position = MagicMock()
         position.unrealized_pl = 1
@@ -142,23 +135,15 @@ class TestTradeRun(unittest.TestCase):
         # Run the function
         trade_run_result = start_trade_run(payload.event, context)
 
-        # Test get secret
-        mock_get_secret.assert_called_once()
-
-        # Test setup stock clients
-        mock_stock_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
-        mock_trading_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
+        # Test cached clients retrieved
+        mock_get_clients.assert_called_once()
 
         # Test check open positions for PnL
-        mock_get_open_positions.assert_called_once_with(mock_trading_client.return_value, 'AAPL')
+        mock_get_open_positions.assert_called_once_with(mock_trading_client, 'AAPL')
         mock_profit_loss_reached.assert_called_once_with(10, -10, 1)
 
         # Test evaluate buy/sell conditions
-        mock_get_stock_data.assert_called_once_with(mock_stock_client.return_value, 'AAPL', 5, 16)
-        pd_testing.assert_series_equal(mock_calculate_rolling_average.call_args[0][0], stock_data_df[
-            'close'])  # checking calculate_rolling_average called with close prices in stock data df
-        self.assertEqual(mock_calculate_rolling_average.call_args[0][1], len(stock_data_df))
-        mock_calculate_rolling_average.assert_called_once_with(stock_data_df['close'], len(stock_data_df))
+        mock_get_close_average.assert_called_once_with(mock_stock_client, 'AAPL', 5, 16, ANY, shared_cache=ANY)
 
         mock_buying_condition.assert_called_once_with(last_average, last_price)
         mock_buy_stock.assert_not_called()
@@ -171,7 +156,8 @@ class TestTradeRun(unittest.TestCase):
         # Test trade run result correct
         self.assertEqual(trade_run_result, {
             "cancelTradeJob": 0,
-            "runCount": 1
+            "runCount": 1,
+            "snapshot": "snapshot"
         })
 
     def test_start_trade_run_with_selling_price_no_position(self,
@@ -181,30 +167,24 @@ class TestTradeRun(unittest.TestCase):
                                                             mock_buying_condition,
                                                             mock_profit_loss_reached,
                                                             mock_get_open_positions,
-                                                            mock_calculate_rolling_average,
-                                                            mock_get_stock_data,
-                                                            mock_trading_client,
-                                                            mock_stock_client,
-                                                            mock_get_secret):
+                                                            mock_get_close_average,
+                                                            mock_order_ledger,
+                                                            mock_get_clients):
 
         # Mocking return values and behaviors
         context = MagicMock()
 
-        secret = {
-            "alpaca_api_key": "fake_api_key",
-            "alpaca_secret_key": "fake_secret_key"
-        }
-        mock_get_secret.return_value = secret
-
-        alpaca_api_key = secret['alpaca_api_key']
-        alpaca_secret_key = secret['alpaca_secret_key']
+        mock_stock_client = MagicMock()
+        mock_trading_client = MagicMock()
+        mock_get_clients.return_value = (mock_stock_client, mock_trading_client)
+        order_ledger = mock_order_ledger.load.return_value.update.return_value
+        order_ledger.realized_pl = 0
+        order_ledger.get_open_orders.return_value = []
 
         last_average = rolling_average_values.iloc[-1]
         last_price = stock_data_df['close'].iloc[-1]
 
-        mock_get_stock_data.return_value = stock_data_df
-
-        mock_calculate_rolling_average.return_value = rolling_average_values
+        mock_get_close_average.return_value = (last_average, last_price)
 
         position = MagicMock()
         position.unrealized_pl = 1
@@ -221,23 +201,15 @@ class TestTradeRun(unittest.TestCase):
         # Run the function
         trade_run_result = start_trade_run(payload.event, context)
 
-        # Test get secret
-        mock_get_secret.assert_called_once()
-
-        # Test setup stock clients
-        mock_stock_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
-        mock_trading_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
+        # Test cached clients retrieved
+        mock_get_clients.assert_called_once()
 
         # Test check open positions for PnL
-        mock_get_open_positions.assert_called_once_with(mock_trading_client.return_value, 'AAPL')
-        mock_profit_loss_reached.assert_not_called()
+        mock_get_open_positions.assert_called_once_with(mock_trading_client, 'AAPL')
+        mock_profit_loss_reached.assert_called_once_with(10, -10, 0)
 
         # Test evaluate buy/sell conditions
-        mock_get_stock_data.assert_called_once_with(mock_stock_client.return_value, 'AAPL', 5, 16)
-        pd_testing.assert_series_equal(mock_calculate_rolling_average.call_args[0][0], stock_data_df[
-            'close'])  # checking calculate_rolling_average called with close prices in stock data df
-        self.assertEqual(mock_calculate_rolling_average.call_args[0][1], len(stock_data_df))
-        mock_calculate_rolling_average.assert_called_once_with(stock_data_df['close'], len(stock_data_df))
+        mock_get_close_average.assert_called_once_with(mock_stock_client, 'AAPL', 5, 16, ANY, shared_cache=ANY)
 
         mock_buying_condition.assert_called_once_with(last_average, last_price)
         mock_buy_stock.assert_not_called()
@@ -249,7 +221,8 @@ class TestTradeRun(unittest.TestCase):
         # Test trade run result correct
         self.assertEqual(trade_run_result, {
             "cancelTradeJob": 0,
-            "runCount": 1
+            "runCount": 1,
+            "snapshot": "snapshot"
         })
 
     def test_start_trade_run_with_selling_price_no_position(self,
@@ -259,30 +232,24 @@ class TestTradeRun(unittest.TestCase):
                                                             mock_buying_condition,
                                                             mock_profit_loss_reached,
                                                             mock_get_open_positions,
-                                                            mock_calculate_rolling_average,
-                                                            mock_get_stock_data,
-                                                            mock_trading_client,
-                                                            mock_stock_client,
-                                                            mock_get_secret):
+                                                            mock_get_close_average,
+                                                            mock_order_ledger,
+                                                            mock_get_clients):
 
         # Mocking return values and behaviors
         context = MagicMock()
 
-        secret = {
-            "alpaca_api_key": "fake_api_key",
-            "alpaca_secret_key": "fake_secret_key"
-        }
-        mock_get_secret.return_value = secret
-
-        alpaca_api_key = secret['alpaca_api_key']
-        alpaca_secret_key = secret['alpaca_secret_key']
+        mock_stock_client = MagicMock()
+        mock_trading_client = MagicMock()
+        mock_get_clients.return_value = (mock_stock_client, mock_trading_client)
+        order_ledger = mock_order_ledger.load.return_value.update.return_value
+        order_ledger.realized_pl = 0
+        order_ledger.get_open_orders.return_value = []
 
         last_average = rolling_average_values.iloc[-1]
         last_price = stock_data_df['close'].iloc[-1]
 
-        mock_get_stock_data.return_value = stock_data_df
-
-        mock_calculate_rolling_average.return_value = rolling_average_values
+        mock_get_close_average.return_value = (last_average, last_price)
 
         position = MagicMock()
         position.unrealized_pl = 1
@@ -299,23 +266,15 @@ class TestTradeRun(unittest.TestCase):
         # Run the function
         trade_run_result = start_trade_run(payload.event, context)
 
-        # Test get secret
-        mock_get_secret.assert_called_once()
-
-        # Test setup stock clients
-        mock_stock_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
-        mock_trading_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
+        # Test cached clients retrieved
+        mock_get_clients.assert_called_once()
 
         # Test check open positions for PnL
-        mock_get_open_positions.assert_called_once_with(mock_trading_client.return_value, 'AAPL')
-        mock_profit_loss_reached.assert_not_called()
+        mock_get_open_positions.assert_called_once_with(mock_trading_client, 'AAPL')
+        mock_profit_loss_reached.assert_called_once_with(10, -10, 0)
 
         # Test evaluate buy/sell conditions
-        mock_get_stock_data.assert_called_once_with(mock_stock_client.return_value, 'AAPL', 5, 16)
-        pd_testing.assert_series_equal(mock_calculate_rolling_average.call_args[0][0], stock_data_df[
-            'close'])  # checking calculate_rolling_average called with close prices in stock data df
-        self.assertEqual(mock_calculate_rolling_average.call_args[0][1], len(stock_data_df))
-        mock_calculate_rolling_average.assert_called_once_with(stock_data_df['close'], len(stock_data_df))
+        mock_get_close_average.assert_called_once_with(mock_stock_client, 'AAPL', 5, 16, ANY, shared_cache=ANY)
 
         mock_buying_condition.assert_called_once_with(last_average, last_price)
         mock_buy_stock.assert_not_called()
@@ -327,7 +286,8 @@ class TestTradeRun(unittest.TestCase):
         # Test trade run result correct
         self.assertEqual(trade_run_result, {
             "cancelTradeJob": 0,
-            "runCount": 1
+            "runCount": 1,
+            "snapshot": "snapshot"
         })
 
     def test_start_trade_run_max_run_count_reached(self,
@@ -337,30 +297,24 @@ class TestTradeRun(unittest.TestCase):
                                                    mock_buying_condition,
                                                    mock_profit_loss_reached,
                                                    mock_get_open_positions,
-                                                   mock_calculate_rolling_average,
-                                                   mock_get_stock_data,
-                                                   mock_trading_client,
-                                                   mock_stock_client,
-                                                   mock_get_secret):
+                                                   mock_get_close_average,
+                                                   mock_order_ledger,
+                                                   mock_get_clients):
 
         # Mocking return values and behaviors
         context = MagicMock()
 
-        secret = {
-            "alpaca_api_key": "fake_api_key",
-            "alpaca_secret_key": "fake_secret_key"
-        }
-        mock_get_secret.return_value = secret
-
-        alpaca_api_key = secret['alpaca_api_key']
-        alpaca_secret_key = secret['alpaca_secret_key']
+        mock_stock_client = MagicMock()
+        mock_trading_client = MagicMock()
+        mock_get_clients.return_value = (mock_stock_client, mock_trading_client)
+        order_ledger = mock_order_ledger.load.return_value.update.return_value
+        order_ledger.realized_pl = 0
+        order_ledger.get_open_orders.return_value = []
 
         last_average = rolling_average_values.iloc[-1]
         last_price = stock_data_df['close'].iloc[-1]
 
-        mock_get_stock_data.return_value = stock_data_df
-
-        mock_calculate_rolling_average.return_value = rolling_average_values
+        mock_get_close_average.return_value = (last_average, last_price)
 
         position = MagicMock()
         position.unrealized_pl = 1
@@ -377,23 +331,15 @@ class TestTradeRun(unittest.TestCase):
         # Run the function
         trade_run_result = start_trade_run(payload.event, context)
 
-        # Test get secret
-        mock_get_secret.assert_called_once()
-
-        # Test setup stock clients
-        mock_stock_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
-        mock_trading_client.assert_called_once_with(alpaca_api_key, alpaca_secret_key)
+        # Test cached clients retrieved
+        mock_get_clients.assert_called_once()
 
         # Test check open positions for PnL
-        mock_get_open_positions.assert_called_once_with(mock_trading_client.return_value, 'AAPL')
-        mock_profit_loss_reached.assert_not_called()
+        mock_get_open_positions.assert_called_once_with(mock_trading_client, 'AAPL')
+        mock_profit_loss_reached.assert_called_once_with(10, -10, 0)
 
         # Test evaluate buy/sell conditions
-        mock_get_stock_data.assert_called_once_with(mock_stock_client.return_value, 'AAPL', 5, 16)
-        pd_testing.assert_series_equal(mock_calculate_rolling_average.call_args[0][0], stock_data_df[
-            'close'])  # checking calculate_rolling_average called with close prices in stock data df
-        self.assertEqual(mock_calculate_rolling_average.call_args[0][1], len(stock_data_df))
-        mock_calculate_rolling_average.assert_called_once_with(stock_data_df['close'], len(stock_data_df))
+        mock_get_close_average.assert_called_once_with(mock_stock_client, 'AAPL', 5, 16, ANY, shared_cache=ANY)
 
         mock_buying_condition.assert_called_once_with(last_average, last_price)
         mock_buy_stock.assert_not_called()
@@ -403,11 +349,324 @@ class TestTradeRun(unittest.TestCase):
         mock_increment_run_count.assert_called_once_with(1)
 
         # Test trade run result correct
+        self.assertEqual(trade_run_result, {
+            "cancelTradeJob": 1,
+            "runCount": 3,
+            "snapshot": "snapshot"
+        })
+
+    @patch("trade_job.src.trade_run.close_positions_by_percentage")
+    def test_start_trade_run_does_not_buy_on_final_run(self,
+                                                       mock_close_positions_by_percentage,
+                                                       mock_increment_run_count,
+                                                       mock_buy_stock,
+                                                       mock_selling_condition,
+                                                       mock_buying_condition,
+                                                       mock_profit_loss_reached,
+                                                       mock_get_open_positions,
+                                                       mock_get_close_average,
+                                                       mock_order_ledger,
+                                                       mock_get_clients):
+        mock_trading_client = MagicMock()
+        mock_get_clients.return_value = (MagicMock(), mock_trading_client)
+        order_ledger = mock_order_ledger.load.return_value.update.return_value
+        order_ledger.realized_pl = 0
+        order_ledger.get_open_orders.return_value = []
+        mock_get_close_average.return_value = (rolling_average_values.iloc[-1], stock_data_df['close'].iloc[-1])
+        position = MagicMock()
+        position.unrealized_pl = 1
+        mock_get_open_positions.return_value = position
+        mock_profit_loss_reached.return_value = False
+        mock_buying_condition.return_value = True
+        mock_increment_run_count.return_value = 3
+
+        trade_run_result = start_trade_run(payload.event, MagicMock())
+
+        # The position the run started with is closed and no new buy is left behind
+        mock_buy_stock.assert_not_called()
+        mock_close_positions_by_percentage.assert_called_once_with(mock_trading_client, 'AAPL', '100', position, ANY)
+        self.assertEqual(trade_run_result["cancelTradeJob"], 1)
+
+    @patch("trade_job.src.trade_run.close_positions_by_percentage")
+    def test_start_trade_run_sells_once_on_final_run(self,
+                                                     mock_close_positions_by_percentage,
+                                                     mock_increment_run_count,
+                                                     mock_buy_stock,
+                                                     mock_selling_condition,
+                                                     mock_buying_condition,
+                                                     mock_profit_loss_reached,
+                                                     mock_get_open_positions,
+                                                     mock_get_close_average,
+                                                     mock_order_ledger,
+                                                     mock_get_clients):
+        mock_trading_client = MagicMock()
+        mock_get_clients.return_value = (MagicMock(), mock_trading_client)
+        order_ledger = mock_order_ledger.load.return_value.update.return_value
+        order_ledger.realized_pl = 0
+        open_buy_orders = [{"id": "buy-1", "side": "buy"}, {"id": "buy-2", "side": "buy"}]
+        order_ledger.get_open_orders.side_effect = lambda side=None: open_buy_orders if side == "buy" else []
+        mock_get_close_average.return_value = (rolling_average_values.iloc[-1], stock_data_df['close'].iloc[-1])
+        position = MagicMock()
+        position.unrealized_pl = 1
+        mock_get_open_positions.return_value = position
+        mock_profit_loss_reached.return_value = False
+        mock_buying_condition.return_value = False
+        mock_selling_condition.return_value = True
+        mock_increment_run_count.return_value = 3
+
+        trade_run_result = start_trade_run(payload.event, MagicMock())
+
+        # The sell has already cancelled the buy orders and closed the position, so the final run does not repeat it
+        self.assertEqual(mock_trading_client.cancel_order_by_id.call_count, 2)
+        mock_close_positions_by_percentage.assert_called_once_with(mock_trading_client, 'AAPL', '100', position, ANY)
+        self.assertEqual(trade_run_result["cancelTradeJob"], 1)
+
+    @patch("trade_job.src.trade_run.invalidate_clients")
+    def test_start_trade_run_refreshes_clients_on_auth_error(self,
+                                                             mock_invalidate_clients,
+                                                             mock_increment_run_count,
+                                                             mock_buy_stock,
+                                                             mock_selling_condition,
+                                                             mock_buying_condition,
+                                                             mock_profit_loss_reached,
+                                                             mock_get_open_positions,
+                                                             mock_get_close_average,
+                                                             mock_order_ledger,
+                                                             mock_get_clients):
+        context = MagicMock()
+
+        mock_stock_client = MagicMock()
+        mock_trading_client = MagicMock()
+        mock_get_clients.return_value = (mock_stock_client, mock_trading_client)
+
+        http_error = MagicMock()
+        http_error.response.status_code = 401
+        order_ledger = MagicMock()
+        order_ledger.realized_pl = 0
+        order_ledger.get_open_orders.return_value = []
+        mock_order_ledger.load.return_value.update.side_effect = [APIError("unauthorized", http_error), order_ledger]
+
+        mock_get_close_average.return_value = (rolling_average_values.iloc[-1], stock_data_df['close'].iloc[-1])
+        mock_get_open_positions.return_value = False
+        mock_profit_loss_reached.return_value = False
+        mock_buying_condition.return_value = False
+        mock_selling_condition.return_value = False
+        mock_increment_run_count.return_value = 2
+
+        trade_run_result = start_trade_run(payload.event, context)
+
+        mock_invalidate_clients.assert_called_once()
+        self.assertEqual(mock_get_clients.call_count, 2)
+        self.assertEqual(mock_order_ledger.load.return_value.update.call_count, 2)
+        self.assertEqual(trade_run_result, {
+            "cancelTradeJob": 0,
+            "runCount": 2,
+            "snapshot": "snapshot"
+        })
+
+
+@patch("trade_job.src.trade_run.get_clients")
+@patch("trade_job.src.trade_run.OrderLedger")
+@patch("trade_job.src.trade_run.get_stock_data")
+@patch("trade_job.src.trade_run.buy_stock")
+@patch("trade_job.src.trade_run.close_positions_by_percentage")
+@patch("trade_job.src.trade_run.cancel_orders")
+class TestBatchTradeRun(unittest.TestCase):
+    def setUp(self):
+        self.event = {
+            "jobParameters": {
+                "windowLength": 5,
+                "symbols": ["AAPL", "MSFT", "TSLA"],
+                "maxRuns": 3,
+                "offsetTime": 16,
+                "stopLoss": -10,
+                "takeProfit": 10
+            },
+            "jobInfo": "2024-08-02T21:02:44.952Z",
+            "jobStatus": {
+                "cancelTradeJob": 0,
+                "runCount": 1
+            }
+        }
+        self.stock_client = MagicMock()
+        self.trading_client = MagicMock()
+        self.trading_client.get_all_positions.return_value = [
+            MagicMock(symbol="MSFT", unrealized_pl="1.5"),
+            MagicMock(symbol="TSLA", unrealized_pl="-0.5")
+        ]
+        self.order_ledger = MagicMock()
+        self.order_ledger.realized_pl = 0
+        self.order_ledger.get_open_orders.return_value = []
+
+    def test_start_batch_trade_run_submits_orders_from_one_bars_request(self,
+                                                                       mock_cancel_orders,
+                                                                       mock_close_positions_by_percentage,
+                                                                       mock_buy_stock,
+                                                                       mock_get_stock_data,
+                                                                       mock_order_ledger,
+                                                                       mock_get_clients):
+        mock_get_clients.return_value = (self.stock_client, self.trading_client)
+        mock_order_ledger.load.return_value.update.return_value = self.order_ledger
+        mock_get_stock_data.return_value = multi_symbol_stock_data_df
+
+        trade_run_result = start_batch_trade_run(self.event, MagicMock())
+
+        mock_order_ledger.load.assert_called_once_with(ANY, ["AAPL", "MSFT", "TSLA"], "2024-08-02T21:02:44.952Z")
+        mock_get_stock_data.assert_called_once_with(self.stock_client, ["AAPL", "MSFT", "TSLA"], 5, 16,
+                                                    bar_store=ANY, shared_cache=ANY)
+        self.trading_client.get_all_positions.assert_called_once()
+        mock_buy_stock.assert_called_once_with(self.trading_client, "AAPL", ANY)
+        mock_close_positions_by_percentage.assert_called_once_with(self.trading_client, "MSFT", "100", ANY, ANY)
+        self.assertEqual(trade_run_result, {
+            "cancelTradeJob": 0,
+            "runCount": 2
+        })
+
+    def test_start_batch_trade_run_profit_loss_limit_closes_all_positions(self,
+                                                                         mock_cancel_orders,
+                                                                         mock_close_positions_by_percentage,
+                                                                         mock_buy_stock,
+                                                                         mock_get_stock_data,
+                                                                         mock_order_ledger,
+                                                                         mock_get_clients):
+        mock_get_clients.return_value = (self.stock_client, self.trading_client)
+        self.order_ledger.realized_pl = 10
+        mock_order_ledger.load.return_value.update.return_value = self.order_ledger
+
+        trade_run_result = start_batch_trade_run(self.event, MagicMock())
+
+        self.assertEqual(trade_run_result, {"cancelTradeJob": 1})
+        self.assertEqual(mock_close_positions_by_percentage.call_count, 2)
+        # The bars are fetched alongside the orders and positions, but nothing is bought once the limit is reached
+        mock_get_stock_data.assert_called_once()
+        mock_buy_stock.assert_not_called()
+
+    def test_start_batch_trade_run_max_run_count_reached(self,
+                                                         mock_cancel_orders,
+                                                         mock_close_positions_by_percentage,
+                                                         mock_buy_stock,
+                                                         mock_get_stock_data,
+                                                         mock_order_ledger,
+                                                         mock_get_clients):
+        mock_get_clients.return_value = (self.stock_client, self.trading_client)
+        mock_order_ledger.load.return_value.update.return_value = self.order_ledger
+        mock_get_stock_data.return_value = multi_symbol_stock_data_df
+        self.event["jobStatus"]["runCount"] = 2
+
+        trade_run_result = start_batch_trade_run(self.event, MagicMock())
+
+        closed_symbols = sorted(call.args[1] for call in mock_close_positions_by_percentage.call_args_list)
+        self.assertEqual(closed_symbols, ["MSFT", "TSLA"])
         self.assertEqual(trade_run_result, {
             "cancelTradeJob": 1,
             "runCount": 3
         })
 
 
+    def test_start_batch_trade_run_final_run_does_not_repeat_sells(self,
+                                                                  mock_cancel_orders,
+                                                                  mock_close_positions_by_percentage,
+                                                                  mock_buy_stock,
+                                                                  mock_get_stock_data,
+                                                                  mock_order_ledger,
+                                                                  mock_get_clients):
+        mock_get_clients.return_value = (self.stock_client, self.trading_client)
+        open_buy_orders = [{"id": "1", "symbol": "MSFT", "side": "buy"}, {"id": "2", "symbol": "TSLA", "side": "buy"}]
+        self.order_ledger.get_open_orders.side_effect = lambda side=None, symbol=None: [
+            order for order in open_buy_orders if side == "buy" and symbol in (None, order["symbol"])]
+        mock_order_ledger.load.return_value.update.return_value = self.order_ledger
+        mock_get_stock_data.return_value = multi_symbol_stock_data_df
+        self.event["jobStatus"]["runCount"] = 2
+
+        start_batch_trade_run(self.event, MagicMock())
+
+        # MSFT is sold by its sell signal, TSLA only by the final run
+        self.assertEqual([call.args[0] for call in mock_cancel_orders.call_args_list],
+                         [[open_buy_orders[0]], [open_buy_orders[1]]])
+        closed_symbols = sorted(call.args[1] for call in mock_close_positions_by_percentage.call_args_list)
+        self.assertEqual(closed_symbols, ["MSFT", "TSLA"])
+
+@patch("trade_job.src.trade_run.get_clients")
+@patch("trade_job.src.trade_run.OrderLedger")
+@patch("trade_job.src.trade_run.get_close_average")
+@patch("trade_job.src.trade_run.buy_stock")
+@patch("trade_job.src.trade_run.close_positions_by_percentage")
+class TestMultiplexedTradeRun(unittest.TestCase):
+    def setUp(self):
+        state_store_patcher = patch("trade_job.src.trade_run.state_store", InMemoryStateStore())
+        state_store_patcher.start()
+        self.addCleanup(state_store_patcher.stop)
+        snapshot_patcher = patch("trade_job.src.trade_run.snapshot_or_none", return_value="snapshot")
+        snapshot_patcher.start()
+        self.addCleanup(snapshot_patcher.stop)
+        self.event = {"jobs": [{
+            "jobParameters": {
+                "windowLength": 5,
+                "symbol": symbol,
+                "maxRuns": 3,
+                "offsetTime": 16,
+                "stopLoss": -10,
+                "takeProfit": 10
+            },
+            "jobInfo": "2024-08-02T21:02:44.952Z",
+            "jobStatus": {
+                "cancelTradeJob": 0,
+                "runCount": 1
+            }
+        } for symbol in ["AAPL", "MSFT", "TSLA"]]}
+        self.stock_client = MagicMock()
+        self.trading_client = MagicMock()
+        self.trading_client.get_all_positions.return_value = [MagicMock(symbol="MSFT", unrealized_pl="1.5")]
+        self.order_ledger = MagicMock()
+        self.order_ledger.realized_pl = 0
+        self.order_ledger.get_open_orders.return_value = []
+
+    def test_start_multiplexed_trade_run_shares_positions_request(self,
+                                                                  mock_close_positions_by_percentage,
+                                                                  mock_buy_stock,
+                                                                  mock_get_close_average,
+                                                                  mock_order_ledger,
+                                                                  mock_get_clients):
+        mock_get_clients.return_value = (self.stock_client, self.trading_client)
+        mock_order_ledger.load.return_value.update.return_value = self.order_ledger
+        last_prices = {"AAPL": (100, 101), "MSFT": (100, 99), "TSLA": (100, 100)}
+        mock_get_close_average.side_effect = lambda client, symbol, *args, **kwargs: last_prices[symbol]
+
+        trade_run_result = start_multiplexed_trade_run(self.event, MagicMock())
+
+        self.trading_client.get_all_positions.assert_called_once()
+        self.trading_client.get_open_position.assert_not_called()
+        mock_buy_stock.assert_called_once_with(ANY, "AAPL", ANY)
+        mock_close_positions_by_percentage.assert_called_once_with(ANY, "MSFT", "100", ANY, ANY)
+        self.assertEqual([job["jobParameters"]["symbol"] for job in trade_run_result["jobs"]], ["AAPL", "MSFT", "TSLA"])
+        self.assertEqual([job["jobStatus"] for job in trade_run_result["jobs"]],
+                         [{"cancelTradeJob": 0, "runCount": 2, "snapshot": "snapshot"}] * 3)
+
+    def test_start_multiplexed_trade_run_returns_failed_job_unchanged(self,
+                                                                      mock_close_positions_by_percentage,
+                                                                      mock_buy_stock,
+                                                                      mock_get_close_average,
+                                                                      mock_order_ledger,
+                                                                      mock_get_clients):
+        mock_get_clients.return_value = (self.stock_client, self.trading_client)
+        mock_order_ledger.load.return_value.update.return_value = self.order_ledger
+
+        def get_close_average(client, symbol, *args, **kwargs):
+            if symbol == "TSLA":
+                raise ConnectionError("reset")
+            return 100, 100
+
+        mock_get_close_average.side_effect = get_close_average
+
+        trade_run_result = start_multiplexed_trade_run(self.event, MagicMock())
+
+        failed_job = trade_run_result["jobs"][2]
+        self.assertEqual(failed_job["jobStatus"], {"cancelTradeJob": 0, "runCount": 1})
+        self.assertIn("reset", failed_job["error"])
+        self.assertNotIn("error", trade_run_result["jobs"][0])
+        self.assertEqual(trade_run_result["jobs"][0]["jobStatus"],
+                         {"cancelTradeJob": 0, "runCount": 2, "snapshot": "snapshot"})
+
+
 if __name__ == '__main__':
     unittest.main()
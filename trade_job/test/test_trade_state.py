@@ -0,0 +1,165 @@
+import unittest
+import sys
+import datetime
+from io import StringIO
+from unittest.mock import patch
+from alpaca.trading.requests import MarketOrderRequest
+from trade_job.src.broker_simulator import BrokerSimulator
+from trade_job.src.order_ledger import OrderLedger
+from trade_job.src.state_store import InMemoryStateStore
+from trade_job.src.trade_run import start_trade_run
+from trade_job.src.trade_state import TradeState, create_trade_state, start_trade_updates
+# trade_run imports its helpers as src.*, so the clock has to be set through that module
+from src.clock import use_clock
+from trade_job.test.data.fakes import BAR_START as START, make_bars
+
+JOB_START_TIME = "2024-08-02T13:30:00.000Z"
+
+
+def market_order(symbol, side, qty):
+    return MarketOrderRequest(symbol=symbol, qty=qty, side=side, time_in_force="day")
+
+
+class TestTradeState(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.now = [0.0]
+        self.simulator = BrokerSimulator(make_bars(), start=START + datetime.timedelta(minutes=10))
+        self.trade_state = TradeState(max_age=60, clock=lambda: self.now[0])
+        self.stream = self.simulator.trading_stream
+        start_trade_updates(self.stream, self.trade_state)
+
+    def tearDown(self):
+        self.stream.stop()
+        sys.stdout = self.held_stdout
+
+    def track(self):
+        ledger = OrderLedger("AAPL", JOB_START_TIME).update(self.simulator)
+        with use_clock(self.simulator.now):
+            self.trade_state.track("AAPL", JOB_START_TIME, ledger, None)
+
+    def test_updates_keep_ledger_and_position_in_step_with_the_broker(self):
+        self.track()
+
+        self.simulator.submit_order(market_order("AAPL", "buy", 3))
+        self.simulator.advance()
+        self.simulator.submit_order(market_order("AAPL", "sell", 1))
+        self.simulator.advance(2)
+        self.stream.join()
+
+        ledger = self.trade_state.ledger("AAPL", JOB_START_TIME)
+        expected = OrderLedger("AAPL", JOB_START_TIME).update(self.simulator)
+        self.assertEqual(ledger.to_state(), expected.to_state())
+        self.assertAlmostEqual(ledger.realized_pl, self.simulator.realized_pl)
+        position = self.trade_state.position("AAPL")
+        broker_position = self.simulator.get_open_position("AAPL")
+        self.assertEqual(position.qty, float(broker_position.qty))
+        self.assertAlmostEqual(position.cost_basis, float(broker_position.cost_basis))
+
+    def test_updates_from_before_tracking_are_replayed_once(self):
+        self.simulator.submit_order(market_order("AAPL", "buy", 2))
+        self.simulator.advance()
+        self.stream.join()
+
+        # The run read the ledger before the order was placed, the position after it filled
+        ledger = OrderLedger("AAPL", JOB_START_TIME)
+        with use_clock(self.simulator.now):
+            self.trade_state.track("AAPL", JOB_START_TIME, ledger, self.simulator.get_open_position("AAPL"))
+
+        self.assertEqual(self.trade_state.ledger("AAPL", JOB_START_TIME).positions["AAPL"]["qty"], 2)
+        self.assertEqual(ledger.open_orders, {})
+        self.assertEqual(self.trade_state.position("AAPL").qty, 2)
+
+    def test_position_is_valued_at_the_newest_price(self):
+        self.track()
+        self.simulator.submit_order(market_order("AAPL", "buy", 2))
+        self.simulator.advance()
+        self.stream.join()
+        fill_price = float(self.simulator.get_open_position("AAPL").cost_basis) / 2
+
+        self.trade_state.mark("AAPL", fill_price + 1, self.simulator.now().timestamp() + 60)
+        self.assertAlmostEqual(self.trade_state.position("AAPL").unrealized_pl, 2)
+        # A bar older than the fill does not move the price back
+        self.trade_state.mark("AAPL", fill_price - 1, 0)
+        self.assertAlmostEqual(self.trade_state.position("AAPL").unrealized_pl, 2)
+
+    def test_tracking_lapses_and_stops_with_the_stream(self):
+        self.track()
+        self.assertTrue(self.trade_state.is_tracking("AAPL", JOB_START_TIME))
+        self.assertFalse(self.trade_state.is_tracking("AAPL", "2024-08-03T13:30:00.000Z"))
+        self.assertIsNone(self.trade_state.position("AAPL"))
+
+        self.now[0] = 60
+        self.assertFalse(self.trade_state.is_tracking("AAPL", JOB_START_TIME))
+        self.assertEqual(self.trade_state.stats["lapsed"], 1)
+
+        self.track()
+        self.stream.stop()
+        self.trade_state.thread.join()
+        self.assertFalse(self.trade_state.is_tracking("AAPL", JOB_START_TIME))
+        # Nothing is tracked until a new stream is started
+        self.track()
+        self.assertFalse(self.trade_state.is_tracking("AAPL", JOB_START_TIME))
+
+    def test_create_trade_state_is_off_by_default(self):
+        self.assertIsNone(create_trade_state("0"))
+
+
+class TestTradeRunWithTradeUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.held_stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.held_stdout
+
+    def run_job(self, trade_updates):
+        simulator = BrokerSimulator(make_bars(), start=START + datetime.timedelta(minutes=45))
+        trade_state = start_trade_updates(simulator.trading_stream) if trade_updates else None
+        event = {
+            "jobParameters": {
+                "windowLength": 5,
+                "symbol": "AAPL",
+                "maxRuns": 60,
+                "offsetTime": 1,
+                "stopLoss": -1000,
+                "takeProfit": 1000
+            },
+            "jobInfo": JOB_START_TIME,
+            "jobStatus": {"cancelTradeJob": 0, "runCount": 0}
+        }
+        decisions = []
+        with patch("trade_job.src.trade_run.get_clients", return_value=simulator.clients()), use_clock(simulator.now):
+            with patch("trade_job.src.trade_run.state_store", InMemoryStateStore()):
+                with patch("trade_job.src.trade_run.shared_bar_cache", None):
+                    with patch("trade_job.src.trade_run.trade_state", trade_state):
+                        for _ in range(60):
+                            event["jobStatus"] = start_trade_run(event, None)
+                            decisions.append(event["jobStatus"])
+                            simulator.advance()
+                            simulator.trading_stream.join()
+        simulator.trading_stream.stop()
+        return simulator, decisions
+
+    def test_runs_read_orders_and_position_from_trade_updates(self):
+        rest, rest_decisions = self.run_job(trade_updates=False)
+        streamed, streamed_decisions = self.run_job(trade_updates=True)
+
+        # Only the first run reads the ledger and position over REST
+        self.assertEqual(streamed.requests["get_orders"], 1)
+        self.assertEqual(streamed.requests["get_open_position"], 1)
+        self.assertGreaterEqual(rest.requests["get_orders"], 60)
+        # The same orders are placed, with the same outcome, as when every run reads them over REST
+        self.assertEqual([status["runCount"] for status in streamed_decisions],
+                         [status["runCount"] for status in rest_decisions])
+        self.assertEqual([(order["side"], order["qty"], order["client_order_id"]) for order in streamed.orders.values()],
+                         [(order["side"], order["qty"], order["client_order_id"]) for order in rest.orders.values()])
+        self.assertNotEqual(streamed.realized_pl, 0)
+        self.assertAlmostEqual(streamed.realized_pl, rest.realized_pl)
+
+
+if __name__ == '__main__':
+    unittest.main()